@@ -1,15 +1,18 @@
 #!/usr/bin/env python3
 """AI-powered analysis and report generation for HubSpot audits"""
 
-import os
 import json
 import logging
-from typing import Dict, List
-from openai import OpenAI
+from typing import Dict, List, Optional
+from llm_governor import get_llm_governor
+
+# Items of each metrics list included in prompts
+PROMPT_LIST_SAMPLE = 10
 
 class AIAnalyzer:
     def __init__(self):
-        self.client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+        # All model calls go through the shared governor for budgets, retries and fallback
+        self.governor = get_llm_governor()
         
     def generate_comprehensive_report(self, audit_results: Dict) -> Dict:
         """Generate AI-enhanced comprehensive audit report"""
@@ -57,17 +60,46 @@ class AIAnalyzer:
                 summary['categories'][category] = {
                     'score': data.get('score', 0),
                     'grade': data.get('grade', 'F'),
-                    'metrics': data.get('metrics', {}),
+                    # Detail lists hold every user/property/workflow; a sample is enough for the prompt
+                    'metrics': {key: value[:PROMPT_LIST_SAMPLE] if isinstance(value, list) else value
+                                for key, value in data.get('metrics', {}).items()},
                     'critical_issues': data.get('critical_issues', []),
                     'recommendations': data.get('recommendations', [])
                 }
         
         return summary
     
+    def build_batch_requests(self, audit_results: Dict) -> Dict[str, Dict]:
+        """Chat completion requests for a report, keyed by the field they produce"""
+        summary_data = self._extract_summary_data(audit_results)
+        return {
+            'ai_summary': self._summary_request(summary_data),
+            'ai_recommendations': self._recommendations_request(summary_data),
+            'action_plan': self._action_plan_request(summary_data)
+        }
+    
+    def assemble_report(self, audit_results: Dict, outputs: Dict[str, Optional[str]]) -> Dict:
+        """Build the same report as generate_comprehensive_report from raw model outputs"""
+        summary_data = self._extract_summary_data(audit_results)
+        return {
+            'ai_summary': self._parse_summary(outputs.get('ai_summary'), summary_data),
+            'ai_recommendations': self._parse_recommendations(outputs.get('ai_recommendations'), summary_data),
+            'action_plan': self._parse_action_plan(outputs.get('action_plan')),
+            'executive_summary': self._generate_executive_summary(summary_data),
+            'risk_assessment': self._generate_risk_assessment(summary_data)
+        }
+    
     def _generate_ai_summary(self, data: Dict) -> str:
         """Generate AI-powered executive summary"""
-        # the newest OpenAI model is "gpt-4o" which was released May 13, 2024.
-        # do not change this unless explicitly requested by the user
+        try:
+            content = self.governor.complete(**self._summary_request(data))
+            return self._parse_summary(content, data)
+        except Exception as e:
+            logging.error(f"AI summary generation error: {str(e)}")
+            return "AI-generated summary temporarily unavailable."
+    
+    def _summary_request(self, data: Dict) -> Dict:
+        """Prompt and sampling settings for the executive summary"""
         prompt = f"""
         Based on this HubSpot Marketing Operations audit data, write a comprehensive executive summary.
         
@@ -85,20 +117,30 @@ class AIAnalyzer:
         Use a professional, consultative tone suitable for marketing executives.
         """
         
-        try:
-            response = self.client.chat.completions.create(
-                model="gpt-4o",
-                messages=[{"role": "user", "content": prompt}],
-                max_tokens=800,
-                temperature=0.7
-            )
-            return response.choices[0].message.content
-        except Exception as e:
-            logging.error(f"AI summary generation error: {str(e)}")
-            return "AI-generated summary temporarily unavailable."
+        return {
+            'messages': [{"role": "user", "content": prompt}],
+            'max_tokens': 800,
+            'temperature': 0.7
+        }
+    
+    def _parse_summary(self, content: Optional[str], data: Dict) -> str:
+        """Use the model's summary, or the deterministic templates when there is none"""
+        if content is None:
+            # Over budget or model unavailable - fall back to the deterministic templates
+            return f"{self._generate_executive_summary(data)} {self._generate_risk_assessment(data)}"
+        return content
     
     def _generate_strategic_recommendations(self, data: Dict) -> List[str]:
         """Generate strategic AI recommendations"""
+        try:
+            content = self.governor.complete(**self._recommendations_request(data))
+            return self._parse_recommendations(content, data)
+        except Exception as e:
+            logging.error(f"AI recommendations error: {str(e)}")
+            return ["Review audit findings and implement highest priority improvements"]
+    
+    def _recommendations_request(self, data: Dict) -> Dict:
+        """Prompt and sampling settings for strategic recommendations"""
         prompt = f"""
         Based on this HubSpot audit data, provide 5-7 strategic recommendations prioritized by impact.
         
@@ -113,23 +155,36 @@ class AIAnalyzer:
         Format as a JSON array of strings, each recommendation being actionable and specific.
         """
         
+        return {
+            'messages': [{"role": "user", "content": prompt}],
+            'response_format': {"type": "json_object"},
+            'max_tokens': 600,
+            'temperature': 0.6
+        }
+    
+    def _parse_recommendations(self, content: Optional[str], data: Dict) -> List[str]:
+        """Decode the recommendations JSON, falling back to the category recommendations"""
+        if content is None:
+            return self._collect_category_recommendations(data)
+        
         try:
-            response = self.client.chat.completions.create(
-                model="gpt-4o",
-                messages=[{"role": "user", "content": prompt}],
-                response_format={"type": "json_object"},
-                max_tokens=600,
-                temperature=0.6
-            )
-            
-            result = json.loads(response.choices[0].message.content)
+            result = json.loads(content)
             return result.get('recommendations', [])
         except Exception as e:
-            logging.error(f"AI recommendations error: {str(e)}")
+            logging.error(f"AI recommendations parse error: {str(e)}")
             return ["Review audit findings and implement highest priority improvements"]
     
     def _generate_action_plan(self, data: Dict) -> List[Dict]:
         """Generate prioritized action plan with timelines"""
+        try:
+            content = self.governor.complete(**self._action_plan_request(data))
+            return self._parse_action_plan(content)
+        except Exception as e:
+            logging.error(f"AI action plan error: {str(e)}")
+            return []
+    
+    def _action_plan_request(self, data: Dict) -> Dict:
+        """Prompt and sampling settings for the action plan"""
         prompt = f"""
         Create a prioritized action plan based on this HubSpot audit data.
         
@@ -145,21 +200,36 @@ class AIAnalyzer:
         Return as JSON array of objects with these fields.
         """
         
+        return {
+            'messages': [{"role": "user", "content": prompt}],
+            'response_format': {"type": "json_object"},
+            'max_tokens': 800,
+            'temperature': 0.5
+        }
+    
+    def _parse_action_plan(self, content: Optional[str]) -> List[Dict]:
+        """Decode the action plan JSON"""
+        if content is None:
+            return []
+        
         try:
-            response = self.client.chat.completions.create(
-                model="gpt-4o",
-                messages=[{"role": "user", "content": prompt}],
-                response_format={"type": "json_object"},
-                max_tokens=800,
-                temperature=0.5
-            )
-            
-            result = json.loads(response.choices[0].message.content)
+            result = json.loads(content)
             return result.get('action_plan', [])
         except Exception as e:
-            logging.error(f"AI action plan error: {str(e)}")
+            logging.error(f"AI action plan parse error: {str(e)}")
             return []
     
+    def _collect_category_recommendations(self, data: Dict) -> List[str]:
+        """Deterministic recommendations used when the model budget is exhausted"""
+        # Lowest-scoring categories first so the most urgent advice leads
+        categories = sorted(data.get('categories', {}).values(), key=lambda cat: cat.get('score') or 0)
+        recommendations = []
+        for cat_data in categories:
+            for recommendation in cat_data.get('recommendations', []):
+                if recommendation not in recommendations:
+                    recommendations.append(recommendation)
+        return recommendations[:7] or ["Review audit findings and implement highest priority improvements"]
+    
     def _generate_executive_summary(self, data: Dict) -> str:
         """Generate brief executive summary for dashboard"""
         overall_score = data.get('overall_score', 0)
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""Batch AI report generation for audits saved without AI enhancements"""
+
+import os
+import json
+import time
+import logging
+import tempfile
+from datetime import datetime
+from typing import List, Optional
+from openai import OpenAI
+from ai_analyzer import AIAnalyzer
+from models import AuditResult, AIBatchJob, db
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+
+# Provider states after which a batch will not change any more
+TERMINAL_STATUSES = {'completed', 'failed', 'expired', 'cancelled'}
+
+class AIBatchRunner:
+    """Collect report requests from many audits into one batch job and write results back.
+
+    The client honours OPENAI_BATCH_BASE_URL so the whole flow can be exercised
+    against a local stand-in batch server instead of the real provider.
+    """
+
+    def __init__(self, client: OpenAI = None):
+        self.client = client or OpenAI(
+            api_key=os.environ.get("OPENAI_API_KEY"),
+            base_url=os.environ.get("OPENAI_BATCH_BASE_URL") or None
+        )
+        self.analyzer = AIAnalyzer()
+        self.model = os.environ.get("OPENAI_BATCH_MODEL") or self.analyzer.governor.primary_model
+        self.max_audits = int(os.environ.get("AI_BATCH_MAX_AUDITS", "1000"))
+        self.completion_window = os.environ.get("AI_BATCH_COMPLETION_WINDOW", "24h")
+
+    def collect_pending(self, limit: int = None) -> List[AuditResult]:
+        """Audits that still need AI enhancements and are not already in a running batch"""
+        limit = limit or self.max_audits
+        in_flight = set()
+        for job in AIBatchJob.query.filter(AIBatchJob.status.in_(['pending', 'submitted'])).all():
+            in_flight.update(job.get_audit_ids())
+
+        pending = []
+        candidates = AuditResult.query.filter(AuditResult.ai_summary.is_(None)).order_by(AuditResult.id)
+        for audit in candidates.yield_per(200):
+            if audit.id in in_flight:
+                continue
+
+            results = audit.get_results_dict()
+            if results.get('ai_summary'):
+                # Enhanced interactively before the column existed - backfill and skip
+                audit.ai_summary = results['ai_summary']
+                audit.ai_recommendations = json.dumps(results.get('ai_recommendations', []))
+                continue
+
+            pending.append(audit)
+            if len(pending) >= limit:
+                break
+
+        db.session.commit()
+        return pending
+
+    def write_batch_file(self, audits: List[AuditResult], path: str) -> int:
+        """Write one JSONL line per chat completion request and return the count"""
+        count = 0
+        with open(path, 'w') as batch_file:
+            for audit in audits:
+                requests = self.analyzer.build_batch_requests(audit.get_results_dict())
+                for field, request_body in requests.items():
+                    body = dict(request_body)
+                    body['model'] = self.model
+                    batch_file.write(json.dumps({
+                        'custom_id': f"audit-{audit.id}:{field}",
+                        'method': 'POST',
+                        'url': BATCH_ENDPOINT,
+                        'body': body
+                    }) + "\n")
+                    count += 1
+        return count
+
+    def submit(self, limit: int = None) -> Optional[AIBatchJob]:
+        """Collect pending audits, upload the batch file and create the batch"""
+        audits = self.collect_pending(limit)
+        if not audits:
+            logging.info("No audits waiting for AI enhancements")
+            return None
+
+        job = AIBatchJob(status='pending')
+        job.set_audit_ids([audit.id for audit in audits])
+        db.session.add(job)
+        db.session.commit()
+
+        batch_path = None
+        try:
+            with tempfile.NamedTemporaryFile(prefix=f"ai-batch-{job.id}-", suffix=".jsonl", delete=False) as tmp:
+                batch_path = tmp.name
+            job.request_count = self.write_batch_file(audits, batch_path)
+
+            with open(batch_path, 'rb') as batch_file:
+                uploaded = self.client.files.create(file=batch_file, purpose="batch")
+            batch = self.client.batches.create(
+                input_file_id=uploaded.id,
+                endpoint=BATCH_ENDPOINT,
+                completion_window=self.completion_window,
+                metadata={'ai_batch_job_id': str(job.id)}
+            )
+
+            job.input_file_id = uploaded.id
+            job.provider_batch_id = batch.id
+            job.status = 'submitted'
+            db.session.commit()
+            logging.info(f"Submitted AI batch {batch.id} with {job.request_count} requests for {len(audits)} audits")
+            return job
+
+        except Exception as e:
+            logging.error(f"AI batch submit error: {str(e)}")
+            job.status = 'failed'
+            job.error_message = str(e)
+            job.completed_at = datetime.utcnow()
+            db.session.commit()
+            return job
+        finally:
+            if batch_path and os.path.exists(batch_path):
+                os.remove(batch_path)
+
+    def poll(self, job: AIBatchJob) -> AIBatchJob:
+        """Refresh one submitted batch and apply its results once it is finished"""
+        try:
+            batch = self.client.batches.retrieve(job.provider_batch_id)
+            logging.debug(f"AI batch {job.provider_batch_id} status: {batch.status}")
+            if batch.status not in TERMINAL_STATUSES:
+                return job
+
+            job.output_file_id = batch.output_file_id
+            job.error_file_id = batch.error_file_id
+            if batch.output_file_id:
+                # Expired batches can still carry partial output worth keeping
+                output_text = self.client.files.content(batch.output_file_id).text
+                job.completed_count = self.apply_results(output_text)
+
+            job.status = 'completed' if batch.status == 'completed' else 'failed'
+            if batch.status != 'completed':
+                job.error_message = f"Batch ended with status {batch.status}"
+            job.completed_at = datetime.utcnow()
+            db.session.commit()
+            return job
+
+        except Exception as e:
+            db.session.rollback()
+            logging.error(f"AI batch poll error for {job.provider_batch_id}: {str(e)}")
+            return job
+
+    def poll_all(self) -> List[AIBatchJob]:
+        """Poll every batch that is still running"""
+        jobs = AIBatchJob.query.filter_by(status='submitted').order_by(AIBatchJob.id).all()
+        return [self.poll(job) for job in jobs]
+
+    def wait(self, poll_interval: int = 60, timeout: int = None) -> List[AIBatchJob]:
+        """Poll until no batch is running or the timeout is reached"""
+        started = time.monotonic()
+        while True:
+            jobs = self.poll_all()
+            if not any(job.status == 'submitted' for job in jobs):
+                return jobs
+            if timeout and time.monotonic() - started > timeout:
+                logging.warning("Stopped waiting for AI batches before they finished")
+                return jobs
+            time.sleep(poll_interval)
+
+    def apply_results(self, output_text: str) -> int:
+        """Write batch outputs back onto their AuditResult rows and return how many were updated"""
+        outputs_by_audit = {}
+        for line in output_text.splitlines():
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            audit_id, field = self._parse_custom_id(record.get('custom_id', ''))
+            if audit_id is None:
+                continue
+
+            response = record.get('response') or {}
+            content = None
+            if response.get('status_code') == 200 and not record.get('error'):
+                choices = response.get('body', {}).get('choices', [])
+                content = choices[0]['message']['content'] if choices else None
+            outputs_by_audit.setdefault(audit_id, {})[field] = content
+
+        updated = 0
+        for audit_id, outputs in outputs_by_audit.items():
+            if any(content is None for content in outputs.values()):
+                # Leave the audit pending so the next batch retries it
+                logging.warning(f"AI batch output incomplete for audit {audit_id}")
+                continue
+
+            audit = db.session.get(AuditResult, audit_id)
+            if not audit:
+                continue
+
+            results = audit.get_results_dict()
+            report = self.analyzer.assemble_report(results, outputs)
+            results.update(report)
+            audit.set_results_dict(results)
+            audit.ai_summary = report['ai_summary']
+            audit.ai_recommendations = json.dumps(report['ai_recommendations'])
+            updated += 1
+
+        db.session.commit()
+        logging.info(f"Applied AI batch results to {updated} audits")
+        return updated
+
+    @staticmethod
+    def _parse_custom_id(custom_id: str):
+        """Split 'audit-<id>:<field>' back into its parts"""
+        try:
+            prefix, field = custom_id.split(':', 1)
+            return int(prefix.replace('audit-', '')), field
+        except ValueError:
+            logging.warning(f"Unexpected batch custom_id: {custom_id}")
+            return None, None
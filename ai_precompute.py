@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""Speculative AI report precomputation while the user reads the free preview"""
+
+import os
+import copy
+import time
+import uuid
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Dict, Optional
+
+class AIPrecomputer:
+    """Start AIAnalyzer work as soon as an audit finishes and hand it over on unlock.
+
+    Entries live in process memory keyed by an opaque audit key that is stored in
+    the user's session. When the unlock request lands on a different worker (or
+    after a restart) the key is simply not found and the caller generates inline.
+    """
+
+    def __init__(self, max_workers: int = None, ttl_seconds: int = None, wait_seconds: int = None):
+        self.max_workers = max_workers or int(os.environ.get("AI_PRECOMPUTE_WORKERS", "2"))
+        self.ttl_seconds = ttl_seconds or int(os.environ.get("AI_PRECOMPUTE_TTL", "1800"))
+        self.wait_seconds = wait_seconds or int(os.environ.get("AI_PRECOMPUTE_WAIT", "60"))
+        self.enabled = os.environ.get("AI_PRECOMPUTE_ENABLED", "true").lower() == "true"
+        self._executor = None
+        self._entries = {}  # audit_key -> (future, created_at)
+        self._lock = threading.Lock()
+
+    def start(self, audit_results: Dict) -> Optional[str]:
+        """Queue AI generation for a finished audit and return its audit key"""
+        if not self.enabled:
+            return None
+
+        try:
+            self.expire_stale()
+            audit_key = uuid.uuid4().hex
+            # Snapshot the results so later session edits can't race the worker thread
+            future = self._get_executor().submit(self._generate, copy.deepcopy(audit_results))
+            with self._lock:
+                self._entries[audit_key] = (future, time.time())
+            logging.debug(f"AI precompute started for audit key {audit_key}")
+            return audit_key
+        except Exception as e:
+            logging.error(f"AI precompute start error: {str(e)}")
+            return None
+
+    def get(self, audit_key: Optional[str]) -> Optional[Dict]:
+        """Return precomputed AI enhancements, waiting for in-flight work if needed"""
+        if not audit_key:
+            return None
+
+        with self._lock:
+            entry = self._entries.pop(audit_key, None)
+        if not entry:
+            logging.debug(f"AI precompute miss for audit key {audit_key}")
+            return None
+
+        future, created_at = entry
+        if time.time() - created_at > self.ttl_seconds:
+            future.cancel()
+            return None
+
+        try:
+            # Work already in flight will finish sooner than a fresh inline request
+            result = future.result(timeout=self.wait_seconds)
+            logging.debug(f"AI precompute hit for audit key {audit_key} (done={future.done()})")
+            return result
+        except FutureTimeoutError:
+            logging.warning(f"AI precompute timed out for audit key {audit_key}")
+            future.cancel()
+            return None
+        except Exception as e:
+            logging.error(f"AI precompute error for audit key {audit_key}: {str(e)}")
+            return None
+
+    def cancel(self, audit_key: Optional[str]):
+        """Drop a precomputation the user no longer needs"""
+        if not audit_key:
+            return
+
+        with self._lock:
+            entry = self._entries.pop(audit_key, None)
+        if entry:
+            # Only queued work can be cancelled; running calls finish and are discarded
+            entry[0].cancel()
+
+    def expire_stale(self):
+        """Cancel and forget entries that were never unlocked"""
+        cutoff = time.time() - self.ttl_seconds
+        with self._lock:
+            stale_keys = [key for key, (_, created_at) in self._entries.items() if created_at < cutoff]
+            stale_entries = [self._entries.pop(key) for key in stale_keys]
+
+        for future, _ in stale_entries:
+            future.cancel()
+        if stale_keys:
+            logging.debug(f"Expired {len(stale_keys)} unclaimed AI precomputations")
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        """Create the worker pool lazily so importing this module stays cheap"""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                    thread_name_prefix="ai-precompute")
+            return self._executor
+
+    def _generate(self, audit_results: Dict) -> Dict:
+        """Run the AI analysis in a worker thread"""
+        from ai_analyzer import AIAnalyzer
+        return AIAnalyzer().generate_comprehensive_report(audit_results)
+
+# Shared per-process instance used by the web routes
+ai_precomputer = AIPrecomputer()
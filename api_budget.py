@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+"""HubSpot API rate budget shared by every worker process of the app, split fairly between tenants"""
+
+import os
+import time
+import mmap
+import struct
+import random
+import hashlib
+import logging
+import threading
+from typing import Optional, Tuple
+
+# Calls per second and back-to-back burst for the whole app, and calls per UTC day (0: no daily limit)
+API_RATE = float(os.environ.get("API_BUDGET_RATE", "9"))
+API_BURST = float(os.environ.get("API_BUDGET_BURST", "10"))
+DAILY_LIMIT = int(os.environ.get("API_BUDGET_DAILY_LIMIT", "0"))
+# Tenants that made or waited for a call within this many seconds share the rate
+ACTIVE_SECONDS = 2
+# Tokens taken per database round trip, and how long unused ones may be kept
+LEASE_SIZE = int(os.environ.get("API_BUDGET_LEASE", "3"))
+LEASE_SECONDS = 1.0
+SHM_PATH = os.environ.get("API_BUDGET_SHM_PATH", "/dev/shm/hubspot-api-budget")
+SHM_SLOTS = 256
+CLEANUP_PROBABILITY = 0.001
+STORE_ERROR_RETRIES = 3
+
+class ApiBudgetExhausted(RuntimeError):
+    """The app's daily API limit is used up"""
+
+def tenant_key(access_token: Optional[str]) -> str:
+    """Fingerprint of a tenant's access token (tokens are never stored)"""
+    return hashlib.sha256((access_token or '').encode('utf-8')).hexdigest()[:16]
+
+def _utc_day(now: float) -> int:
+    return int(time.strftime('%Y%m%d', time.gmtime(now)))
+
+class _Conflict(Exception):
+    """The bucket changed between read and write"""
+
+def grant(app_tokens: float, app_updated: float, tenant_tokens: float, tenant_updated: float,
+          active_tenants: int, want: int, now: float, rate: float = None, burst: float = None):
+    """Refill both buckets and take up to want tokens from each.
+
+    Returns (granted, wait seconds before trying again, new app tokens, new tenant tokens).
+    """
+    rate = rate or API_RATE
+    burst = burst or API_BURST
+    share = max(active_tenants, 1)
+    tenant_rate = rate / share
+    tenant_burst = max(burst / share, 1.0)
+
+    app_tokens = min(burst, app_tokens + max(now - app_updated, 0) * rate)
+    tenant_tokens = min(tenant_burst, tenant_tokens + max(now - tenant_updated, 0) * tenant_rate)
+    granted = int(min(want, app_tokens, tenant_tokens))
+    if granted < 1:
+        wait = max((1 - app_tokens) / rate, (1 - tenant_tokens) / tenant_rate, 0.001)
+        return 0, wait, app_tokens, tenant_tokens
+    return granted, 0.0, app_tokens - granted, tenant_tokens - granted
+
+def _count_daily(day: Optional[int], day_count: int, granted: int, now: float) -> Tuple[int, int, int]:
+    """(day, new day count, granted) with granted cut to what is left of the daily limit"""
+    today = _utc_day(now)
+    day_count = day_count if day == today else 0
+    if DAILY_LIMIT:
+        granted = min(granted, DAILY_LIMIT - day_count)
+        if granted <= 0:
+            raise ApiBudgetExhausted(f"Daily HubSpot API limit of {DAILY_LIMIT} calls reached")
+    return today, day_count + granted, granted
+
+class DatabaseBudgetStore:
+    """Buckets in the api_budget_buckets table, shared by every process and host"""
+
+    def __init__(self, engine, table=None):
+        if table is None:
+            from models import ApiBudgetBucket
+            table = ApiBudgetBucket.__table__
+        self.engine = engine
+        self.table = table
+        self._known = set()
+
+    def _ensure_row(self, key: str):
+        if key in self._known:
+            return
+        from sqlalchemy import insert, select
+        from sqlalchemy.exc import IntegrityError
+        try:
+            with self.engine.begin() as connection:
+                if connection.execute(select(self.table.c.key).where(self.table.c.key == key)).first() is None:
+                    connection.execute(insert(self.table).values(key=key, tokens=0, updated_at=0, last_seen=0,
+                                                                 day_count=0, version=0))
+        except IntegrityError:
+            pass  # another process created it first
+        self._known.add(key)
+
+    def take(self, tenant: str, want: int, now: float) -> Tuple[int, float]:
+        try:
+            return self._take(tenant, want, now)
+        except _Conflict:
+            return 0, 0.005  # another process changed the bucket since we read it; try again shortly
+
+    def _take(self, tenant: str, want: int, now: float) -> Tuple[int, float]:
+        from sqlalchemy import select, update, delete, func
+        table = self.table
+        tenant_row_key = f"tenant:{tenant}"
+        self._ensure_row('app')
+        self._ensure_row(tenant_row_key)
+
+        with self.engine.begin() as connection:
+            # FOR UPDATE serializes takers on Postgres; the version check covers SQLite
+            app_row = connection.execute(select(table).where(table.c.key == 'app').with_for_update()).one()
+            tenant_row = connection.execute(select(table).where(table.c.key == tenant_row_key).with_for_update()).one()
+            others = connection.execute(
+                select(func.count()).select_from(table)
+                .where(table.c.key.like('tenant:%'), table.c.key != tenant_row_key,
+                       table.c.last_seen >= now - ACTIVE_SECONDS)
+            ).scalar()
+
+            granted, wait, app_tokens, tenant_tokens = grant(app_row.tokens, app_row.updated_at, tenant_row.tokens,
+                                                             tenant_row.updated_at, others + 1, want, now)
+            day, day_count = app_row.day, app_row.day_count
+            if granted:
+                day, day_count, counted = _count_daily(app_row.day, app_row.day_count, granted, now)
+                app_tokens += granted - counted
+                tenant_tokens += granted - counted
+                granted = counted
+
+            result = connection.execute(
+                update(table).where(table.c.key == 'app', table.c.version == app_row.version)
+                .values(tokens=app_tokens, updated_at=now, day=day, day_count=day_count, version=app_row.version + 1)
+            )
+            if result.rowcount != 1:
+                raise _Conflict()
+            connection.execute(update(table).where(table.c.key == tenant_row_key)
+                               .values(tokens=tenant_tokens, updated_at=now, last_seen=now))
+
+            if random.random() < CLEANUP_PROBABILITY:
+                connection.execute(delete(table).where(table.c.key.like('tenant:%'), table.c.last_seen < now - 86400))
+        return granted, wait
+
+class SharedMemoryBudgetStore:
+    """Buckets in a memory-mapped file, shared by the processes of one host.
+
+    Layout: the app bucket (tokens, refilled at, day, day count) followed by
+    SHM_SLOTS tenant slots (key, tokens, refilled at, last seen). A zero-filled
+    file is a full bucket, so the file needs no initialization.
+    """
+
+    HEADER = struct.Struct('<ddqq')
+    SLOT = struct.Struct('<Qddd')
+
+    def __init__(self, path: str = None):
+        self.path = path or SHM_PATH
+        self.size = self.HEADER.size + self.SLOT.size * SHM_SLOTS
+        self._pid = None
+        self._file = None
+        self._map = None
+        # flock() does not exclude threads sharing the file, so they also take this lock
+        self._thread_lock = threading.Lock()
+
+    def _open(self):
+        if self._pid == os.getpid():
+            return
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(fd).st_size < self.size:
+            os.ftruncate(fd, self.size)
+        self._file = fd
+        self._map = mmap.mmap(fd, self.size)
+        self._pid = os.getpid()  # reopened after a fork
+
+    def take(self, tenant: str, want: int, now: float) -> Tuple[int, float]:
+        import fcntl
+        key = int(tenant, 16) or 1
+        with self._thread_lock:
+            self._open()
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+            try:
+                app_tokens, app_updated, day, day_count = self.HEADER.unpack_from(self._map, 0)
+                slot, tenant_tokens, tenant_updated, active = None, 0.0, 0.0, 1
+                oldest, oldest_seen = 0, None
+                for index in range(SHM_SLOTS):
+                    slot_key, tokens, updated, last_seen = self.SLOT.unpack_from(self._map, self._slot_offset(index))
+                    if slot_key == key:
+                        slot, tenant_tokens, tenant_updated = index, tokens, updated
+                    elif slot_key and last_seen >= now - ACTIVE_SECONDS:
+                        active += 1
+                    if oldest_seen is None or last_seen < oldest_seen:
+                        oldest, oldest_seen = index, last_seen
+                if slot is None:
+                    slot = oldest  # a free slot or the one idle longest
+
+                granted, wait, app_tokens, tenant_tokens = grant(app_tokens, app_updated, tenant_tokens,
+                                                                 tenant_updated, active, want, now)
+                if granted:
+                    day, day_count, counted = _count_daily(day, day_count, granted, now)
+                    app_tokens += granted - counted
+                    tenant_tokens += granted - counted
+                    granted = counted
+                self.HEADER.pack_into(self._map, 0, app_tokens, now, day, day_count)
+                self.SLOT.pack_into(self._map, self._slot_offset(slot), key, tenant_tokens, now, now)
+            finally:
+                fcntl.flock(self._file, fcntl.LOCK_UN)
+        return granted, wait
+
+    def _slot_offset(self, index: int) -> int:
+        return self.HEADER.size + index * self.SLOT.size
+
+class ApiBudget:
+    """Rate limiter for HubSpotService: acquire(access_token) blocks until a call is allowed.
+
+    Tokens are taken from the shared store in small leases and handed out
+    locally until they run out or go stale. If the store itself fails the
+    call is let through, so an outage of the budget never stops audits.
+    """
+
+    def __init__(self, store, lease_size: int = None):
+        self.store = store
+        self.lease_size = max(lease_size or LEASE_SIZE, 1)
+        self._leases = {}  # tenant -> (tokens left, taken at)
+        self._lock = threading.Lock()
+
+    def acquire(self, access_token: Optional[str] = None):
+        tenant = tenant_key(access_token)
+        errors = 0
+        while True:
+            now = time.time()
+            with self._lock:
+                tokens, taken_at = self._leases.get(tenant, (0, 0.0))
+                if tokens > 0 and now - taken_at < LEASE_SECONDS:
+                    self._leases[tenant] = (tokens - 1, taken_at)
+                    return
+            try:
+                granted, wait = self.store.take(tenant, self.lease_size, now)
+                errors = 0
+            except ApiBudgetExhausted:
+                raise
+            except Exception as e:
+                # e.g. SQLite busy under contention: retry briefly before giving up on the budget
+                errors += 1
+                if errors >= STORE_ERROR_RETRIES:
+                    logging.warning(f"API budget unavailable, allowing call: {str(e)}")
+                    return
+                granted, wait = 0, 0.05
+            if granted:
+                with self._lock:
+                    self._leases[tenant] = (granted - 1, now)
+                return
+            # Small random extra so waiting processes do not all retry at the same instant
+            time.sleep(min(wait, 1.0) + random.uniform(0, 0.01))
+
+def budget_backend() -> str:
+    return os.environ.get("API_BUDGET_BACKEND", "database").lower()
+
+def install_api_budget(app):
+    """Share HubSpot's rate limit across processes unless API_BUDGET_BACKEND=off (call in an app context)"""
+    from hubspot_service import HubSpotService
+    from models import db
+    backend = budget_backend()
+    if backend == 'off':
+        return
+    if backend == 'shm':
+        budget = ApiBudget(SharedMemoryBudgetStore(), lease_size=1)
+    else:
+        budget = ApiBudget(DatabaseBudgetStore(db.engine))
+    HubSpotService.rate_limiter = budget
+    logging.info(f"Using {backend} HubSpot API budget ({API_RATE}/s, burst {API_BURST})")
+
+def standalone_api_budget() -> Optional[ApiBudget]:
+    """The shared budget for a process that does not load the Flask app (batch audit workers).
+
+    The database store gets its own engine and reflects the bucket table; None
+    with API_BUDGET_BACKEND=off.
+    """
+    backend = budget_backend()
+    if backend == 'off':
+        return None
+    if backend == 'shm':
+        return ApiBudget(SharedMemoryBudgetStore(), lease_size=1)
+    from sqlalchemy import MetaData, Table, create_engine
+    engine = create_engine(os.environ["DATABASE_URL"], pool_pre_ping=True)
+    return ApiBudget(DatabaseBudgetStore(engine, Table('api_budget_buckets', MetaData(), autoload_with=engine)))
@@ -27,16 +27,38 @@ app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
 }
 db.init_app(app)
 
+# Keep session data (including audit results) server-side instead of in the cookie
+from server_session import install_session_interface
+install_session_interface(app)
+
 # HubSpot OAuth configuration
 app.config['HUBSPOT_CLIENT_ID'] = os.environ.get("HUBSPOT_CLIENT_ID")
 app.config['HUBSPOT_CLIENT_SECRET'] = os.environ.get("HUBSPOT_CLIENT_SECRET")
 app.config['HUBSPOT_REDIRECT_URI'] = os.environ.get("HUBSPOT_REDIRECT_URI", "https://hubspotaudit.replit.app/oauth/callback")
 
+# Compile and validate the scoring rules once, so a broken rules file fails at startup
+from rules_engine import get_rules_engine
+get_rules_engine()
+
 # Create database tables
 with app.app_context():
     import models  # noqa: F401
-    db.create_all()
+    from db_migrations import auto_upgrade_enabled, upgrade_schema
+    if auto_upgrade_enabled():
+        upgrade_schema()
+    # Registers the listeners that keep percentile benchmarks current
+    from score_benchmarks import ensure_benchmarks
+    ensure_benchmarks()
+    # Every worker process draws HubSpot API calls from one shared budget
+    from api_budget import install_api_budget
+    install_api_budget(app)
+    # ... and counts OpenAI tokens against one shared daily budget
+    from llm_governor import install_llm_usage_store
+    install_llm_usage_store(app)
     logging.info("Database tables created")
 
 # Import routes after app creation to avoid circular imports
 from routes import *
+
+# Register Flask CLI commands
+import cli  # noqa: F401
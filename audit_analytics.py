@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""Cross-audit analytics over the normalized audit_category_metrics table"""
+
+from datetime import datetime
+from typing import Dict, List, Optional
+from sqlalchemy import func
+from models import AuditCategoryMetrics, AuditResult, db
+from rules_engine import RulesEngine
+
+def category_score_summary(since: Optional[datetime] = None, until: Optional[datetime] = None,
+                           portal_id: Optional[str] = None) -> List[Dict]:
+    """Average, min and max score per category for audits in a time range"""
+    query = (db.session.query(
+                AuditCategoryMetrics.category,
+                func.count(AuditCategoryMetrics.id),
+                func.avg(AuditCategoryMetrics.score),
+                func.min(AuditCategoryMetrics.score),
+                func.max(AuditCategoryMetrics.score))
+             .filter(AuditCategoryMetrics.score.isnot(None)))
+    if since:
+        query = query.filter(AuditCategoryMetrics.audit_timestamp >= since)
+    if until:
+        query = query.filter(AuditCategoryMetrics.audit_timestamp < until)
+    if portal_id:
+        query = query.filter(AuditCategoryMetrics.hubspot_portal_id == portal_id)
+
+    return [
+        {
+            'category': category,
+            'audits': count,
+            'average_score': round(average, 2) if average is not None else None,
+            'min_score': minimum,
+            'max_score': maximum
+        }
+        for category, count, average, minimum, maximum
+        in query.group_by(AuditCategoryMetrics.category).order_by(AuditCategoryMetrics.category)
+    ]
+
+def what_if_scores(engine: RulesEngine, since: Optional[datetime] = None,
+                   portal_id: Optional[str] = None) -> Dict:
+    """Re-score stored category metrics under another rule set, vectorized per category.
+
+    Returns per-category counts of changed scores/grades, and changed overall
+    grades against each audit's stored overall score.
+    """
+    import numpy as np
+
+    audit_index = {}
+    new_scores = {}
+    categories = []
+    for category, compiled in engine.categories.items():
+        metric_names = [metric.name for metric in compiled.metrics] + [adjustment.name for adjustment in compiled.adjustments]
+        columns = [getattr(AuditCategoryMetrics, name) for name in metric_names]
+        query = (db.session.query(AuditCategoryMetrics.audit_result_id, AuditCategoryMetrics.score, *columns)
+                 .filter(AuditCategoryMetrics.category == category,
+                         AuditCategoryMetrics.score.isnot(None)))
+        if since:
+            query = query.filter(AuditCategoryMetrics.audit_timestamp >= since)
+        if portal_id:
+            query = query.filter(AuditCategoryMetrics.hubspot_portal_id == portal_id)
+        rows = query.all()
+        if not rows:
+            continue
+
+        # None -> NaN; float conversion keeps the whole column in one array
+        table = np.array([[np.nan if value is None else value for value in row] for row in rows], dtype=float)
+        audit_ids = table[:, 0].astype(int)
+        old = table[:, 1]
+        new = engine.score_category_vectors(category, {name: table[:, 2 + i] for i, name in enumerate(metric_names)})
+        for audit_id in audit_ids:
+            audit_index.setdefault(int(audit_id), len(audit_index))
+        new_scores[category] = (audit_ids, old, new)
+        categories.append({
+            'category': category,
+            'audits': len(rows),
+            'changed_scores': int(np.count_nonzero(old != new)),
+            'changed_grades': int(np.count_nonzero(engine.grade_vectors(old) != engine.grade_vectors(new))),
+            'average_old': round(float(np.mean(old)), 2),
+            'average_new': round(float(np.nanmean(new)), 2) if np.any(~np.isnan(new)) else None
+        })
+
+    overall = {'audits': len(audit_index), 'changed_grades': 0, 'average_old': None, 'average_new': None}
+    if audit_index:
+        new_matrix = {}
+        for category, (audit_ids, _, new) in new_scores.items():
+            new_matrix[category] = np.full(len(audit_index), np.nan)
+            new_matrix[category][[audit_index[int(audit_id)] for audit_id in audit_ids]] = new
+        new_overall = engine.overall_score_vectors(new_matrix)
+
+        old_overall = np.zeros(len(audit_index))
+        audit_ids = list(audit_index)
+        for start in range(0, len(audit_ids), 500):
+            for audit_id, score in (db.session.query(AuditResult.id, AuditResult.overall_score)
+                                    .filter(AuditResult.id.in_(audit_ids[start:start + 500]))):
+                old_overall[audit_index[audit_id]] = score or 0
+        overall.update({
+            'changed_grades': int(np.count_nonzero(engine.grade_vectors(old_overall) != engine.grade_vectors(new_overall))),
+            'average_old': round(float(np.mean(old_overall)), 2),
+            'average_new': round(float(np.mean(new_overall)), 2)
+        })
+    return {'categories': categories, 'overall': overall}
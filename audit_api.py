@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""JSON payloads for the versioned audit API (/api/v1/audits/...), cached per process by content hash"""
+
+import os
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Tuple
+from results_codec import dumps
+
+PAYLOAD_CACHE_MAX_BYTES = int(float(os.environ.get("API_PAYLOAD_CACHE_MB", "32")) * 1024 * 1024)
+# ?fields= selections beyond these limits are rejected, so clients cannot fill the cache with variants
+MAX_FIELDS = 32
+MAX_FIELD_LENGTH = 128
+# Smaller bodies are sent uncompressed; gzip would barely shrink them
+GZIP_MIN_BYTES = 1024
+
+_cache = OrderedDict()  # (audit id, content hash, category, fields) -> EncodedPayload
+_cache_bytes = 0
+_cache_lock = threading.Lock()
+
+class EncodedPayload:
+    """Serialized payload with a strong ETag; the gzipped body is built on first use"""
+
+    def __init__(self, body: bytes):
+        self.body = body
+        self.etag = hashlib.sha256(body).hexdigest()
+        self._gzipped = None
+
+    @property
+    def cost(self) -> int:
+        """Bytes charged to the cache: the body plus room for its gzipped form"""
+        return 2 * len(self.body)
+
+    @property
+    def gzipped(self) -> bytes:
+        if self._gzipped is None:
+            # mtime=0 keeps the compressed bytes identical for identical payloads
+            self._gzipped = gzip.compress(self.body, compresslevel=6, mtime=0)
+        return self._gzipped
+
+def parse_fields(value: Optional[str]) -> Optional[Tuple[str, ...]]:
+    """?fields=overall_score,categories.admin.score -> sorted dotted paths (None selects everything).
+
+    Paths under another selected path are dropped, so equivalent selections share
+    one cache entry. ValueError for too many or too long paths.
+    """
+    if not value:
+        return None
+    paths = {path.strip() for path in value.split(',') if path.strip()}
+    if len(paths) > MAX_FIELDS or any(len(path) > MAX_FIELD_LENGTH for path in paths):
+        raise ValueError(f"At most {MAX_FIELDS} fields of up to {MAX_FIELD_LENGTH} characters")
+    paths = {path for path in paths
+             if not any('.'.join(path.split('.')[:depth]) in paths for depth in range(1, path.count('.') + 1))}
+    return tuple(sorted(paths)) or None
+
+def select_fields(payload: Dict, paths: Iterable[str]) -> Dict:
+    """Copy of payload with only the given dotted paths; paths that do not exist are left out"""
+    selected = {}
+    taken = set()
+    for path in sorted(paths):
+        parts = path.split('.')
+        if any('.'.join(parts[:depth]) in taken for depth in range(1, len(parts))):
+            continue  # a parent is already selected whole
+        source = payload
+        for part in parts[:-1]:
+            source = source.get(part) if isinstance(source, dict) else None
+        if not isinstance(source, dict) or parts[-1] not in source:
+            continue
+        target = selected
+        for part in parts[:-1]:
+            target = target.setdefault(part, {})
+        target[parts[-1]] = source[parts[-1]]
+        taken.add(path)
+    return selected
+
+def audit_payload(audit, results: Dict) -> Dict:
+    """Full API representation of a saved audit"""
+    categories = {key: value for key, value in results.items() if isinstance(value, dict) and 'score' in value}
+    return {
+        'id': audit.id,
+        'portal_id': audit.hubspot_portal_id,
+        'audit_timestamp': audit.audit_timestamp.isoformat() if audit.audit_timestamp else None,
+        'overall_score': results.get('overall_score'),
+        'overall_grade': results.get('overall_grade'),
+        'portal_info': results.get('portal_info') or {},
+        'categories': categories,
+        'ai': {key: results[key] for key in ('ai_summary', 'ai_recommendations', 'action_plan',
+                                             'executive_summary', 'risk_assessment') if key in results}
+    }
+
+def _build(audit, category: Optional[str], fields: Optional[Tuple[str, ...]]) -> EncodedPayload:
+    results = audit.get_results_dict()
+    if category is None:
+        payload = audit_payload(audit, results)
+    else:
+        data = results.get(category)
+        if not isinstance(data, dict) or 'score' not in data:
+            raise KeyError(category)
+        payload = dict(data, category=category, audit_id=audit.id)
+    if fields:
+        payload = select_fields(payload, fields)
+    return EncodedPayload(dumps(payload))
+
+def encoded_payload(audit, category: Optional[str] = None,
+                    fields: Optional[Tuple[str, ...]] = None) -> EncodedPayload:
+    """Cached payload of an audit (or one of its categories); KeyError for an unknown category"""
+    if not audit.content_hash:
+        return _build(audit, category, fields)  # legacy row without a hash to key on
+    key = (audit.id, audit.content_hash, category, fields)
+    with _cache_lock:
+        encoded = _cache.get(key)
+        if encoded is not None:
+            _cache.move_to_end(key)
+            return encoded
+    encoded = _build(audit, category, fields)
+    if encoded.cost > PAYLOAD_CACHE_MAX_BYTES:
+        return encoded
+    global _cache_bytes
+    with _cache_lock:
+        if key in _cache:
+            _cache_bytes -= _cache.pop(key).cost
+        _cache[key] = encoded
+        _cache_bytes += encoded.cost
+        while _cache_bytes > PAYLOAD_CACHE_MAX_BYTES:
+            _, evicted = _cache.popitem(last=False)
+            _cache_bytes -= evicted.cost
+    return encoded
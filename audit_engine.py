@@ -1,90 +1,166 @@
 import logging
-from typing import Dict, List
+from typing import Callable, Dict, List, Optional
 from hubspot_service import HubSpotService
+from api_budget import ApiBudgetExhausted
+from rules_engine import get_rules_engine
 
 class AuditEngine:
     """Engine for running HubSpot Marketing Operations audit"""
     
-    def __init__(self, hubspot_service: HubSpotService):
+    def __init__(self, hubspot_service: HubSpotService, progress_callback: Optional[Callable[[str, Dict], None]] = None):
         self.hubspot = hubspot_service
+        # Called as progress_callback(event, data) while the audit runs
+        self.progress_callback = progress_callback
+        self._current_category = None
+        if progress_callback:
+            self.hubspot.on_api_call = self._on_api_call
         
-        # Scoring thresholds for each category
-        self.scoring_thresholds = {
-            'admin': {
-                'excellent': {'users': (1, 10), 'super_admins': (1, 3), 'integrations': (3, float('inf'))},
-                'good': {'users': (11, 25), 'super_admins': (4, 5), 'integrations': (1, 2)},
-                'poor': {'users': (26, float('inf')), 'super_admins': (6, float('inf')), 'integrations': (0, 0)}
-            },
-            'properties': {
-                'excellent': {'unused_percentage': (0, 10)},
-                'good': {'unused_percentage': (11, 25)},
-                'poor': {'unused_percentage': (26, float('inf'))}
-            },
-            'workflows': {
-                'excellent': {'total': (5, float('inf')), 'inactive_percentage': (0, 10)},
-                'good': {'total': (2, 4), 'inactive_percentage': (11, 25)},
-                'poor': {'total': (0, 1), 'inactive_percentage': (26, float('inf'))}
-            },
-            'forms': {
-                'excellent': {'total': (3, float('inf')), 'unembedded_percentage': (0, 20)},
-                'good': {'total': (1, 2), 'unembedded_percentage': (21, 40)},
-                'poor': {'total': (0, 0), 'unembedded_percentage': (41, float('inf'))}
-            },
-            'reporting': {
-                'excellent': {'dashboards': (2, float('inf')), 'custom_reports': (1, float('inf'))},
-                'good': {'dashboards': (1, 1), 'custom_reports': (0, 0)},
-                'poor': {'dashboards': (0, 0), 'custom_reports': (0, 0)}
-            },
-            'sales': {
-                'excellent': {'pipelines': (2, float('inf')), 'unassigned_deals_percentage': (0, 5)},
-                'good': {'pipelines': (1, 1), 'unassigned_deals_percentage': (6, 15)},
-                'poor': {'pipelines': (0, 0), 'unassigned_deals_percentage': (16, float('inf'))}
-            }
-        }
+        # Categories in the order they are audited
+        self.categories = [
+            ('admin', self._audit_admin_setup),
+            ('properties', self._audit_properties),
+            ('workflows', self._audit_workflows),
+            ('forms', self._audit_forms),
+            ('reporting', self._audit_reporting),
+            ('sales', self._audit_sales)
+        ]
+        
+        # Compiled scoring rules (bands and weights from scoring_rules.json)
+        self.rules = get_rules_engine()
     
     def run_full_audit(self) -> Dict:
         """Run complete audit across all categories"""
         try:
-            audit_results = {
-                'admin': self._audit_admin_setup(),
-                'properties': self._audit_properties(),
-                'workflows': self._audit_workflows(),
-                'forms': self._audit_forms(),
-                'reporting': self._audit_reporting(),
-                'sales': self._audit_sales(),
-                'overall_score': 0,
-                'overall_grade': 'F'
-            }
-            
-            # Calculate overall score and grade (exclude None scores from failed permissions)
-            scores = [category['score'] for category in audit_results.values() 
-                     if isinstance(category, dict) and category.get('score') is not None]
-            if scores:
-                audit_results['overall_score'] = round(sum(scores) / len(scores), 1)
-                audit_results['overall_grade'] = self._score_to_grade(audit_results['overall_score'])
-            else:
-                audit_results['overall_score'] = 0
-                audit_results['overall_grade'] = 'F'
-            
-            return audit_results
-            
+            audit_results = {}
+            audit_results['portal_info'] = self._get_portal_info()
+            self._check_api_budget()
+            for category, audit_category in self.categories:
+                self._run_category(category, audit_category, audit_results)
+            return self._finish(audit_results)
+            
+        except ApiBudgetExhausted:
+            raise
+        except Exception as e:
+            logging.error(f"Audit engine error: {str(e)}")
+            return {}
+    
+    def run_categories(self, categories: List[str], previous_results: Dict) -> Dict:
+        """Re-audit only the given categories, keeping the others from previous_results"""
+        try:
+            audit_results = dict(previous_results)
+            for category, audit_category in self.categories:
+                if category in categories or category not in audit_results:
+                    self._run_category(category, audit_category, audit_results)
+            return self._finish(audit_results)
+            
+        except ApiBudgetExhausted:
+            raise
         except Exception as e:
             logging.error(f"Audit engine error: {str(e)}")
             return {}
     
+    def _run_category(self, category: str, audit_category: Callable[[], Dict], audit_results: Dict):
+        self._current_category = category
+        self._emit_progress('category_started', {'category': category})
+        audit_results[category] = audit_category()
+        self._check_api_budget()
+        self._emit_progress('category_finished', {
+            'category': category,
+            'score': audit_results[category].get('score'),
+            'grade': audit_results[category].get('grade'),
+            'card': self._category_card(audit_results[category])
+        })
+        self._current_category = None
+    
+    def _check_api_budget(self):
+        """Stop once HubSpot calls were refused by the API budget - the results would be empty"""
+        if getattr(self.hubspot, 'budget_error', None) is not None:
+            raise self.hubspot.budget_error
+    
+    def _finish(self, audit_results: Dict) -> Dict:
+        # Weighted overall score and grade (exclude None scores from failed permissions)
+        audit_results['overall_score'], audit_results['overall_grade'] = self.rules.overall_score({
+            category: audit_results[category].get('score') for category, _ in self.categories
+        })
+        
+        self._emit_progress('audit_finished', {
+            'overall_score': audit_results['overall_score'],
+            'overall_grade': audit_results['overall_grade']
+        })
+        return audit_results
+    
+    def _property_row(self, prop: Dict, potentially_unused: bool) -> Dict:
+        """Compact description of one custom property for the detailed lists"""
+        return {
+            'name': prop.get('name', ''),
+            'label': prop.get('label', ''),
+            'objectType': prop.get('objectType', ''),
+            'type': prop.get('type', ''),
+            'created': prop.get('createdAt', '').split('T')[0] if prop.get('createdAt') else 'Unknown',
+            'potentially_unused': potentially_unused
+        }
+    
+    def _get_portal_info(self) -> Dict:
+        """Identify the audited portal so saved audits can be grouped by portal"""
+        account = self.hubspot.get_account_info()
+        return {
+            'portalId': str(account['portalId']) if account.get('portalId') is not None else None,
+            'accountType': account.get('accountType'),
+            'timeZone': account.get('timeZone'),
+            'companyCurrency': account.get('companyCurrency'),
+            'uiDomain': account.get('uiDomain')
+        }
+    
+    def _fetched(self, category: str, resource: str, items: List) -> List:
+        """Report how many items a fetch returned and pass them through"""
+        self._emit_progress('items_fetched', {'category': category, 'resource': resource, 'count': len(items)})
+        return items
+    
+    def _on_api_call(self, endpoint: str, status_code: int):
+        """Relay HubSpot API calls made while a category is being audited"""
+        self._emit_progress('api_call', {
+            'category': self._current_category,
+            'endpoint': endpoint,
+            'status': status_code,
+            'api_calls': getattr(self.hubspot, 'api_call_count', 0)
+        })
+    
+    def _category_card(self, category_result: Dict) -> Dict:
+        """Compact view of a category result for live dashboard cards"""
+        metrics = category_result.get('metrics', {})
+        return {
+            'score': category_result.get('score'),
+            'grade': category_result.get('grade'),
+            'status': category_result.get('status'),
+            'message': category_result.get('message'),
+            # Detail lists are left out - the full dashboard renders them once the audit is done
+            'metrics': {key: value for key, value in metrics.items() if isinstance(value, (int, float, str))},
+            'critical_issues': category_result.get('critical_issues', []),
+            'recommendations': category_result.get('recommendations', [])
+        }
+    
+    def _emit_progress(self, event: str, data: Dict):
+        """Report audit progress without letting a listener failure stop the audit"""
+        if not self.progress_callback:
+            return
+        try:
+            self.progress_callback(event, data)
+        except Exception as e:
+            logging.error(f"Audit progress callback error: {str(e)}")
+    
     def _audit_admin_setup(self) -> Dict:
         """Audit admin and setup configuration"""
         try:
-            users = self.hubspot.get_users()
-            integrations = self.hubspot.get_integrations()
+            users = self._fetched('admin', 'users', self.hubspot.get_users())
+            integrations = self._fetched('admin', 'integrations', self.hubspot.get_integrations())
             
             total_users = len(users)
             super_admins = [user for user in users if user.get('superAdmin', False)]
             active_integrations = [integ for integ in integrations if integ.get('enabled', False)]
             
-            # Prepare detailed data for UI display
+            # Full lists; the dashboard pages through them (see detail_pages)
             users_list = []
-            for user in users[:20]:  # Limit to 20 users for display
+            for user in users:
                 users_list.append({
                     'firstName': user.get('firstName', ''),
                     'lastName': user.get('lastName', ''),
@@ -94,10 +170,11 @@ class AuditEngine:
                 })
             
             integrations_list = []
-            for integration in integrations[:15]:  # Limit to 15 integrations
+            for integration in integrations:
                 integrations_list.append({
                     'name': integration.get('name', 'Unknown Integration'),
                     'type': integration.get('integrationType', 'Unknown'),
+                    'enabled': integration.get('enabled', False),
                     'lastUpdated': integration.get('lastUpdated', '').split('T')[0] if integration.get('lastUpdated') else None
                 })
 
@@ -112,11 +189,11 @@ class AuditEngine:
                 'integrations_list': integrations_list
             }
             
-            score = self._calculate_admin_score(metrics)
+            score = self.rules.score_category('admin', metrics)
             
             return {
                 'score': score,
-                'grade': self._score_to_grade(score),
+                'grade': self.rules.grade(score),
                 'metrics': metrics,
                 'recommendations': self._get_admin_recommendations(metrics),
                 'critical_issues': self._get_admin_critical_issues(metrics)
@@ -129,9 +206,9 @@ class AuditEngine:
     def _audit_properties(self) -> Dict:
         """Audit custom properties usage"""
         try:
-            contact_props = self.hubspot.get_contact_properties()
-            company_props = self.hubspot.get_company_properties()
-            deal_props = self.hubspot.get_deal_properties()
+            contact_props = self._fetched('properties', 'contact_properties', self.hubspot.get_contact_properties())
+            company_props = self._fetched('properties', 'company_properties', self.hubspot.get_company_properties())
+            deal_props = self._fetched('properties', 'deal_properties', self.hubspot.get_deal_properties())
             
             logging.debug(f"Properties fetched - Contacts: {len(contact_props)}, Companies: {len(company_props)}, Deals: {len(deal_props)}")
             
@@ -171,6 +248,7 @@ class AuditEngine:
             
             total_custom = len(custom_properties)
             unused_count = len(unused_properties)
+            unused_ids = {id(prop) for prop in unused_properties}
             unused_percentage = (unused_count / total_custom * 100) if total_custom > 0 else 0
             
             # Better object type detection
@@ -187,17 +265,19 @@ class AuditEngine:
                 'company_properties': len(company_custom),
                 'deal_properties': len(deal_custom),
                 'potentially_redundant': 0,
+                'properties_list': [self._property_row(prop, id(prop) in unused_ids) for prop in custom_properties],
+                'unused_properties_list': [self._property_row(prop, True) for prop in unused_properties],
                 'similar_property_details': [
                     {'pattern': 'Assessment Properties', 'count': 5, 'examples': ['a_should_atsg', 'a_do_you_quarterly', 'a_have_tools']},
                     {'pattern': 'Service Properties', 'count': 3, 'examples': ['service_type_current', 'service_level_needed', 'service_manager']}
                 ] if len(custom_properties) > 20 else []
             }
             
-            score = self._calculate_properties_score(metrics)
+            score = self.rules.score_category('properties', metrics)
             
             return {
                 'score': score,
-                'grade': self._score_to_grade(score),
+                'grade': self.rules.grade(score),
                 'metrics': metrics,
                 'recommendations': self._get_properties_recommendations(metrics),
                 'critical_issues': self._get_properties_critical_issues(metrics)
@@ -215,7 +295,7 @@ class AuditEngine:
     def _audit_workflows(self) -> Dict:
         """Audit workflows configuration"""
         try:
-            workflows = self.hubspot.get_workflows()
+            workflows = self._fetched('workflows', 'workflows', self.hubspot.get_workflows())
             logging.debug(f"Workflows audit: {len(workflows)} workflows retrieved")
             
             total_workflows = len(workflows)
@@ -237,7 +317,7 @@ class AuditEngine:
                     'type': wf.get('type', 'workflow'),
                     'enabled': is_active,
                     'created_date': wf.get('createdAt', '').split('T')[0] if wf.get('createdAt') else 'Unknown',
-                    'actions': wf.get('actions', [])[:5]  # Limit to first 5 actions for display
+                    'actions': wf.get('actions', [])
                 }
                 workflows_details.append(workflow_detail)
                 
@@ -259,15 +339,15 @@ class AuditEngine:
                 'inactive_workflows': len(inactive_workflows),
                 'inactive_percentage': round(inactive_percentage, 1),
                 'potentially_redundant': len(potentially_redundant),
-                'inactive_workflow_details': [{'name': wf.get('name', 'Unknown'), 'type': wf.get('type', 'workflow')} for wf in inactive_workflows[:10]],
+                'inactive_workflow_details': [{'name': wf.get('name', 'Unknown'), 'type': wf.get('type', 'workflow')} for wf in inactive_workflows],
                 'workflows_details': workflows_details
             }
             
-            score = self._calculate_workflows_score(metrics)
+            score = self.rules.score_category('workflows', metrics)
             
             return {
                 'score': score,
-                'grade': self._score_to_grade(score),
+                'grade': self.rules.grade(score),
                 'metrics': metrics,
                 'recommendations': self._get_workflows_recommendations(metrics),
                 'critical_issues': self._get_workflows_critical_issues(metrics)
@@ -285,7 +365,7 @@ class AuditEngine:
     def _audit_forms(self) -> Dict:
         """Audit forms configuration with usage-based analysis"""
         try:
-            forms = self.hubspot.get_forms()
+            forms = self._fetched('forms', 'forms', self.hubspot.get_forms())
             logging.debug(f"Forms audit: {len(forms)} forms retrieved")
             
             total_forms = len(forms)
@@ -376,11 +456,11 @@ class AuditEngine:
                 'forms_details': forms_details
             }
             
-            score = self._calculate_forms_score(metrics)
+            score = self.rules.score_category('forms', metrics)
             
             return {
                 'score': score,
-                'grade': self._score_to_grade(score),
+                'grade': self.rules.grade(score),
                 'metrics': metrics,
                 'recommendations': self._get_forms_recommendations(metrics),
                 'critical_issues': self._get_forms_critical_issues(metrics)
@@ -393,8 +473,8 @@ class AuditEngine:
     def _audit_reporting(self) -> Dict:
         """Audit reporting setup"""
         try:
-            dashboards = self.hubspot.get_dashboards()
-            reports = self.hubspot.get_reports()
+            dashboards = self._fetched('reporting', 'dashboards', self.hubspot.get_dashboards())
+            reports = self._fetched('reporting', 'reports', self.hubspot.get_reports())
             
             total_dashboards = len(dashboards)
             total_reports = len(reports)
@@ -408,11 +488,11 @@ class AuditEngine:
                 'custom_reports': len(custom_reports)
             }
             
-            score = self._calculate_reporting_score(metrics)
+            score = self.rules.score_category('reporting', metrics)
             
             return {
                 'score': score,
-                'grade': self._score_to_grade(score),
+                'grade': self.rules.grade(score),
                 'metrics': metrics,
                 'recommendations': self._get_reporting_recommendations(metrics),
                 'critical_issues': self._get_reporting_critical_issues(metrics)
@@ -425,7 +505,7 @@ class AuditEngine:
     def _audit_sales(self) -> Dict:
         """Audit sales configuration"""
         try:
-            pipelines = self.hubspot.get_pipelines()
+            pipelines = self._fetched('sales', 'pipelines', self.hubspot.get_pipelines())
             
             total_pipelines = len(pipelines)
             
@@ -435,11 +515,11 @@ class AuditEngine:
                 'unassigned_deals_percentage': 5  # Placeholder - would calculate from actual deal data
             }
             
-            score = self._calculate_sales_score(metrics)
+            score = self.rules.score_category('sales', metrics)
             
             return {
                 'score': score,
-                'grade': self._score_to_grade(score),
+                'grade': self.rules.grade(score),
                 'metrics': metrics,
                 'recommendations': self._get_sales_recommendations(metrics),
                 'critical_issues': self._get_sales_critical_issues(metrics)
@@ -449,125 +529,6 @@ class AuditEngine:
             logging.error(f"Sales audit error: {str(e)}")
             return self._empty_category_result()
     
-    def _calculate_admin_score(self, metrics: Dict) -> float:
-        """Calculate score for admin category"""
-        users = metrics['total_users']
-        super_admins = metrics['super_admins_count']
-        integrations = metrics['active_integrations_count']
-        
-        thresholds = self.scoring_thresholds['admin']
-        
-        if (thresholds['excellent']['users'][0] <= users <= thresholds['excellent']['users'][1] and
-            thresholds['excellent']['super_admins'][0] <= super_admins <= thresholds['excellent']['super_admins'][1] and
-            integrations >= thresholds['excellent']['integrations'][0]):
-            return 5.0
-        elif (thresholds['good']['users'][0] <= users <= thresholds['good']['users'][1] and
-              thresholds['good']['super_admins'][0] <= super_admins <= thresholds['good']['super_admins'][1] and
-              thresholds['good']['integrations'][0] <= integrations <= thresholds['good']['integrations'][1]):
-            return 3.5
-        else:
-            return 2.0
-    
-    def _calculate_properties_score(self, metrics: Dict) -> float:
-        """Calculate score for properties category"""
-        unused_percentage = metrics['unused_percentage']
-        thresholds = self.scoring_thresholds['properties']
-        
-        if unused_percentage <= thresholds['excellent']['unused_percentage'][1]:
-            return 5.0
-        elif unused_percentage <= thresholds['good']['unused_percentage'][1]:
-            return 3.5
-        else:
-            return 2.0
-    
-    def _calculate_workflows_score(self, metrics: Dict) -> float:
-        """Calculate score for workflows category"""
-        total = metrics['total_workflows']
-        inactive_percentage = metrics['inactive_percentage']
-        thresholds = self.scoring_thresholds['workflows']
-        
-        if (total >= thresholds['excellent']['total'][0] and
-            inactive_percentage <= thresholds['excellent']['inactive_percentage'][1]):
-            return 5.0
-        elif (thresholds['good']['total'][0] <= total <= thresholds['good']['total'][1] and
-              inactive_percentage <= thresholds['good']['inactive_percentage'][1]):
-            return 3.5
-        else:
-            return 2.0
-    
-    def _calculate_forms_score(self, metrics: Dict) -> float:
-        """Calculate score for forms category with enhanced usage-based scoring"""
-        total = metrics['total_forms']
-        unembedded_percentage = metrics['unembedded_percentage']
-        unused_forms_percentage = metrics.get('unused_forms_percentage', 0)
-        
-        # Base score from traditional metrics
-        base_score = 2.0
-        if total >= 3 and unembedded_percentage <= 20:
-            base_score = 5.0
-        elif total >= 1 and unembedded_percentage <= 40:
-            base_score = 3.5
-        
-        # Adjust score based on actual usage (submissions)
-        usage_adjustment = 0
-        if unused_forms_percentage <= 20:  # 20% or less unused forms
-            usage_adjustment = 0.5
-        elif unused_forms_percentage <= 50:  # 21-50% unused forms
-            usage_adjustment = 0.0
-        else:  # 50%+ unused forms
-            usage_adjustment = -1.0
-        
-        # Adjust for field consolidation opportunities
-        common_fields_count = metrics.get('common_fields_count', 0)
-        if common_fields_count > 3:  # Many repeated fields indicate consolidation opportunity
-            usage_adjustment -= 0.3
-        
-        final_score = max(1.0, min(5.0, base_score + usage_adjustment))
-        return round(final_score, 1)
-    
-    def _calculate_reporting_score(self, metrics: Dict) -> float:
-        """Calculate score for reporting category"""
-        dashboards = metrics['total_dashboards']
-        custom_reports = metrics['custom_reports']
-        thresholds = self.scoring_thresholds['reporting']
-        
-        if (dashboards >= thresholds['excellent']['dashboards'][0] and
-            custom_reports >= thresholds['excellent']['custom_reports'][0]):
-            return 5.0
-        elif (dashboards >= thresholds['good']['dashboards'][0] and
-              custom_reports >= thresholds['good']['custom_reports'][0]):
-            return 3.5
-        else:
-            return 2.0
-    
-    def _calculate_sales_score(self, metrics: Dict) -> float:
-        """Calculate score for sales category"""
-        pipelines = metrics['total_pipelines']
-        unassigned_percentage = metrics['unassigned_deals_percentage']
-        thresholds = self.scoring_thresholds['sales']
-        
-        if (pipelines >= thresholds['excellent']['pipelines'][0] and
-            unassigned_percentage <= thresholds['excellent']['unassigned_deals_percentage'][1]):
-            return 5.0
-        elif (pipelines >= thresholds['good']['pipelines'][0] and
-              unassigned_percentage <= thresholds['good']['unassigned_deals_percentage'][1]):
-            return 3.5
-        else:
-            return 2.0
-    
-    def _score_to_grade(self, score: float) -> str:
-        """Convert numeric score to letter grade"""
-        if score >= 4.5:
-            return 'A'
-        elif score >= 3.5:
-            return 'B'
-        elif score >= 2.5:
-            return 'C'
-        elif score >= 1.5:
-            return 'D'
-        else:
-            return 'F'
-    
     def _get_admin_recommendations(self, metrics: Dict) -> List[str]:
         """Get recommendations for admin category"""
         recommendations = []
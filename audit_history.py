@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""Keyset-paginated audit history for a portal, read from the lightweight columns only"""
+
+import base64
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import tuple_
+from models import AuditResult, AuditCategoryMetrics, db
+
+MAX_PAGE_SIZE = 200
+
+def encode_cursor(audit_timestamp: datetime, audit_id: int) -> str:
+    """Opaque cursor pointing just past the given row"""
+    raw = f"{audit_timestamp.isoformat()}|{audit_id}"
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor: str) -> Optional[Tuple[datetime, int]]:
+    """Inverse of encode_cursor; None for a malformed cursor"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8')
+        timestamp, audit_id = raw.split('|', 1)
+        return datetime.fromisoformat(timestamp), int(audit_id)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+def portal_history(portal_id: str, limit: int = 50, cursor: Optional[Tuple[datetime, int]] = None,
+                   user_id: Optional[int] = None, include_categories: bool = False) -> Dict:
+    """Newest-first page of a portal's audits with score changes between consecutive audits.
+
+    Walks the (hubspot_portal_id, audit_timestamp, id) index from the cursor, so
+    the cost of a page does not grow with how far back the caller has paged.
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    query = (db.session.query(AuditResult.id, AuditResult.audit_timestamp,
+                              AuditResult.overall_score, AuditResult.overall_grade)
+             .filter(AuditResult.hubspot_portal_id == portal_id))
+    if user_id is not None:
+        query = query.filter(AuditResult.user_id == user_id)
+    if cursor:
+        query = query.filter(tuple_(AuditResult.audit_timestamp, AuditResult.id) < cursor)
+
+    # One extra row tells us whether there is another page and the change for the last item
+    rows = query.order_by(AuditResult.audit_timestamp.desc(), AuditResult.id.desc()).limit(limit + 1).all()
+    page = rows[:limit]
+
+    audits = []
+    for index, row in enumerate(page):
+        previous = rows[index + 1] if index + 1 < len(rows) else None
+        change = None
+        if previous and row.overall_score is not None and previous.overall_score is not None:
+            change = round(row.overall_score - previous.overall_score, 1)
+        audits.append({
+            'id': row.id,
+            'audit_timestamp': row.audit_timestamp.isoformat() if row.audit_timestamp else None,
+            'overall_score': row.overall_score,
+            'overall_grade': row.overall_grade,
+            'score_change': change
+        })
+
+    if include_categories and audits:
+        categories = _category_scores([audit['id'] for audit in audits])
+        for audit in audits:
+            audit['categories'] = categories.get(audit['id'], {})
+
+    next_cursor = None
+    if len(rows) > limit and page[-1].audit_timestamp:
+        next_cursor = encode_cursor(page[-1].audit_timestamp, page[-1].id)
+
+    return {
+        'portal_id': portal_id,
+        'audits': audits,
+        'next_cursor': next_cursor
+    }
+
+def _category_scores(audit_ids: List[int]) -> Dict[int, Dict]:
+    """Category score and grade per audit, from audit_category_metrics"""
+    rows = (db.session.query(AuditCategoryMetrics.audit_result_id, AuditCategoryMetrics.category,
+                             AuditCategoryMetrics.score, AuditCategoryMetrics.grade)
+            .filter(AuditCategoryMetrics.audit_result_id.in_(audit_ids)))
+    categories = {}
+    for audit_id, category, score, grade in rows:
+        categories.setdefault(audit_id, {})[category] = {'score': score, 'grade': grade}
+    return categories
@@ -0,0 +1,362 @@
+#!/usr/bin/env python3
+"""Database-backed audit job queue and the worker that drains it"""
+
+import os
+import json
+import time
+import uuid
+import socket
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+from sqlalchemy import update
+from api_budget import ApiBudgetExhausted
+from models import AuditJob, db
+from progress_events import progress_broker, format_sse
+from snapshot_store import run_recorded_audit
+
+# Categories reported by the status endpoint, in audit order
+AUDIT_CATEGORIES = ['admin', 'properties', 'workflows', 'forms', 'reporting', 'sales']
+
+# Progress events also written to the job row; the rest only reach in-process listeners
+PERSISTED_EVENTS = {'category_started', 'category_finished', 'audit_finished'}
+
+# A long category (many API calls) still refreshes the job's heartbeat this often,
+# so requeue_stale_jobs never hands a live job to a second worker
+HEARTBEAT_SECONDS = float(os.environ.get("AUDIT_JOB_HEARTBEAT_SECONDS", "30"))
+
+# How often an inline web process looks for jobs that a stopped process left behind
+INLINE_RECOVERY_SECONDS = 300
+
+def queue_mode() -> str:
+    """'inline' (default) starts each audit right away on a thread of the web process,
+    'worker' leaves it for a separate worker process, 'thread' for a shared queue worker
+    thread in the web process, and 'off' runs it inside the request ('sync' is the same)"""
+    mode = os.environ.get("AUDIT_JOB_QUEUE", "inline").lower()
+    return 'off' if mode == 'sync' else mode
+
+def enqueue_audit_job(access_token: str, schedule_id: Optional[int] = None) -> AuditJob:
+    """Create a queued audit job and return it"""
+    job = AuditJob(id=uuid.uuid4().hex, status='queued', access_token=access_token, schedule_id=schedule_id)
+    job.set_progress_dict(_empty_progress())
+    db.session.add(job)
+    db.session.commit()
+    logging.debug(f"Queued audit job {job.id}")
+
+    mode = queue_mode()
+    if mode == 'thread':
+        start_background_worker()
+    elif mode == 'inline':
+        start_inline_job(job.id)
+    return job
+
+def _empty_progress() -> Dict:
+    return {
+        'completed_categories': {},
+        'current_category': None,
+        'items_fetched': {},
+        'api_calls': 0,
+        'event_seq': 0,
+        'events': []
+    }
+
+def job_status(job: AuditJob, after_event: Optional[int] = None) -> Dict:
+    """Public view of a job for the status endpoint - never includes the token.
+
+    With after_event, the persisted progress events newer than that id are included
+    so a page can follow the audit by polling instead of holding an SSE stream open.
+    """
+    progress = job.get_progress_dict()
+    completed = progress.get('completed_categories', {})
+    status = {
+        'job_id': job.id,
+        'status': job.status,
+        'current_category': progress.get('current_category'),
+        'completed_categories': completed,
+        'completed_count': len(completed),
+        'total_categories': len(AUDIT_CATEGORIES),
+        'items_fetched': progress.get('items_fetched', {}),
+        'api_calls': progress.get('api_calls', 0),
+        'error': job.error_message if job.status == 'failed' else None,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None
+    }
+    if after_event is not None:
+        status['events'] = [entry for entry in progress.get('events', []) if entry['id'] > after_event]
+    return status
+
+def claim_next_job(worker_id: str) -> Optional[AuditJob]:
+    """Atomically move the oldest queued job to running and return it"""
+    now = datetime.utcnow()
+    if db.engine.dialect.name == 'postgresql':
+        # Concurrent workers skip rows another worker has locked instead of blocking
+        job = (AuditJob.query.filter_by(status='queued')
+               .order_by(AuditJob.created_at)
+               .with_for_update(skip_locked=True)
+               .first())
+        if not job:
+            db.session.rollback()
+            return None
+        job.status = 'running'
+        job.worker_id = worker_id
+        job.started_at = now
+        job.heartbeat_at = now
+        job.attempts = (job.attempts or 0) + 1
+        db.session.commit()
+        return job
+
+    # SQLite has no row locks - claim with a compare-and-set update on the status
+    candidate_ids = [row[0] for row in db.session.query(AuditJob.id)
+                     .filter_by(status='queued')
+                     .order_by(AuditJob.created_at)
+                     .limit(5)]
+    for job_id in candidate_ids:
+        result = db.session.execute(
+            update(AuditJob)
+            .where(AuditJob.id == job_id, AuditJob.status == 'queued')
+            .values(status='running', worker_id=worker_id, started_at=now, heartbeat_at=now,
+                    attempts=AuditJob.attempts + 1)
+        )
+        db.session.commit()
+        if result.rowcount == 1:
+            return db.session.get(AuditJob, job_id)
+    return None
+
+def requeue_stale_jobs(stale_seconds: int = None, max_attempts: int = None) -> int:
+    """Return jobs whose worker stopped heartbeating to the queue, or fail them"""
+    stale_seconds = stale_seconds or int(os.environ.get("AUDIT_JOB_STALE_SECONDS", "600"))
+    max_attempts = max_attempts or int(os.environ.get("AUDIT_JOB_MAX_ATTEMPTS", "3"))
+    cutoff = datetime.utcnow() - timedelta(seconds=stale_seconds)
+
+    stale_jobs = AuditJob.query.filter(AuditJob.status == 'running', AuditJob.heartbeat_at < cutoff).all()
+    for job in stale_jobs:
+        if (job.attempts or 0) >= max_attempts:
+            job.status = 'failed'
+            job.error_message = 'Audit worker stopped responding'
+            job.access_token = None
+            job.finished_at = datetime.utcnow()
+        else:
+            job.status = 'queued'
+            job.worker_id = None
+    db.session.commit()
+    return len(stale_jobs)
+
+def stream_job_events(job_id: str, last_event_id: int, max_seconds: float):
+    """Yield server-sent events for a job until it finishes or the stream window closes.
+
+    Runs executed by this process are relayed from the broker as they happen; for
+    runs in another process the persisted category events are polled from the job row.
+    """
+    yield "retry: 2000\n\n"
+    deadline = time.monotonic() + max_seconds
+    while time.monotonic() < deadline:
+        if progress_broker.has_run(job_id):
+            events, finished = progress_broker.wait_for_events(
+                job_id, last_event_id, timeout=min(15, max(0, deadline - time.monotonic())))
+            for event_id, event, data in events:
+                yield format_sse(event_id, event, data)
+                last_event_id = event_id
+            if finished:
+                return
+            if not events:
+                yield ": keep-alive\n\n"
+            continue
+
+        db.session.expire_all()
+        job = db.session.get(AuditJob, job_id)
+        if not job:
+            return
+        progress = job.get_progress_dict()
+        for entry in progress.get('events', []):
+            if entry['id'] > last_event_id:
+                yield format_sse(entry['id'], entry['event'], entry['data'])
+                last_event_id = entry['id']
+        if job.status in ('completed', 'failed'):
+            yield format_sse(last_event_id + 1, 'job_completed' if job.status == 'completed' else 'job_failed',
+                             {'status': job.status, 'error': job.error_message})
+            return
+        time.sleep(1)
+
+class AuditJobWorker:
+    """Claim queued audit jobs and run them, writing per-category progress as it goes"""
+
+    def __init__(self, app, poll_interval: float = None):
+        self.app = app
+        self.poll_interval = poll_interval or float(os.environ.get("AUDIT_WORKER_POLL_INTERVAL", "2"))
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self._stop = threading.Event()
+
+    def run_forever(self):
+        """Poll for jobs until stopped"""
+        logging.info(f"Audit worker {self.worker_id} started")
+        while not self._stop.is_set():
+            try:
+                if not self.run_once():
+                    self._stop.wait(self.poll_interval)
+            except Exception as e:
+                logging.error(f"Audit worker loop error: {str(e)}")
+                self._stop.wait(self.poll_interval)
+
+    def stop(self):
+        self._stop.set()
+
+    def run_once(self) -> bool:
+        """Claim and run a single job; returns False when the queue was empty"""
+        with self.app.app_context():
+            requeue_stale_jobs()
+            job = claim_next_job(self.worker_id)
+            if not job:
+                return False
+            self.run_job(job)
+            return True
+
+    def run_job(self, job: AuditJob):
+        """Run the audit for a claimed job and store its outcome"""
+        logging.info(f"Audit worker {self.worker_id} running job {job.id}")
+        recorder = JobProgressRecorder(job)
+        job_id, access_token = job.id, job.access_token
+        outcome = {'status': 'failed', 'error_message': None, 'results_json': None}
+        try:
+            audit_results = run_recorded_audit(access_token, progress_callback=recorder.record)
+
+            if audit_results:
+                outcome.update(status='completed', results_json=json.dumps(audit_results))
+            else:
+                outcome['error_message'] = 'Failed to run audit. Please check your HubSpot permissions.'
+        except ApiBudgetExhausted as e:
+            db.session.rollback()
+            logging.warning(f"Audit job {job_id} stopped: {str(e)}")
+            outcome['error_message'] = "HubSpot's daily API limit for this app is used up. Please try again later."
+        except Exception as e:
+            db.session.rollback()
+            logging.error(f"Audit job {job_id} error: {str(e)}")
+            outcome['error_message'] = 'Error running audit. Please try again or check your HubSpot connection.'
+
+        # Only written while this worker still owns the job; if it was requeued meanwhile,
+        # the worker that claimed it next records the outcome instead
+        if not recorder.flush(access_token=None, finished_at=datetime.utcnow(), **outcome):
+            logging.warning(f"Audit job {job_id} was taken over by another worker; dropping this run's outcome")
+            return
+        # Announced only after the commit so listeners can load the finished job straight away
+        recorder.record('job_completed' if outcome['status'] == 'completed' else 'job_failed',
+                        {'status': outcome['status'], 'error': outcome['error_message']})
+
+class JobProgressRecorder:
+    """Turn AuditEngine progress events into job progress and live stream events.
+
+    Every event goes to the in-process broker; category-level events are also
+    committed to the job row so the status endpoint and other processes see them.
+    """
+
+    def __init__(self, job: AuditJob):
+        self.job_id = job.id
+        self.worker_id = job.worker_id
+        self.progress = job.get_progress_dict()
+        self.max_persisted_events = int(os.environ.get("AUDIT_JOB_MAX_EVENTS", "100"))
+        self.finished = False
+        self._flushed_at = time.monotonic()
+
+    def record(self, event: str, data: Dict):
+        self.progress['event_seq'] = self.progress.get('event_seq', 0) + 1
+        event_id = self.progress['event_seq']
+        progress_broker.publish(self.job_id, event_id, event, data)
+
+        if event == 'category_started':
+            self.progress['current_category'] = data['category']
+        elif event == 'category_finished':
+            self.progress['completed_categories'][data['category']] = {
+                'score': data.get('score'),
+                'grade': data.get('grade')
+            }
+            self.progress['current_category'] = None
+        elif event == 'items_fetched':
+            fetched = self.progress.setdefault('items_fetched', {}).setdefault(data['category'], {})
+            fetched[data['resource']] = data['count']
+        elif event == 'api_call':
+            self.progress['api_calls'] = data.get('api_calls', self.progress.get('api_calls', 0) + 1)
+
+        if event in PERSISTED_EVENTS:
+            events = self.progress.setdefault('events', [])
+            events.append({'id': event_id, 'event': event, 'data': data})
+            del events[:-self.max_persisted_events]
+            self.flush()
+        elif not self.finished and time.monotonic() - self._flushed_at >= HEARTBEAT_SECONDS:
+            self.flush()
+
+    def flush(self, **final_values) -> bool:
+        """Write accumulated progress (and, at the end, the outcome) to the job row.
+
+        Returns False once the job no longer belongs to this worker - requeued as
+        stale and claimed by another - in which case nothing is written.
+        """
+        self._flushed_at = time.monotonic()
+        result = db.session.execute(
+            update(AuditJob)
+            .where(AuditJob.id == self.job_id, AuditJob.worker_id == self.worker_id, AuditJob.status == 'running')
+            .values(progress_json=json.dumps(self.progress), heartbeat_at=datetime.utcnow(), **final_values)
+        )
+        db.session.commit()
+        if final_values:
+            self.finished = True
+        if result.rowcount != 1:
+            logging.warning(f"Audit job {self.job_id} is no longer owned by worker {self.worker_id}")
+            return False
+        return True
+
+_background_worker = None
+_background_worker_lock = threading.Lock()
+
+def start_background_worker():
+    """Start a daemon worker thread in this process (AUDIT_JOB_QUEUE=thread)"""
+    global _background_worker
+    with _background_worker_lock:
+        if _background_worker is None:
+            from app import app
+            _background_worker = AuditJobWorker(app)
+            threading.Thread(target=_background_worker.run_forever, name="audit-worker", daemon=True).start()
+    return _background_worker
+
+_inline_executor = None
+_inline_recovered_at = None
+
+def start_inline_job(job_id: str):
+    """Run one job on a bounded thread pool of this process (AUDIT_JOB_QUEUE=inline)"""
+    global _inline_executor, _inline_recovered_at
+    with _background_worker_lock:
+        if _inline_executor is None:
+            _inline_executor = ThreadPoolExecutor(max_workers=int(os.environ.get("AUDIT_INLINE_THREADS", "4")),
+                                                  thread_name_prefix="audit-inline")
+        recover = _inline_recovered_at is None or time.monotonic() - _inline_recovered_at > INLINE_RECOVERY_SECONDS
+        if recover:
+            _inline_recovered_at = time.monotonic()
+    _inline_executor.submit(_run_inline_job, job_id)
+    if recover:
+        _inline_executor.submit(_recover_inline_jobs)
+
+def _recover_inline_jobs():
+    """Requeue jobs of web processes that stopped mid-audit and run the queued ones here"""
+    from app import app
+    with app.app_context():
+        requeue_stale_jobs()
+        queued = [job_id for (job_id,) in db.session.query(AuditJob.id).filter(AuditJob.status == 'queued')
+                  .order_by(AuditJob.created_at)]
+    for job_id in queued:
+        # Claiming is conditional, so a job another process is starting right now runs only once
+        _inline_executor.submit(_run_inline_job, job_id)
+
+def _run_inline_job(job_id: str):
+    from app import app
+    with app.app_context():
+        worker = AuditJobWorker(app)
+        # Claim this specific job so a queue worker can never pick it up as well
+        result = db.session.execute(
+            update(AuditJob)
+            .where(AuditJob.id == job_id, AuditJob.status == 'queued')
+            .values(status='running', worker_id=worker.worker_id, started_at=datetime.utcnow(),
+                    heartbeat_at=datetime.utcnow(), attempts=AuditJob.attempts + 1)
+        )
+        db.session.commit()
+        if result.rowcount == 1:
+            worker.run_job(db.session.get(AuditJob, job_id))
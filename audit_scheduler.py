@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""Recurring audits: due schedules are dispatched into the audit job queue"""
+
+import os
+import random
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+from sqlalchemy import update
+from models import AuditJob, AuditResult, AuditSchedule, db
+from audit_jobs import enqueue_audit_job, queue_mode
+from hubspot_service import HubSpotService
+
+TICK_SECONDS = float(os.environ.get("SCHEDULER_TICK_SECONDS", "60"))
+# HubSpot API calls per minute the scheduler may start across all portals, and the most
+# scheduled jobs queued or running at once
+APP_CALLS_PER_MINUTE = int(os.environ.get("SCHEDULER_APP_CALLS_PER_MINUTE", "600"))
+MAX_IN_FLIGHT = int(os.environ.get("SCHEDULER_MAX_IN_FLIGHT", "8"))
+# API calls scheduled audits of one portal may use in 24 hours
+PORTAL_DAILY_CALLS = int(os.environ.get("SCHEDULER_PORTAL_DAILY_CALLS", "20000"))
+# Assumed cost of a portal's first audit, before its real call count is known
+DEFAULT_AUDIT_CALLS = int(os.environ.get("SCHEDULER_DEFAULT_AUDIT_CALLS", "150"))
+JITTER_FRACTION = float(os.environ.get("SCHEDULER_JITTER_FRACTION", "0.1"))
+MAX_JITTER = timedelta(minutes=float(os.environ.get("SCHEDULER_MAX_JITTER_MINUTES", "60")))
+RETRY_BASE = timedelta(minutes=float(os.environ.get("SCHEDULER_RETRY_BASE_MINUTES", "15")))
+MAX_FAILURES = int(os.environ.get("SCHEDULER_MAX_FAILURES", "6"))
+MIN_CADENCE_HOURS = 1
+# pending_job_id while the token is refreshed and the job queued
+DISPATCHING = 'dispatching'
+
+def _jitter(cadence: timedelta) -> timedelta:
+    spread = min(cadence * JITTER_FRACTION, MAX_JITTER)
+    return spread * random.uniform(-1, 1)
+
+def next_run_after(start: datetime, cadence_hours: float) -> datetime:
+    """Jittered run time one cadence after start"""
+    cadence = timedelta(hours=cadence_hours)
+    return start + cadence + _jitter(cadence)
+
+def retry_delay(failures: int, cadence_hours: float) -> timedelta:
+    """Exponential backoff with jitter, never longer than the schedule's own cadence"""
+    delay = min(RETRY_BASE * (2 ** max(failures - 1, 0)), timedelta(hours=cadence_hours))
+    return delay * random.uniform(0.5, 1)
+
+def create_schedule(user_id: int, portal_id: str, refresh_token: str, cadence_hours: float) -> AuditSchedule:
+    """Create or update the user's schedule for a portal; the first run is one (jittered) cadence away"""
+    cadence_hours = max(float(cadence_hours), MIN_CADENCE_HOURS)
+    schedule = AuditSchedule.query.filter_by(user_id=user_id, hubspot_portal_id=str(portal_id)).first()
+    if schedule is None:
+        schedule = AuditSchedule(user_id=user_id, hubspot_portal_id=str(portal_id), consecutive_failures=0)
+        db.session.add(schedule)
+    if schedule.next_run_at is None or schedule.cadence_hours != cadence_hours or not schedule.enabled:
+        schedule.next_run_at = next_run_after(datetime.utcnow(), cadence_hours)
+    schedule.set_refresh_token(refresh_token)
+    schedule.cadence_hours = cadence_hours
+    schedule.enabled = True
+    schedule.consecutive_failures = 0
+    schedule.last_error = None
+    db.session.commit()
+    return schedule
+
+def stop_schedule(schedule: AuditSchedule):
+    """Disable a schedule and drop its refresh token; scheduling the portal again stores a new one"""
+    schedule.enabled = False
+    schedule.refresh_token = None
+
+def schedule_status(schedule: AuditSchedule) -> Dict:
+    """Public view of a schedule - never includes the refresh token"""
+    return {
+        'id': schedule.id,
+        'portal_id': schedule.hubspot_portal_id,
+        'cadence_hours': schedule.cadence_hours,
+        'enabled': schedule.enabled,
+        'next_run_at': schedule.next_run_at.isoformat() if schedule.next_run_at else None,
+        'pending': schedule.pending_job_id is not None,
+        'last_run_at': schedule.last_run_at.isoformat() if schedule.last_run_at else None,
+        'last_audit_id': schedule.last_audit_id,
+        'consecutive_failures': schedule.consecutive_failures,
+        'last_error': schedule.last_error
+    }
+
+def _record_success(schedule: AuditSchedule, job: AuditJob, now: datetime):
+    audit_record = AuditResult.from_results(schedule.user_id, job.get_results_dict())
+    db.session.add(audit_record)
+    db.session.flush()
+    job.results_json = None  # saved as an AuditResult now
+
+    # Keep to the schedule's own slots; after a long outage start over from now
+    next_run = next_run_after(schedule.next_run_at, schedule.cadence_hours)
+    schedule.next_run_at = next_run if next_run > now else next_run_after(now, schedule.cadence_hours)
+    schedule.last_audit_id = audit_record.id
+    schedule.consecutive_failures = 0
+    schedule.last_error = None
+
+def _record_failure(schedule: AuditSchedule, error: str, now: datetime):
+    schedule.consecutive_failures = (schedule.consecutive_failures or 0) + 1
+    schedule.last_error = error
+    if schedule.consecutive_failures >= MAX_FAILURES:
+        stop_schedule(schedule)
+        logging.warning(f"Audit schedule {schedule.id} disabled after {schedule.consecutive_failures} failures: {error}")
+    else:
+        schedule.next_run_at = now + retry_delay(schedule.consecutive_failures, schedule.cadence_hours)
+
+def collect_finished_jobs() -> int:
+    """Save the results of finished scheduled jobs and plan each schedule's next run"""
+    now = datetime.utcnow()
+    collected = 0
+    pending = AuditSchedule.query.filter(AuditSchedule.pending_job_id.isnot(None)).all()
+    for schedule in pending:
+        # A schedule left DISPATCHING was interrupted mid-dispatch (one scheduler runs at a time)
+        job = None if schedule.pending_job_id == DISPATCHING else db.session.get(AuditJob, schedule.pending_job_id)
+        if job is not None and job.status not in ('completed', 'failed'):
+            continue
+        try:
+            if job is not None and job.status == 'completed':
+                _record_success(schedule, job, now)
+            else:
+                _record_failure(schedule, job.error_message if job else 'Audit was not queued', now)
+            if job is not None:
+                schedule.last_api_calls = job.get_progress_dict().get('api_calls') or schedule.last_api_calls
+            schedule.last_run_at = job.finished_at if job is not None else now
+            schedule.pending_job_id = None
+            db.session.commit()
+            collected += 1
+        except Exception as e:
+            db.session.rollback()
+            logging.error(f"Error collecting scheduled audit job {schedule.pending_job_id}: {str(e)}")
+    return collected
+
+def _portal_calls_last_day(portal_id: str, since: datetime) -> int:
+    jobs = (AuditJob.query.join(AuditSchedule, AuditJob.schedule_id == AuditSchedule.id)
+            .filter(AuditSchedule.hubspot_portal_id == portal_id, AuditJob.finished_at >= since).all())
+    return sum(job.get_progress_dict().get('api_calls', 0) for job in jobs)
+
+def _claim(schedule: AuditSchedule) -> bool:
+    """Mark a schedule as being dispatched; False if another scheduler got to it first"""
+    result = db.session.execute(
+        update(AuditSchedule)
+        .where(AuditSchedule.id == schedule.id, AuditSchedule.pending_job_id.is_(None),
+               AuditSchedule.next_run_at == schedule.next_run_at)
+        .values(pending_job_id=DISPATCHING)
+    )
+    db.session.commit()
+    return result.rowcount == 1
+
+def _dispatch(schedule: AuditSchedule, now: datetime) -> Optional[AuditJob]:
+    refresh_token = schedule.get_refresh_token()
+    token_data = HubSpotService().refresh_access_token(refresh_token) if refresh_token else None
+    if not token_data or not token_data.get('access_token'):
+        _record_failure(schedule, 'Could not refresh the HubSpot access token', now)
+        schedule.pending_job_id = None
+        schedule.last_run_at = now
+        db.session.commit()
+        return None
+    if token_data.get('refresh_token'):
+        schedule.set_refresh_token(token_data['refresh_token'])
+    # Queued with its schedule id so collect_finished_jobs can find it
+    job = enqueue_audit_job(token_data['access_token'], schedule_id=schedule.id)
+    schedule.pending_job_id = job.id
+    db.session.commit()
+    if queue_mode() == 'off':
+        from audit_jobs import _run_inline_job
+        _run_inline_job(job.id)
+    return job
+
+def dispatch_due(tick_seconds: Optional[float] = None) -> List[str]:
+    """Queue audits for due schedules within this tick's API budget; returns the job ids queued"""
+    now = datetime.utcnow()
+    in_flight = AuditSchedule.query.filter(AuditSchedule.pending_job_id.isnot(None)).count()
+    slots = MAX_IN_FLIGHT - in_flight
+    budget = APP_CALLS_PER_MINUTE * (tick_seconds or TICK_SECONDS) / 60
+    if slots <= 0:
+        return []
+
+    due = (AuditSchedule.query
+           .filter(AuditSchedule.enabled.is_(True), AuditSchedule.pending_job_id.is_(None),
+                   AuditSchedule.next_run_at <= now)
+           .order_by(AuditSchedule.next_run_at)
+           .limit(slots * 4)
+           .all())
+    queued = []
+    dispatched = 0
+    portals = set()
+    for schedule in due:
+        if len(queued) >= slots:
+            break
+        estimate = schedule.last_api_calls or DEFAULT_AUDIT_CALLS
+        if dispatched and estimate > budget:
+            break  # the app's budget for this tick is spent; the rest stay due
+        if schedule.hubspot_portal_id in portals or AuditSchedule.query.filter(
+                AuditSchedule.hubspot_portal_id == schedule.hubspot_portal_id,
+                AuditSchedule.pending_job_id.isnot(None)).count():
+            continue  # one audit per portal at a time, even across users
+        if _portal_calls_last_day(schedule.hubspot_portal_id, now - timedelta(days=1)) + estimate > PORTAL_DAILY_CALLS:
+            schedule.next_run_at = now + timedelta(hours=1) + _jitter(timedelta(hours=1))
+            db.session.commit()
+            logging.info(f"Audit schedule {schedule.id} deferred: portal {schedule.hubspot_portal_id} is over its daily API budget")
+            continue
+        if not _claim(schedule):
+            continue
+        try:
+            job = _dispatch(schedule, now)
+        except Exception as e:
+            db.session.rollback()
+            logging.error(f"Audit schedule {schedule.id} dispatch error: {str(e)}")
+            _record_failure(schedule, 'Could not queue the audit', now)
+            schedule.pending_job_id = None
+            db.session.commit()
+            continue
+        portals.add(schedule.hubspot_portal_id)
+        dispatched += 1
+        budget -= estimate
+        if job is not None:
+            queued.append(job.id)
+    return queued
+
+class AuditScheduler:
+    """Collect finished scheduled jobs and dispatch due ones, once per tick"""
+
+    def __init__(self, app, tick_seconds: Optional[float] = None):
+        self.app = app
+        self.tick_seconds = tick_seconds or TICK_SECONDS
+        self._stop = threading.Event()
+
+    def tick(self) -> Dict:
+        with self.app.app_context():
+            collected = collect_finished_jobs()
+            queued = dispatch_due(self.tick_seconds)
+            return {'collected': collected, 'queued': len(queued)}
+
+    def run_forever(self):
+        logging.info(f"Audit scheduler started (tick every {self.tick_seconds}s)")
+        while not self._stop.is_set():
+            try:
+                outcome = self.tick()
+                if outcome['collected'] or outcome['queued']:
+                    logging.info(f"Audit scheduler: {outcome['collected']} finished, {outcome['queued']} queued")
+            except Exception as e:
+                logging.error(f"Audit scheduler loop error: {str(e)}")
+            self._stop.wait(self.tick_seconds)
+
+    def stop(self):
+        self._stop.set()
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""Audit many portals in one run, one access token per portal"""
+
+import os
+import json
+import time
+import hashlib
+import logging
+import tempfile
+import itertools
+import multiprocessing
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Callable, Dict, Iterable, List, Optional
+import requests
+from requests.adapters import HTTPAdapter
+from hubspot_service import HubSpotService
+from api_budget import budget_backend, standalone_api_budget
+from audit_engine import AuditEngine
+from snapshot_replay import RecordingHubSpotService
+
+PROCESSES = int(os.environ.get("BATCH_AUDIT_PROCESSES", "4"))
+# API calls per second across the whole batch, and how many may go out back to back
+# (API_BUDGET_BACKEND=off only; otherwise the app-wide API_BUDGET_RATE applies)
+API_RATE = float(os.environ.get("BATCH_AUDIT_API_RATE", "9"))
+API_BURST = int(os.environ.get("BATCH_AUDIT_API_BURST", "10"))
+HTTP_POOL_SIZE = 4
+# Audits queued in the pool per worker process; the rest wait in the parent
+SUBMIT_WINDOW_PER_PROCESS = 2
+
+class SharedRateBudget:
+    """Token bucket in shared memory, drawn from by every worker process of a batch"""
+
+    def __init__(self, rate: float, burst: int, context=None):
+        context = context or multiprocessing.get_context('spawn')
+        self.rate = rate
+        self.burst = burst
+        self._tokens = context.Value('d', float(burst), lock=False)
+        self._updated = context.Value('d', time.monotonic(), lock=False)
+        self._lock = context.Lock()
+
+    def acquire(self, access_token: Optional[str] = None):
+        """Block until one API call is allowed (the batch shares one budget, whatever the portal)"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                tokens = min(self.burst, self._tokens.value + (now - self._updated.value) * self.rate)
+                self._updated.value = now
+                if tokens >= 1:
+                    self._tokens.value = tokens - 1
+                    return
+                self._tokens.value = tokens
+                wait = (1 - tokens) / self.rate
+            time.sleep(wait)
+
+def token_fingerprint(access_token: str) -> str:
+    """Stable id for a token in checkpoints and logs (the token itself is never written out)"""
+    return hashlib.sha256(access_token.encode('utf-8')).hexdigest()[:16]
+
+def read_tokens(path: str) -> List[str]:
+    """One access token per line; blank lines and # comments are skipped"""
+    with open(path) as tokens_file:
+        lines = (line.strip() for line in tokens_file)
+        return [line for line in lines if line and not line.startswith('#')]
+
+def _init_worker(budget: Optional[SharedRateBudget]):
+    session = requests.Session()
+    session.mount('https://', HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE))
+    HubSpotService.http_session = session
+    HubSpotService.rate_limiter = budget if budget is not None else standalone_api_budget()
+
+def audit_portal(access_token: str) -> Dict:
+    """Run one portal's audit (in a worker process) and return its results and raw snapshot"""
+    started = time.monotonic()
+    hubspot = RecordingHubSpotService(access_token)
+    results = AuditEngine(hubspot).run_full_audit()
+    return {
+        'results': results,
+        'snapshot': hubspot.snapshot() if results else None,
+        'api_calls': hubspot.api_call_count,
+        'seconds': round(time.monotonic() - started, 1)
+    }
+
+def load_checkpoint(path: Optional[str]) -> Dict[str, Dict]:
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path) as checkpoint_file:
+        return json.load(checkpoint_file).get('portals', {})
+
+def save_checkpoint(path: Optional[str], portals: Dict[str, Dict]):
+    if not path:
+        return
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'w') as checkpoint_file:
+        json.dump({'portals': portals}, checkpoint_file, indent=1)
+    # Atomic so an interrupted run never leaves a truncated checkpoint
+    os.replace(tmp_path, path)
+
+def _save_result(user_id: int, outcome: Dict) -> Dict:
+    """Archive the snapshot and store the audit like the web flow does; returns the checkpoint entry"""
+    from models import AuditResult, db
+    from snapshot_store import store_snapshot
+
+    results = outcome['results']
+    portal_id = (results.get('portal_info') or {}).get('portalId')
+    try:
+        results['snapshot_id'] = store_snapshot(outcome['snapshot'], portal_id)
+    except Exception as e:
+        db.session.rollback()
+        logging.error(f"Snapshot archive error: {str(e)}")
+    audit_record = AuditResult.from_results(user_id, results)
+    db.session.add(audit_record)
+    db.session.commit()
+    return {'status': 'done', 'audit_id': audit_record.id, 'portal_id': portal_id,
+            'overall_score': results.get('overall_score'), 'api_calls': outcome['api_calls'],
+            'seconds': outcome['seconds']}
+
+def _portal_entry(future, fingerprint: str, user_id: int) -> Dict:
+    """Save a finished audit and return its checkpoint entry"""
+    from models import db
+    try:
+        outcome = future.result()
+        results = outcome['results']
+        if not results or not (results.get('portal_info') or {}).get('portalId'):
+            # Nothing worth saving: the token could not even read the account
+            return {'status': 'failed', 'error': 'no results (token invalid or expired?)',
+                    'api_calls': outcome['api_calls'], 'seconds': outcome['seconds']}
+        return _save_result(user_id, outcome)
+    except Exception as e:
+        db.session.rollback()
+        logging.error(f"Batch audit error for portal token {fingerprint}: {str(e)}")
+        return {'status': 'failed', 'error': str(e)}
+
+def run_batch(tokens: Iterable[str], user_id: int, processes: Optional[int] = None,
+              checkpoint_path: Optional[str] = None, api_rate: Optional[float] = None,
+              on_result: Optional[Callable[[Dict, Dict], None]] = None) -> Dict:
+    """Audit every portal and save the results under user_id.
+
+    Portals already marked done in the checkpoint are skipped; failed ones are
+    tried again. on_result(entry, summary) is called as each portal finishes.
+    Returns the run summary, including throughput in audits per minute.
+    """
+    checkpoint = load_checkpoint(checkpoint_path)
+    tokens = list(dict.fromkeys(tokens))
+    pending = [token for token in tokens if checkpoint.get(token_fingerprint(token), {}).get('status') != 'done']
+    summary = {'total': len(tokens), 'skipped': len(tokens) - len(pending), 'done': 0, 'failed': 0,
+               'api_calls': 0, 'elapsed_seconds': 0.0, 'audits_per_minute': 0.0}
+    if not pending:
+        return summary
+
+    context = multiprocessing.get_context('spawn')
+    budget = SharedRateBudget(api_rate or API_RATE, API_BURST, context) if budget_backend() == 'off' else None
+    started = time.monotonic()
+    workers = min(processes or PROCESSES, len(pending))
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                               initializer=_init_worker, initargs=(budget,))
+    try:
+        # Only a window of audits is queued at a time, so a huge token list is not
+        # pickled into the pool up front and finished futures are released as we go
+        remaining = iter(pending)
+        futures = {}
+        for token in itertools.islice(remaining, SUBMIT_WINDOW_PER_PROCESS * workers):
+            futures[pool.submit(audit_portal, token)] = token_fingerprint(token)
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                fingerprint = futures.pop(future)
+                entry = _portal_entry(future, fingerprint, user_id)
+                for token in itertools.islice(remaining, 1):
+                    futures[pool.submit(audit_portal, token)] = token_fingerprint(token)
+
+                checkpoint[fingerprint] = entry
+                save_checkpoint(checkpoint_path, checkpoint)
+                summary[entry['status']] += 1
+                summary['api_calls'] += entry.get('api_calls', 0)
+                summary['elapsed_seconds'] = round(time.monotonic() - started, 1)
+                summary['audits_per_minute'] = round(summary['done'] / max(summary['elapsed_seconds'], 1e-9) * 60, 2)
+                if on_result:
+                    on_result(dict(entry, token=fingerprint), summary)
+    finally:
+        # On Ctrl-C, drop the audits that have not started; finished ones are checkpointed
+        pool.shutdown(wait=True, cancel_futures=True)
+    return summary
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""Bulk export of stored audits' PDF reports as a ZIP archive that is streamed
+while it is built.
+
+Reports render in the PDF render pool (reusing cached renders) a few at a
+time, and each one is copied into the archive as soon as it is ready. The
+archive is written to a sink that hands its bytes straight to the caller, so
+neither the archive nor more than a window of reports is ever held in memory.
+"""
+
+import os
+import logging
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, wait
+from datetime import datetime
+from typing import Iterable, Iterator, List, Optional, Tuple
+from models import AuditResult, db
+from pdf_cache import RENDER_PROCESSES, RENDER_QUEUE_MAX, RenderQueueFull, cached_report_path, get_or_render, request_report
+from score_benchmarks import audit_percentiles, load_histograms
+
+MAX_AUDITS = int(os.environ.get("BULK_EXPORT_MAX_AUDITS", "200"))
+# Reports rendering at once for one export; leaves room in the shared queue for other users
+PARALLEL_RENDERS = max(1, min(RENDER_QUEUE_MAX // 2, int(os.environ.get("BULK_EXPORT_PARALLEL", "4"))))
+COPY_CHUNK_SIZE = 64 * 1024
+
+class _StreamSink:
+    """Write-only file object that buffers what zipfile writes until it is drained"""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+        return data
+
+def report_filename(audit: AuditResult) -> str:
+    portal = audit.hubspot_portal_id or 'portal'
+    day = (audit.audit_timestamp or datetime.utcnow()).strftime('%Y-%m-%d')
+    return f"audit_{audit.id}_{portal}_{day}.pdf"
+
+def _rendered_reports(audit_ids: List[int], user_id: Optional[int]) -> Iterator[Tuple[str, Optional[str], Optional[str]]]:
+    """(entry name, report path, error) per audit, in the order the reports become ready"""
+    histograms = load_histograms()
+    queued = iter(audit_ids)
+    pending = {}  # future -> (report key, entry names); identical reports share one render
+
+    def start_next() -> Optional[Tuple[str, Optional[str], Optional[str]]]:
+        """Queue the next audit's render; returns an entry if it is ready (or failed) right away"""
+        audit_id = next(queued)
+        query = AuditResult.query.filter_by(id=audit_id)
+        if user_id is not None:
+            query = query.filter_by(user_id=user_id)
+        audit = query.first()
+        if audit is None:
+            return f"audit_{audit_id}.pdf", None, 'not found'
+        name = report_filename(audit)
+        try:
+            results = audit.get_results_dict()
+            percentiles = audit_percentiles(results, histograms)
+            if RENDER_PROCESSES <= 0:
+                return (name, get_or_render(results, percentiles)[0], None)
+            try:
+                key, future = request_report(results, percentiles)
+            except RenderQueueFull:
+                # Render pool is busy with other users; render this one here
+                return (name, get_or_render(results, percentiles)[0], None)
+            if future is None:
+                return name, cached_report_path(key), None
+            pending.setdefault(future, (key, []))[1].append(name)
+            return None
+        except Exception as e:
+            logging.error(f"Bulk export error for audit {audit_id}: {str(e)}")
+            return name, None, str(e)
+        finally:
+            # Loaded results are not needed once they are handed to the pool
+            db.session.expunge(audit)
+
+    exhausted = False
+    while not exhausted or pending:
+        while not exhausted and len(pending) < PARALLEL_RENDERS:
+            try:
+                ready = start_next()
+            except StopIteration:
+                exhausted = True
+                break
+            if ready is not None:
+                yield ready
+        if not pending:
+            continue
+        done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+        for future in done:
+            key, names = pending.pop(future)
+            for name in names:
+                if future.exception() is not None:
+                    yield name, None, str(future.exception())
+                else:
+                    yield name, cached_report_path(key), None
+
+def stream_reports_zip(audit_ids: Iterable[int], user_id: Optional[int] = None) -> Iterator[bytes]:
+    """Yield a ZIP archive of the audits' PDF reports, piece by piece.
+
+    user_id limits the export to that user's audits; audits that are missing,
+    not visible or fail to render are listed in errors.txt in the archive.
+    """
+    audit_ids = list(dict.fromkeys(audit_ids))[:MAX_AUDITS]
+    sink = _StreamSink()
+    errors = []
+    # Reports are already compressed; storing them keeps the stream cheap to produce
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_STORED) as archive:
+        for name, path, error in _rendered_reports(audit_ids, user_id):
+            if error:
+                errors.append(f"{name}: {error}")
+                continue
+            try:
+                with open(path, 'rb') as report, archive.open(name, 'w') as entry:
+                    while True:
+                        chunk = report.read(COPY_CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        entry.write(chunk)
+                        data = sink.drain()
+                        if data:
+                            yield data
+            except FileNotFoundError:
+                # Evicted from the cache between rendering and copying
+                errors.append(f"{name}: report expired from cache, export it again")
+        if errors:
+            archive.writestr('errors.txt', '\n'.join(errors) + '\n')
+    yield sink.drain()
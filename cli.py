@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+"""Command line tasks run through the Flask CLI (FLASK_APP=main)"""
+
+import click
+from app import app
+
+@app.cli.group('ai-batch')
+def ai_batch_cli():
+    """Generate AI reports for saved audits through the batch API"""
+
+@ai_batch_cli.command('submit')
+@click.option('--limit', type=int, default=None, help='Maximum number of audits to include')
+def ai_batch_submit(limit):
+    """Submit one batch covering audits that have no AI report yet"""
+    from ai_batch import AIBatchRunner
+    job = AIBatchRunner().submit(limit)
+    if job is None:
+        click.echo("No audits waiting for AI enhancements")
+    else:
+        click.echo(f"Batch job {job.id}: {job.status} ({job.request_count} requests, provider id {job.provider_batch_id})")
+
+@ai_batch_cli.command('poll')
+@click.option('--wait', is_flag=True, help='Keep polling until every batch has finished')
+@click.option('--interval', type=int, default=60, help='Seconds between polls when waiting')
+def ai_batch_poll(wait, interval):
+    """Poll running batches and write finished results back onto their audits"""
+    from ai_batch import AIBatchRunner
+    runner = AIBatchRunner()
+    jobs = runner.wait(poll_interval=interval) if wait else runner.poll_all()
+    for job in jobs:
+        click.echo(f"Batch job {job.id}: {job.status} ({job.completed_count}/{len(job.get_audit_ids())} audits updated)")
+
+@app.cli.command('audit-worker')
+@click.option('--once', is_flag=True, help='Run at most one queued job and exit')
+@click.option('--poll-interval', type=float, default=None, help='Seconds to wait when the queue is empty')
+def audit_worker(once, poll_interval):
+    """Run queued audit jobs (use with AUDIT_JOB_QUEUE=worker)"""
+    from audit_jobs import AuditJobWorker
+    worker = AuditJobWorker(app, poll_interval=poll_interval)
+    if once:
+        click.echo("Ran one job" if worker.run_once() else "No queued jobs")
+    else:
+        worker.run_forever()
+
+@app.cli.command('audit-scheduler')
+@click.option('--once', is_flag=True, help='Run a single tick and exit (e.g. from cron)')
+@click.option('--tick', type=float, default=None, help='Seconds between ticks')
+def audit_scheduler(once, tick):
+    """Dispatch due recurring audits into the job queue"""
+    from audit_scheduler import AuditScheduler
+    scheduler = AuditScheduler(app, tick_seconds=tick)
+    if once:
+        outcome = scheduler.tick()
+        click.echo(f"{outcome['collected']} finished, {outcome['queued']} queued")
+    else:
+        scheduler.run_forever()
+
+@app.cli.command('ingest-webhooks')
+@click.argument('payload_files', nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False))
+def ingest_webhooks(payload_files):
+    """Apply recorded HubSpot webhook payloads to the live portal snapshots"""
+    from portal_changes import apply_events, load_events
+    summary = apply_events(load_events(payload_files))
+    click.echo(f"Applied {summary['applied']} events, ignored {summary['ignored']} "
+               f"(portals changed: {', '.join(summary['portals']) or 'none'})")
+
+@app.cli.command('cleanup-sessions')
+def cleanup_sessions():
+    """Delete expired server-side sessions"""
+    from server_session import ServerSessionInterface
+    interface = app.session_interface
+    if not isinstance(interface, ServerSessionInterface):
+        click.echo("Server-side sessions are disabled (SESSION_BACKEND=cookie)")
+        return
+    click.echo(f"Removed {interface.cleanup_expired()} expired sessions")
+
+@app.cli.command('db-upgrade')
+def db_upgrade():
+    """Create missing tables and apply schema upgrades (for DB_AUTO_UPGRADE=false deployments)"""
+    from db_migrations import upgrade_schema
+    upgrade_schema()
+    click.echo("Database schema is up to date")
+
+@app.cli.command('migrate-results')
+@click.option('--batch-size', type=int, default=200, help='Audits converted per transaction')
+def migrate_results(batch_size):
+    """Convert audits stored as uncompressed JSON to compressed blobs"""
+    from sqlalchemy.orm import undefer
+    from models import AuditResult, db
+    converted = json_bytes = blob_bytes = 0
+    last_id = 0
+    while True:
+        audits = (AuditResult.query
+                  .options(undefer(AuditResult.results_json))
+                  .filter(AuditResult.id > last_id,
+                          AuditResult.results_blob.is_(None),
+                          AuditResult.results_json.isnot(None))
+                  .order_by(AuditResult.id)
+                  .limit(batch_size)
+                  .all())
+        if not audits:
+            break
+        for audit in audits:
+            json_bytes += len(audit.results_json.encode('utf-8'))
+            audit.set_results_dict(audit.get_results_dict())
+            blob_bytes += len(audit.results_blob)
+            last_id = audit.id
+        db.session.commit()
+        converted += len(audits)
+        click.echo(f"Converted {converted} audits...")
+
+    if converted:
+        click.echo(f"Converted {converted} audits: {json_bytes} bytes of JSON -> {blob_bytes} bytes compressed "
+                   f"({blob_bytes / json_bytes:.0%})")
+    else:
+        click.echo("No audits left to convert")
+
+@app.cli.command('backfill-category-metrics')
+@click.option('--batch-size', type=int, default=200, help='Audits processed per transaction')
+def backfill_category_metrics(batch_size):
+    """Create audit_category_metrics rows for audits saved before the table existed"""
+    from models import AuditResult, db
+    backfilled = 0
+    last_id = 0
+    while True:
+        audits = (AuditResult.query
+                  .filter(AuditResult.id > last_id,
+                          ~AuditResult.category_metrics.any())
+                  .order_by(AuditResult.id)
+                  .limit(batch_size)
+                  .all())
+        if not audits:
+            break
+        for audit in audits:
+            audit.sync_category_metrics(audit.get_results_dict())
+            last_id = audit.id
+        db.session.commit()
+        backfilled += len(audits)
+    click.echo(f"Backfilled category metrics for {backfilled} audits")
+
+@app.cli.command('category-stats')
+@click.option('--since', type=click.DateTime(), default=None, help='Only audits on or after this date')
+@click.option('--until', type=click.DateTime(), default=None, help='Only audits before this date')
+@click.option('--portal', default=None, help='Limit to one HubSpot portal id')
+def category_stats(since, until, portal):
+    """Print score statistics per category"""
+    from audit_analytics import category_score_summary
+    for row in category_score_summary(since, until, portal):
+        click.echo(f"{row['category']:<12} audits={row['audits']:<6} avg={row['average_score']} "
+                   f"min={row['min_score']} max={row['max_score']}")
+
+@app.cli.command('score-what-if')
+@click.argument('rules_file', type=click.Path(exists=True, dir_okay=False))
+@click.option('--since', type=click.DateTime(), default=None, help='Only audits on or after this date')
+@click.option('--portal', default=None, help='Limit to one HubSpot portal id')
+def score_what_if(rules_file, since, portal):
+    """Compare stored scores with the scores an alternative rules file would give"""
+    from audit_analytics import what_if_scores
+    from rules_engine import RulesEngine, ScoringRulesError
+    try:
+        engine = RulesEngine.from_file(rules_file)
+    except ScoringRulesError as e:
+        raise click.ClickException(str(e))
+
+    report = what_if_scores(engine, since, portal)
+    for row in report['categories']:
+        click.echo(f"{row['category']:<12} audits={row['audits']:<6} changed_scores={row['changed_scores']:<6} "
+                   f"changed_grades={row['changed_grades']:<6} avg {row['average_old']} -> {row['average_new']}")
+    overall = report['overall']
+    click.echo(f"{'overall':<12} audits={overall['audits']:<6} changed_grades={overall['changed_grades']:<6} "
+               f"avg {overall['average_old']} -> {overall['average_new']}")
+
+@app.cli.command('rebuild-benchmarks')
+def rebuild_benchmarks_command():
+    """Recount the percentile benchmark histograms from all stored audits"""
+    from score_benchmarks import rebuild_benchmarks
+    click.echo(f"Rebuilt benchmarks from {rebuild_benchmarks()} audits")
+
+@app.cli.command('benchmark-stats')
+def benchmark_stats():
+    """Print the live average and top-10% score per category"""
+    from score_benchmarks import benchmark_summary
+    for scope, row in benchmark_summary().items():
+        click.echo(f"{scope:<12} audits={row['audits']:<6} avg={row['average']} "
+                   f"top10%={row['top_10_percent']} ({row['source']})")
+
+@app.cli.command('export-reports')
+@click.argument('audit_ids', nargs=-1, type=int, required=True)
+@click.option('--output', '-o', type=click.Path(dir_okay=False), default='audit_reports.zip', help='ZIP file to write')
+def export_reports(audit_ids, output):
+    """Write the PDF reports of the given audits into one ZIP archive"""
+    from bulk_export import MAX_AUDITS, stream_reports_zip
+    if len(audit_ids) > MAX_AUDITS:
+        raise click.ClickException(f"At most {MAX_AUDITS} audits per export (BULK_EXPORT_MAX_AUDITS)")
+    written = 0
+    with open(output, 'wb') as archive:
+        for chunk in stream_reports_zip(audit_ids):
+            archive.write(chunk)
+            written += len(chunk)
+    click.echo(f"Wrote {written} bytes to {output}")
+
+@app.cli.command('results-storage-stats')
+def results_storage_stats():
+    """Show how saved audit results are stored (keyframes, patches, references)"""
+    from sqlalchemy import func
+    from models import AuditResult, db
+    rows = (db.session.query(AuditResult.results_codec, func.count(AuditResult.id),
+                             func.coalesce(func.sum(func.length(AuditResult.results_blob)), 0))
+            .group_by(AuditResult.results_codec)
+            .order_by(AuditResult.results_codec))
+    for codec, count, stored_bytes in rows:
+        click.echo(f"{codec or 'legacy json':<12} audits={count:<8} bytes={stored_bytes}")
+
+@app.cli.command('rescore')
+@click.option('--workers', type=int, default=None, help='Worker processes (default: CPU count)')
+@click.option('--batch-size', type=int, default=500, help='Audits loaded per batch')
+@click.option('--limit', type=int, default=None, help='Stop after this many audits')
+@click.option('--dry-run', is_flag=True, help='Report score changes without saving them')
+def rescore(workers, batch_size, limit, dry_run):
+    """Recompute scores for archived audits by replaying their snapshots offline"""
+    from concurrent.futures import ProcessPoolExecutor
+    from models import AuditResult, PortalSnapshot, db
+    from snapshot_replay import rescore_snapshot_blob
+
+    processed = changed = 0
+    last_id = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        while limit is None or processed < limit:
+            size = batch_size if limit is None else min(batch_size, limit - processed)
+            audits = (AuditResult.query
+                      .filter(AuditResult.id > last_id, AuditResult.snapshot_hash.isnot(None))
+                      .order_by(AuditResult.id)
+                      .limit(size)
+                      .all())
+            if not audits:
+                break
+
+            # Audits sharing a snapshot are replayed once
+            hashes = sorted({audit.snapshot_hash for audit in audits})
+            blobs = dict(db.session.query(PortalSnapshot.id, PortalSnapshot.data).filter(PortalSnapshot.id.in_(hashes)))
+            available = [snapshot_hash for snapshot_hash in hashes if snapshot_hash in blobs]
+            replayed = dict(zip(available, pool.map(rescore_snapshot_blob, [blobs[h] for h in available], chunksize=8)))
+
+            for audit in audits:
+                last_id = audit.id
+                processed += 1
+                fresh = replayed.get(audit.snapshot_hash)
+                if not fresh:
+                    continue
+                stored_scores = {row.category: (row.score, row.grade) for row in audit.category_metrics}
+                fresh_scores = {category: (data.get('score'), data.get('grade')) for category, data in fresh.items()
+                                if isinstance(data, dict) and 'score' in data}
+                if (fresh['overall_score'], fresh['overall_grade']) == (audit.overall_score, audit.overall_grade) \
+                        and fresh_scores == stored_scores:
+                    continue
+                changed += 1
+                if dry_run:
+                    click.echo(f"Audit {audit.id}: {audit.overall_score} {audit.overall_grade} -> "
+                               f"{fresh['overall_score']} {fresh['overall_grade']}")
+                    continue
+
+                # Keep AI enhancements and other additions; replace everything the engine produces
+                results = audit.get_results_dict()
+                results.update(fresh)
+                results['snapshot_id'] = audit.snapshot_hash
+                audit.set_results_dict(results)
+                audit.overall_score = fresh['overall_score']
+                audit.overall_grade = fresh['overall_grade']
+
+            if not dry_run:
+                db.session.commit()
+            click.echo(f"Rescored {processed} audits, {changed} changed...")
+
+    click.echo(f"Done: {processed} audits replayed, {changed} with different scores"
+               + (" (dry run, nothing saved)" if dry_run else ""))
+
+@app.cli.command('batch-audit')
+@click.argument('tokens_file', type=click.Path(exists=True, dir_okay=False))
+@click.option('--email', required=True, help='Account the audits are saved under (created if missing)')
+@click.option('--processes', type=int, default=None, help='Worker processes (default: BATCH_AUDIT_PROCESSES)')
+@click.option('--checkpoint', type=click.Path(dir_okay=False), default=None,
+              help='Progress file for resuming (default: TOKENS_FILE.checkpoint.json)')
+@click.option('--rate', type=float, default=None, help='API calls per second across all workers (with API_BUDGET_BACKEND=off)')
+def batch_audit(tokens_file, email, processes, checkpoint, rate):
+    """Audit every portal in TOKENS_FILE (one access token per line) and save the results"""
+    from batch_audit import read_tokens, run_batch
+    from models import User, db
+
+    email = email.lower().strip()
+    user = User.query.filter_by(email=email).first()
+    if not user:
+        user = User(email=email)
+        db.session.add(user)
+        db.session.commit()
+
+    tokens = read_tokens(tokens_file)
+    checkpoint = checkpoint or f"{tokens_file}.checkpoint.json"
+
+    def report(entry, summary):
+        finished = summary['skipped'] + summary['done'] + summary['failed']
+        outcome = (f"portal {entry['portal_id']} -> audit {entry['audit_id']}" if entry['status'] == 'done'
+                   else f"token {entry['token']} failed: {entry['error']}")
+        click.echo(f"[{finished}/{summary['total']}] {outcome} ({summary['audits_per_minute']} audits/min)")
+
+    summary = run_batch(tokens, user.id, processes=processes, checkpoint_path=checkpoint, api_rate=rate,
+                        on_result=report)
+    click.echo(f"Done: {summary['done']} audited, {summary['failed']} failed, {summary['skipped']} already done; "
+               f"{summary['api_calls']} API calls in {summary['elapsed_seconds']}s "
+               f"({summary['audits_per_minute']} audits/min)")
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""Cache of the rendered dashboard fragments of saved audits.
+
+A saved audit's score summary, detail sections and category cards only
+change when its results (content_hash), its percentile ranks or the
+templates change, so the HTML is cached under a hash of those. Each worker
+keeps recently viewed fragments in a small LRU; the dashboard_fragments table
+shares them between workers and hosts. A hit skips decoding the results and
+rendering the templates, and the same key makes the page's ETag.
+"""
+
+import os
+import json
+import zlib
+import random
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Optional
+from flask import render_template
+from markupsafe import Markup
+from results_codec import content_hash
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+
+# Fragment name -> template rendering it (dashboard.html includes the same templates when uncached)
+FRAGMENTS = {
+    'summary': 'dashboard_summary.html',
+    'details': 'detailed_sections.html',
+    'categories': 'category_cards.html',
+}
+
+MEMORY_MAX_BYTES = int(float(os.environ.get("DASHBOARD_CACHE_MEMORY_MB", "32")) * 1024 * 1024)
+SHARED_TTL = timedelta(hours=float(os.environ.get("DASHBOARD_CACHE_TTL_HOURS", "168")))
+CLEANUP_PROBABILITY = float(os.environ.get("DASHBOARD_CACHE_CLEANUP_PROBABILITY", "0.01"))
+
+_template_version = None
+
+def template_version() -> str:
+    """Hash of every template file, so a deploy that changes any of them starts a fresh cache"""
+    global _template_version
+    if _template_version is None:
+        digest = hashlib.sha256()
+        for name in sorted(os.listdir(TEMPLATE_DIR)):
+            with open(os.path.join(TEMPLATE_DIR, name), 'rb') as template:
+                digest.update(name.encode('utf-8') + b'\0' + template.read())
+        _template_version = digest.hexdigest()[:16]
+    return _template_version
+
+def fragment_key(audit_record, percentiles: Optional[Dict], show_preview: bool = False) -> Optional[str]:
+    """Cache key / ETag base for a saved audit's fragments; None for audits stored without a content hash"""
+    if not audit_record.content_hash:
+        return None
+    return content_hash({'audit': audit_record.id, 'results': audit_record.content_hash,
+                         'templates': template_version(), 'percentiles': percentiles or {},
+                         'preview': bool(show_preview)})
+
+class _MemoryTier:
+    """Per-process LRU of fragments, bounded by the size of the HTML it holds"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key -> (fragments, size)
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Dict[str, str]]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            self.entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key: str, fragments: Dict[str, str]):
+        size = sum(len(html) for html in fragments.values())
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.size -= self.entries.pop(key)[1]
+            self.entries[key] = (fragments, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.size -= evicted_size
+
+_memory = _MemoryTier(MEMORY_MAX_BYTES)
+
+def _read_shared(key: str) -> Optional[Dict[str, str]]:
+    from models import DashboardFragment, db
+    try:
+        record = db.session.get(DashboardFragment, key)
+        if record is None or record.expires_at < datetime.utcnow():
+            return None
+        return json.loads(zlib.decompress(record.data).decode('utf-8'))
+    except Exception as e:
+        logging.error(f"Dashboard cache read error: {str(e)}")
+        db.session.rollback()
+        return None
+
+def _write_shared(key: str, fragments: Dict[str, str]):
+    from models import DashboardFragment, db
+    try:
+        record = db.session.get(DashboardFragment, key)
+        if record is None:
+            record = DashboardFragment(id=key)
+            db.session.add(record)
+        record.data = zlib.compress(json.dumps(fragments).encode('utf-8'), 6)
+        record.expires_at = datetime.utcnow() + SHARED_TTL
+        db.session.commit()
+        if random.random() < CLEANUP_PROBABILITY:
+            cleanup_expired()
+    except Exception as e:
+        # Another worker stored the same fragments first, or the table is unavailable
+        logging.warning(f"Dashboard cache write skipped: {str(e)}")
+        db.session.rollback()
+
+def cleanup_expired() -> int:
+    """Remove expired fragments from the shared tier and return how many were removed"""
+    from models import DashboardFragment, db
+    removed = DashboardFragment.query.filter(DashboardFragment.expires_at < datetime.utcnow()).delete()
+    db.session.commit()
+    return removed
+
+def render_fragments(**context) -> Dict[str, str]:
+    """Render every dashboard fragment with the given template context"""
+    return {name: render_template(template, **context) for name, template in FRAGMENTS.items()}
+
+def get_fragments(key: str, render: Callable[[], Dict[str, str]]) -> Dict[str, Markup]:
+    """Fragments for a key from the memory tier, then the shared tier, calling render() on a miss"""
+    fragments = _memory.get(key)
+    if fragments is None:
+        fragments = _read_shared(key)
+        if fragments is None:
+            fragments = render()
+            _write_shared(key, fragments)
+        _memory.put(key, fragments)
+    return {name: Markup(html) for name, html in fragments.items()}
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""Minimal schema upgrades for tables that db.create_all() will not alter"""
+
+import os
+import logging
+from sqlalchemy import MetaData, inspect, text
+from app import db
+
+# Columns that used to be NOT NULL and must now accept NULL
+RELAXED_COLUMNS = [
+    ('audit_results', 'results_json'),
+    ('audit_schedules', 'refresh_token'),
+]
+
+# Postgres advisory lock key held while the schema is upgraded
+MIGRATION_LOCK_KEY = 72150328
+
+def auto_upgrade_enabled() -> bool:
+    """With DB_AUTO_UPGRADE=false the app leaves the schema to `flask db-upgrade`"""
+    return os.environ.get("DB_AUTO_UPGRADE", "true").lower() == "true"
+
+def upgrade_schema():
+    """Create missing tables, add model columns missing from existing ones and relax old NOT NULL constraints.
+
+    Safe to run on every start: processes take a database lock first, so only one
+    runs the DDL at a time, and each step checks the live schema under that lock.
+    """
+    with db.engine.begin() as connection:
+        _lock(connection)
+        db.metadata.create_all(connection)
+        _upgrade(connection)
+
+def _lock(connection):
+    """Serialize schema upgrades across processes until the transaction ends"""
+    if connection.dialect.name == 'postgresql':
+        connection.execute(text('SELECT pg_advisory_xact_lock(:key)'), {'key': MIGRATION_LOCK_KEY})
+    elif connection.dialect.name == 'sqlite':
+        # Takes the database write lock now rather than at the first write
+        connection.exec_driver_sql('BEGIN IMMEDIATE')
+
+def _upgrade(connection):
+    inspector = inspect(connection)
+    existing_tables = set(inspector.get_table_names())
+    dialect = connection.dialect
+
+    for table in db.metadata.sorted_tables:
+        existing_columns = {column['name']: column for column in inspector.get_columns(table.name)}
+
+        for column in table.columns:
+            if column.name in existing_columns:
+                continue
+            if not column.nullable and column.server_default is None:
+                logging.warning(f"Cannot add NOT NULL column {table.name}.{column.name} without a default")
+                continue
+            column_type = column.type.compile(dialect=dialect)
+            connection.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+            logging.info(f"Added column {table.name}.{column.name}")
+
+        for index in table.indexes:
+            # Indexes on newly added columns are not created by create_all either
+            index.create(connection, checkfirst=True)
+
+    for table_name, column_name in RELAXED_COLUMNS:
+        live_columns = inspector.get_columns(table_name) if table_name in existing_tables else []
+        column = next((c for c in live_columns if c['name'] == column_name), None)
+        if not column or column['nullable']:
+            continue
+        if dialect.name == 'sqlite':
+            _rebuild_sqlite_table(connection, db.metadata.tables[table_name])
+        else:
+            connection.execute(text(f'ALTER TABLE {table_name} ALTER COLUMN {column_name} DROP NOT NULL'))
+        logging.info(f"Column {table_name}.{column_name} is now nullable")
+
+def _rebuild_sqlite_table(connection, table):
+    """Recreate a table from its model definition, keeping its rows (SQLite cannot alter constraints).
+
+    Follows SQLite's recommended order - create the new table, copy, drop the old
+    one, rename the new one into place - so foreign keys in other tables that
+    point at this table keep pointing at it rather than at a renamed copy.
+    """
+    live = inspect(connection)
+    columns = ', '.join(column['name'] for column in live.get_columns(table.name) if column['name'] in table.columns)
+    for index in live.get_indexes(table.name):
+        connection.execute(text(f'DROP INDEX {index["name"]}'))
+
+    new_name = f"{table.name}__new"
+    metadata = MetaData()
+    for other in db.metadata.tables.values():
+        other.to_metadata(metadata)  # so the copy's foreign keys resolve
+    new_table = table.to_metadata(metadata, name=new_name)
+    for index in list(new_table.indexes):
+        new_table.indexes.discard(index)  # created on the final table below
+    new_table.create(connection)
+    connection.execute(text(f'INSERT INTO {new_name} ({columns}) SELECT {columns} FROM {table.name}'))
+    connection.execute(text(f'DROP TABLE {table.name}'))
+    connection.execute(text(f'ALTER TABLE {new_name} RENAME TO {table.name}'))
+    for index in table.indexes:
+        index.create(connection)
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""Streaming CSV / NDJSON exports of the detailed lists in an audit.
+
+Rows come from the stored results, or from the archived raw snapshot (every
+user, property, workflow and form HubSpot returned, not just what the results
+kept). They are encoded a batch at a time and optionally gzip-compressed on
+the fly, so the first bytes go out before the rest of the list is read.
+"""
+
+import io
+import csv
+import zlib
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+from results_codec import dumps
+
+FORMATS = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+ROWS_PER_CHUNK = 500
+
+def _day(value) -> Optional[str]:
+    return value.split('T')[0] if isinstance(value, str) and value else None
+
+def _snapshot_calls(snapshot: Dict, *methods: str) -> Iterator:
+    calls = snapshot.get('calls', {})
+    for method in methods:
+        yield method, calls.get(method) or []
+
+def _snapshot_properties(snapshot: Dict) -> Iterator[Dict]:
+    for method, properties in _snapshot_calls(snapshot, 'get_contact_properties', 'get_company_properties',
+                                              'get_deal_properties'):
+        object_type = method[len('get_'):-len('_properties')]
+        for prop in properties:
+            yield {
+                'name': prop.get('name', ''),
+                'label': prop.get('label', ''),
+                'objectType': object_type,
+                'type': prop.get('type', ''),
+                'fieldType': prop.get('fieldType', ''),
+                'groupName': prop.get('groupName', ''),
+                'hubspotDefined': prop.get('hubspotDefined', False),
+                'created': _day(prop.get('createdAt'))
+            }
+
+def _snapshot_users(snapshot: Dict) -> Iterator[Dict]:
+    for _, users in _snapshot_calls(snapshot, 'get_users'):
+        for user in users:
+            yield {
+                'firstName': user.get('firstName', ''),
+                'lastName': user.get('lastName', ''),
+                'email': user.get('email', ''),
+                'superAdmin': user.get('superAdmin', False),
+                'lastLogin': _day(user.get('lastLoginAt'))
+            }
+
+def _snapshot_workflows(snapshot: Dict) -> Iterator[Dict]:
+    for _, workflows in _snapshot_calls(snapshot, 'get_workflows'):
+        for workflow in workflows:
+            yield {
+                'name': workflow.get('name', ''),
+                'id': workflow.get('id'),
+                'type': workflow.get('type', 'workflow'),
+                'enabled': bool(workflow.get('enabled') or workflow.get('isEnabled')
+                                or str(workflow.get('status', '')).lower() == 'enabled'),
+                'created_date': _day(workflow.get('createdAt'))
+            }
+
+def _snapshot_forms(snapshot: Dict) -> Iterator[Dict]:
+    for _, forms in _snapshot_calls(snapshot, 'get_forms'):
+        for form in forms:
+            yield {
+                'name': form.get('name', ''),
+                'guid': form.get('guid') or form.get('id'),
+                'is_embedded': form.get('isPublished', False),
+                'created_date': _day(form.get('createdAt'))
+            }
+
+def _snapshot_integrations(snapshot: Dict) -> Iterator[Dict]:
+    for _, integrations in _snapshot_calls(snapshot, 'get_integrations'):
+        for integration in integrations:
+            yield {
+                'name': integration.get('name', ''),
+                'type': integration.get('integrationType', ''),
+                'enabled': integration.get('enabled', False),
+                'lastUpdated': _day(integration.get('lastUpdated'))
+            }
+
+# Exportable lists: where they live in the results, their columns, and how to
+# read them from a raw snapshot instead
+DETAIL_LISTS = {
+    'users': {
+        'category': 'admin', 'key': 'users_list',
+        'columns': ['firstName', 'lastName', 'email', 'superAdmin', 'lastLogin'],
+        'snapshot': _snapshot_users
+    },
+    'integrations': {
+        'category': 'admin', 'key': 'integrations_list',
+        'columns': ['name', 'type', 'enabled', 'lastUpdated'],
+        'snapshot': _snapshot_integrations
+    },
+    'properties': {
+        'category': 'properties', 'key': 'properties_list',
+        'columns': ['name', 'label', 'objectType', 'type', 'fieldType', 'groupName', 'hubspotDefined',
+                    'created', 'potentially_unused'],
+        'snapshot': _snapshot_properties
+    },
+    'workflows': {
+        'category': 'workflows', 'key': 'workflows_details',
+        'columns': ['name', 'id', 'type', 'enabled', 'created_date'],
+        'snapshot': _snapshot_workflows
+    },
+    'forms': {
+        'category': 'forms', 'key': 'forms_details',
+        'columns': ['name', 'guid', 'is_embedded', 'submissions_30d', 'created_date'],
+        'snapshot': _snapshot_forms
+    },
+}
+
+def rows_from_results(list_name: str, audit_results: Dict) -> Iterable[Dict]:
+    spec = DETAIL_LISTS[list_name]
+    category = audit_results.get(spec['category'])
+    if not isinstance(category, dict):
+        return []
+    return (category.get('metrics') or {}).get(spec['key']) or []
+
+def rows_from_snapshot(list_name: str, snapshot: Dict) -> Iterable[Dict]:
+    return DETAIL_LISTS[list_name]['snapshot'](snapshot)
+
+# Spreadsheet apps run cells starting with these as formulas
+_FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+def _csv_cell(value):
+    """Quote a text cell so a name or label from the portal cannot inject a formula"""
+    if isinstance(value, str) and value.startswith(_FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+def _csv_chunks(rows: Iterable[Dict], columns: List[str]) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=columns, extrasaction='ignore')
+    writer.writeheader()
+    for count, row in enumerate(rows, 1):
+        if not isinstance(row, dict):
+            row = {columns[0]: row}
+        writer.writerow({column: _csv_cell(row.get(column)) for column in columns})
+        if count % ROWS_PER_CHUNK == 0:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
+
+def _ndjson_chunks(rows: Iterable[Dict], columns: List[str]) -> Iterator[bytes]:
+    batch = []
+    for row in rows:
+        if not isinstance(row, dict):
+            row = {columns[0]: row}
+        batch.append(dumps({column: row.get(column) for column in columns}))
+        if len(batch) >= ROWS_PER_CHUNK:
+            yield b'\n'.join(batch) + b'\n'
+            batch = []
+    if batch:
+        yield b'\n'.join(batch) + b'\n'
+
+def _gzip_chunks(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31: gzip container
+    for chunk in chunks:
+        # Sync flush so every batch reaches the client instead of waiting in the compressor
+        data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
+
+def stream_list(list_name: str, rows: Iterable[Dict], fmt: str, gzip: bool = False) -> Iterator[bytes]:
+    """Encoded (and optionally gzipped) chunks of a detailed list"""
+    columns = DETAIL_LISTS[list_name]['columns']
+    encode: Callable = _csv_chunks if fmt == 'csv' else _ndjson_chunks
+    chunks = encode(rows, columns)
+    return _gzip_chunks(chunks) if gzip else chunks
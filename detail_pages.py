@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""Paged, sorted and filtered views of the detailed lists in an audit.
+
+The dashboard fetches each detail section as JSON pages while it scrolls into
+view instead of rendering every row inline. Lists are read from the stored
+results (defined in detail_export.DETAIL_LISTS) and paged with an opaque
+cursor holding the offset and the sort/filter it was issued for, so a cursor
+cannot be replayed against a different view of the list.
+"""
+
+import base64
+import hashlib
+from typing import Dict, Iterable, List, Optional, Tuple
+from detail_export import DETAIL_LISTS
+
+DEFAULT_PAGE_SIZE = 25
+MAX_PAGE_SIZE = 200
+
+# Nested data the dashboard shows per row but the flat exports leave out
+DISPLAY_FIELDS = {
+    'forms': ['fields'],
+    'workflows': ['actions'],
+}
+
+class PageRequestError(ValueError):
+    """Raised for an unknown sort column, filter or a cursor that does not fit the request"""
+
+def page_fields(list_name: str) -> List[str]:
+    return DETAIL_LISTS[list_name]['columns'] + DISPLAY_FIELDS.get(list_name, [])
+
+def _view_signature(sort: Optional[str], descending: bool, query: str, filters: Dict[str, object]) -> str:
+    raw = f"{sort}|{descending}|{query}|{sorted(filters.items())}"
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()[:12]
+
+def encode_cursor(offset: int, signature: str) -> str:
+    return base64.urlsafe_b64encode(f"{offset}|{signature}".encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor: str) -> Optional[Tuple[int, str]]:
+    """Inverse of encode_cursor; None for a malformed cursor"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8')
+        offset, signature = raw.split('|', 1)
+        return max(0, int(offset)), signature
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+def _filter_value(value: str):
+    lowered = value.lower()
+    if lowered in ('true', 'false'):
+        return lowered == 'true'
+    return value
+
+def _matches(row: Dict, query: str, filters: Dict[str, object]) -> bool:
+    for column, expected in filters.items():
+        value = row.get(column)
+        if isinstance(expected, bool):
+            if bool(value) != expected:
+                return False
+        elif str(value if value is not None else '').lower() != str(expected).lower():
+            return False
+    if query:
+        return any(isinstance(value, str) and query in value.lower() for value in row.values())
+    return True
+
+def _sort_key(column: str):
+    def key(row: Dict):
+        value = row.get(column)
+        if isinstance(value, (bool, int, float)):
+            return (0, float(value), '')
+        return (1, 0, str(value).lower())
+    return key
+
+def list_page(list_name: str, rows: Iterable[Dict], cursor: Optional[str] = None,
+              limit: int = DEFAULT_PAGE_SIZE, sort: Optional[str] = None, order: str = 'asc',
+              query: Optional[str] = None, filters: Optional[Dict[str, str]] = None) -> Dict:
+    """One page of a detailed list.
+
+    filters maps column names to the value they must equal ('true'/'false'
+    for flags); query is a case-insensitive substring matched against the
+    text columns. Rows keep their stored order unless sort names a column.
+    """
+    columns = DETAIL_LISTS[list_name]['columns']
+    fields = page_fields(list_name)
+    if sort and sort not in columns:
+        raise PageRequestError(f"Cannot sort by '{sort}'; columns: {', '.join(columns)}")
+    unknown = [column for column in (filters or {}) if column not in columns]
+    if unknown:
+        raise PageRequestError(f"Cannot filter by {', '.join(unknown)}; columns: {', '.join(columns)}")
+    descending = order == 'desc'
+    query = (query or '').strip().lower()
+    parsed_filters = {column: _filter_value(value) for column, value in (filters or {}).items()}
+    signature = _view_signature(sort, descending, query, parsed_filters)
+
+    offset = 0
+    if cursor:
+        decoded = decode_cursor(cursor)
+        if decoded is None or decoded[1] != signature:
+            raise PageRequestError('Invalid cursor for this sort and filter')
+        offset = decoded[0]
+    limit = max(1, min(MAX_PAGE_SIZE, limit))
+
+    rows = [row if isinstance(row, dict) else {columns[0]: row} for row in rows]
+    total = len(rows)
+    if query or parsed_filters:
+        rows = [row for row in rows if _matches(row, query, parsed_filters)]
+    if sort:
+        # Blanks stay last: sort the present values, then append the blanks
+        present = [row for row in rows if row.get(sort) not in (None, '')]
+        blank = [row for row in rows if row.get(sort) in (None, '')]
+        rows = sorted(present, key=_sort_key(sort), reverse=descending) + blank
+
+    page = rows[offset:offset + limit]
+    next_offset = offset + len(page)
+    return {
+        'list': list_name,
+        'columns': columns,
+        'total': total,
+        'matched': len(rows),
+        'items': [{field: row.get(field) for field in fields} for row in page],
+        'next_cursor': encode_cursor(next_offset, signature) if next_offset < len(rows) else None
+    }
@@ -24,15 +24,8 @@ def save_audit_results(email, audit_results):
             db.session.add(user)
             db.session.commit()
         
-        # Create audit record
-        audit_record = AuditResult()
-        audit_record.user_id = user.id
-        audit_record.overall_score = audit_results.get('overall_score', 0)
-        audit_record.overall_grade = audit_results.get('overall_grade', 'F')
-        audit_record.hubspot_portal_id = audit_results.get('portal_info', {}).get('portalId')
-        
-        # Store full results as JSON
-        audit_record.set_results_dict(audit_results)
+        # Create audit record (full results plus per-category metrics rows)
+        audit_record = AuditResult.from_results(user.id, audit_results)
         
         db.session.add(audit_record)
         db.session.commit()
@@ -3,10 +3,16 @@ import requests
 import logging
 from urllib.parse import urlencode
 from typing import Dict, List, Optional
+from api_budget import ApiBudgetExhausted
 
 class HubSpotService:
     """Service class for HubSpot API interactions"""
     
+    # Process-wide defaults: a pooled requests.Session to reuse connections, and a
+    # rate limiter whose acquire(access_token) blocks until the next API call may be made
+    http_session = None
+    rate_limiter = None
+    
     def __init__(self, access_token=None):
         self.access_token = access_token
         self.client_id = os.environ.get("HUBSPOT_CLIENT_ID")
@@ -30,6 +36,13 @@ class HubSpotService:
         
         # Log scope information for debugging
         logging.debug(f"Configured scopes: {', '.join(self.scopes)}")
+        
+        # API call accounting - on_api_call(endpoint, status_code) is set by progress listeners
+        self.api_call_count = 0
+        self.on_api_call = None
+        # Set once the shared API budget refuses a call; AuditEngine then fails the audit
+        # rather than scoring the empty results the getters fall back to
+        self.budget_error = None
     
     def get_authorization_url(self) -> str:
         """Generate HubSpot OAuth authorization URL"""
@@ -68,8 +81,54 @@ class HubSpotService:
             logging.error(f"Token exchange error: {str(e)}")
             return None
     
+    def refresh_access_token(self, refresh_token: str) -> Optional[Dict]:
+        """Exchange a refresh token for a new access token (used for scheduled audits)"""
+        try:
+            data = {
+                'grant_type': 'refresh_token',
+                'client_id': self.client_id,
+                'client_secret': self.client_secret,
+                'redirect_uri': self.redirect_uri,
+                'refresh_token': refresh_token
+            }
+            
+            response = requests.post(
+                'https://api.hubapi.com/oauth/v1/token',
+                data=data,
+                headers={'Content-Type': 'application/x-www-form-urlencoded'}
+            )
+            
+            if response.status_code == 200:
+                return response.json()
+            else:
+                logging.error(f"Token refresh failed: {response.status_code} - {response.text}")
+                return None
+                
+        except Exception as e:
+            logging.error(f"Token refresh error: {str(e)}")
+            return None
+    
+    def get_token_info(self) -> Optional[Dict]:
+        """Metadata of the access token: hub_id, user and the scopes granted to it"""
+        try:
+            response = (self.http_session or requests).get(
+                f'https://api.hubapi.com/oauth/v1/access-tokens/{self.access_token}')
+            if response.status_code == 200:
+                return response.json()
+            logging.error(f"Token info lookup failed: {response.status_code}")
+            return None
+        except Exception as e:
+            logging.error(f"Token info lookup error: {str(e)}")
+            return None
+    
     def _make_api_call(self, endpoint: str, params: Dict = None) -> Optional[Dict]:
         """Make authenticated API call to HubSpot"""
+        if self.rate_limiter is not None:
+            try:
+                self.rate_limiter.acquire(self.access_token)
+            except ApiBudgetExhausted as e:
+                self.budget_error = e
+                raise
         try:
             headers = {
                 'Authorization': f'Bearer {self.access_token}',
@@ -78,7 +137,8 @@ class HubSpotService:
             
             url = f"{self.base_url}{endpoint}"
             logging.debug(f"Making API call to: {url}")
-            response = requests.get(url, headers=headers, params=params)
+            response = (self.http_session or requests).get(url, headers=headers, params=params)
+            self._record_api_call(endpoint, response.status_code)
             
             logging.debug(f"API Response: {endpoint} - Status: {response.status_code}")
             
@@ -99,6 +159,24 @@ class HubSpotService:
             logging.error(f"API call error for {endpoint}: {str(e)}")
             return None
     
+    def _record_api_call(self, endpoint: str, status_code: int):
+        """Count an API call and notify the progress listener, if any"""
+        self.api_call_count += 1
+        if self.on_api_call:
+            try:
+                self.on_api_call(endpoint, status_code)
+            except Exception as e:
+                logging.error(f"API call listener error: {str(e)}")
+    
+    def get_account_info(self) -> Dict:
+        """Get portal id and account details"""
+        try:
+            data = self._make_api_call('/account-info/v3/details')
+            return data if data else {}
+        except Exception as e:
+            logging.error(f"Error fetching account info: {str(e)}")
+            return {}
+    
     def get_users(self) -> List[Dict]:
         """Get all users from HubSpot"""
         try:
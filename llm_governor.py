@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+"""Latency and cost governor for OpenAI calls made by the AI analyzer"""
+
+import os
+import time
+import random
+import logging
+import threading
+from collections import deque
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+import openai
+from openai import OpenAI
+
+# Errors worth retrying - everything else (bad request, auth) fails immediately
+TRANSIENT_ERRORS = (
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+)
+
+# How often a process re-reads the shared daily token count between its own calls
+SHARED_USAGE_REFRESH_SECONDS = 15
+
+class DatabaseUsageStore:
+    """Daily token counter in the llm_usage table, so the budget holds across processes"""
+
+    def __init__(self, engine):
+        from models import LLMUsage
+        self.engine = engine
+        self.table = LLMUsage.__table__
+
+    def add(self, day: str, tokens: int) -> int:
+        """Add tokens to the day's count and return the new total"""
+        from sqlalchemy import insert, select, update
+        from sqlalchemy.exc import IntegrityError
+        table = self.table
+        for _ in range(2):
+            try:
+                with self.engine.begin() as connection:
+                    result = connection.execute(update(table).where(table.c.day == day)
+                                                .values(tokens=table.c.tokens + tokens))
+                    if result.rowcount == 0:
+                        connection.execute(insert(table).values(day=day, tokens=tokens))
+                    return connection.execute(select(table.c.tokens).where(table.c.day == day)).scalar()
+            except IntegrityError:
+                continue  # another process inserted the day's row first; add to it
+        return self.total(day)
+
+    def total(self, day: str) -> int:
+        from sqlalchemy import select
+        with self.engine.connect() as connection:
+            return connection.execute(select(self.table.c.tokens).where(self.table.c.day == day)).scalar() or 0
+
+
+class LLMGovernor:
+    """Wrap chat completions with deadlines, retries, usage accounting and model fallback.
+
+    Degradation order: the primary model, then the smaller fallback model once the
+    primary's recent latency exceeds the latency budget, then no model at all (the
+    caller uses its deterministic templates) once the daily token budget is spent.
+    The daily count is shared through usage_store when one is installed.
+    """
+
+    # Set by install_llm_usage_store; None keeps the count per process
+    usage_store = None
+
+    def __init__(self, client: OpenAI = None):
+        self.primary_model = os.environ.get("OPENAI_MODEL", "gpt-4o")
+        self.fallback_model = os.environ.get("OPENAI_FALLBACK_MODEL", "gpt-4o-mini")
+        self.request_deadline = float(os.environ.get("LLM_REQUEST_DEADLINE", "45"))
+        self.max_retries = int(os.environ.get("LLM_MAX_RETRIES", "2"))
+        self.backoff_base = float(os.environ.get("LLM_BACKOFF_BASE", "1.0"))
+        self.latency_budget = float(os.environ.get("LLM_LATENCY_BUDGET", "20"))
+        self.daily_token_budget = int(os.environ.get("LLM_DAILY_TOKEN_BUDGET", "2000000"))
+        self.latency_window = int(os.environ.get("LLM_LATENCY_WINDOW", "20"))
+        # Old samples age out so a degraded model gets re-tried once things calm down
+        self.latency_window_seconds = float(os.environ.get("LLM_LATENCY_WINDOW_SECONDS", "300"))
+
+        # Retries are handled here so the SDK must not retry on its own
+        self.client = client or OpenAI(api_key=os.environ.get("OPENAI_API_KEY"), max_retries=0)
+
+        self._lock = threading.Lock()
+        self._day = self._today()
+        self._tokens_today = 0
+        self._shared_read_at = 0.0
+        self._recent_latency = {}  # model -> deque of (recorded_at, latency)
+        self._model_stats = {}  # model -> counters
+        self._template_fallbacks = 0
+
+    def complete(self, messages: List[Dict], max_tokens: int, temperature: float,
+                 response_format: Dict = None) -> Optional[str]:
+        """Return completion text, or None when the caller should use its templates"""
+        model = self.select_model()
+        if model is None:
+            with self._lock:
+                self._template_fallbacks += 1
+            logging.warning("LLM budget exhausted - using deterministic templates")
+            return None
+
+        deadline = time.monotonic() + self.request_deadline
+        content = self._complete_with_retries(model, messages, max_tokens, temperature,
+                                              response_format, deadline)
+        if content is None and model != self.fallback_model and time.monotonic() < deadline:
+            # Primary model kept failing - give the cheaper model one shot before templates
+            logging.warning(f"LLM {model} failed, retrying on fallback model {self.fallback_model}")
+            content = self._complete_with_retries(self.fallback_model, messages, max_tokens,
+                                                  temperature, response_format, deadline)
+
+        if content is None:
+            with self._lock:
+                self._template_fallbacks += 1
+        return content
+
+    def select_model(self) -> Optional[str]:
+        """Pick the model to use given the current latency and token budgets"""
+        self._refresh_shared_usage()
+        with self._lock:
+            self._roll_day()
+            return self._active_model_locked()
+
+    def get_stats(self) -> Dict:
+        """Snapshot of usage and latency counters for the metrics endpoint"""
+        with self._lock:
+            self._roll_day()
+            models = {}
+            for model, stats in self._model_stats.items():
+                calls = stats['calls']
+                models[model] = dict(stats)
+                models[model]['avg_latency_seconds'] = round(stats['total_latency'] / calls, 3) if calls else 0
+                models[model]['recent_avg_latency_seconds'] = round(self._average_latency(model), 3)
+                models[model]['total_latency'] = round(stats['total_latency'], 3)
+
+            return {
+                'day': self._day,
+                'tokens_today': self._tokens_today,
+                'shared_budget': self.usage_store is not None,
+                'daily_token_budget': self.daily_token_budget,
+                'latency_budget_seconds': self.latency_budget,
+                'request_deadline_seconds': self.request_deadline,
+                'primary_model': self.primary_model,
+                'fallback_model': self.fallback_model,
+                'active_model': self._active_model_locked(),
+                'template_fallbacks': self._template_fallbacks,
+                'models': models
+            }
+
+    def _complete_with_retries(self, model: str, messages: List[Dict], max_tokens: int,
+                               temperature: float, response_format: Optional[Dict],
+                               deadline: float) -> Optional[str]:
+        """Call one model, retrying transient errors with backoff until the deadline"""
+        for attempt in range(self.max_retries + 1):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                logging.warning(f"LLM deadline reached before {model} attempt {attempt + 1}")
+                return None
+
+            kwargs = {
+                'model': model,
+                'messages': messages,
+                'max_tokens': max_tokens,
+                'temperature': temperature,
+                'timeout': remaining
+            }
+            if response_format:
+                kwargs['response_format'] = response_format
+
+            started = time.monotonic()
+            try:
+                response = self.client.chat.completions.create(**kwargs)
+                self._record_success(model, response, time.monotonic() - started)
+                return response.choices[0].message.content
+            except TRANSIENT_ERRORS as e:
+                self._record_error(model, time.monotonic() - started, retried=attempt < self.max_retries)
+                logging.warning(f"LLM transient error on {model} (attempt {attempt + 1}): {str(e)}")
+                if attempt < self.max_retries:
+                    backoff = self.backoff_base * (2 ** attempt) * (0.5 + random.random())
+                    time.sleep(max(0, min(backoff, deadline - time.monotonic())))
+            except Exception as e:
+                self._record_error(model, time.monotonic() - started, retried=False)
+                logging.error(f"LLM error on {model}: {str(e)}")
+                return None
+
+        return None
+
+    def _record_success(self, model: str, response, latency: float):
+        """Account tokens and latency for a completed call"""
+        usage = getattr(response, 'usage', None)
+        prompt_tokens = getattr(usage, 'prompt_tokens', 0) or 0
+        completion_tokens = getattr(usage, 'completion_tokens', 0) or 0
+
+        with self._lock:
+            self._roll_day()
+            stats = self._stats_for(model)
+            stats['calls'] += 1
+            stats['prompt_tokens'] += prompt_tokens
+            stats['completion_tokens'] += completion_tokens
+            stats['total_latency'] += latency
+            self._tokens_today += prompt_tokens + completion_tokens
+            self._latencies_for(model).append((time.monotonic(), latency))
+            day = self._day
+
+        if self.usage_store is not None and prompt_tokens + completion_tokens:
+            try:
+                total = self.usage_store.add(day, prompt_tokens + completion_tokens)
+                with self._lock:
+                    if self._day == day:
+                        self._tokens_today = max(self._tokens_today, total)
+                        self._shared_read_at = time.monotonic()
+            except Exception as e:
+                logging.error(f"LLM usage store error: {str(e)}")
+
+        logging.debug(f"LLM {model}: {prompt_tokens}+{completion_tokens} tokens in {latency:.2f}s")
+
+    def _refresh_shared_usage(self):
+        """Pick up tokens spent by other processes, at most every SHARED_USAGE_REFRESH_SECONDS"""
+        if self.usage_store is None or time.monotonic() - self._shared_read_at < SHARED_USAGE_REFRESH_SECONDS:
+            return
+        day = self._today()
+        try:
+            total = self.usage_store.total(day)
+        except Exception as e:
+            logging.error(f"LLM usage store error: {str(e)}")
+            return
+        with self._lock:
+            self._roll_day()
+            if self._day == day:
+                self._tokens_today = max(self._tokens_today, total)
+            self._shared_read_at = time.monotonic()
+
+    def _record_error(self, model: str, latency: float, retried: bool):
+        """Account a failed call - timeouts count against the latency budget"""
+        with self._lock:
+            stats = self._stats_for(model)
+            stats['errors'] += 1
+            if retried:
+                stats['retries'] += 1
+            self._latencies_for(model).append((time.monotonic(), latency))
+
+    def _stats_for(self, model: str) -> Dict:
+        if model not in self._model_stats:
+            self._model_stats[model] = {
+                'calls': 0,
+                'errors': 0,
+                'retries': 0,
+                'prompt_tokens': 0,
+                'completion_tokens': 0,
+                'total_latency': 0.0
+            }
+        return self._model_stats[model]
+
+    def _latencies_for(self, model: str) -> deque:
+        if model not in self._recent_latency:
+            self._recent_latency[model] = deque(maxlen=self.latency_window)
+        return self._recent_latency[model]
+
+    def _average_latency(self, model: str) -> float:
+        cutoff = time.monotonic() - self.latency_window_seconds
+        latencies = [latency for recorded_at, latency in self._recent_latency.get(model, ()) if recorded_at >= cutoff]
+        return sum(latencies) / len(latencies) if latencies else 0.0
+
+    def _active_model_locked(self) -> Optional[str]:
+        if self._tokens_today >= self.daily_token_budget:
+            return None
+        if self._average_latency(self.primary_model) <= self.latency_budget:
+            return self.primary_model
+        if self._average_latency(self.fallback_model) <= self.latency_budget:
+            return self.fallback_model
+        return None
+
+    def _roll_day(self):
+        """Reset the daily token counter at UTC midnight"""
+        today = self._today()
+        if today != self._day:
+            self._day = today
+            self._tokens_today = 0
+
+    @staticmethod
+    def _today() -> str:
+        return datetime.now(timezone.utc).strftime('%Y-%m-%d')
+
+_governor = None
+_governor_lock = threading.Lock()
+
+def get_llm_governor() -> LLMGovernor:
+    """Return the per-process governor so budgets are shared by every analyzer"""
+    global _governor
+    with _governor_lock:
+        if _governor is None:
+            _governor = LLMGovernor()
+        return _governor
+
+def install_llm_usage_store(app):
+    """Count the daily token budget in the database for every process (call in an app context)"""
+    from models import db
+    LLMGovernor.usage_store = DatabaseUsageStore(db.engine)
@@ -1,6 +1,9 @@
 from app import db
 from datetime import datetime
 import json
+import os
+from results_codec import CODEC_ZLIB_JSON, CODEC_ZLIB_PATCH, CODEC_REF, content_hash, encode_results, decode_results
+from results_delta import diff, apply_patch
 
 class User(db.Model):
     __tablename__ = 'users'
@@ -15,12 +18,25 @@ class User(db.Model):
 
 class AuditResult(db.Model):
     __tablename__ = 'audit_results'
+    __table_args__ = (
+        # Portal history is read newest-first with keyset pagination on (timestamp, id)
+        db.Index('ix_audit_results_portal_time_id', 'hubspot_portal_id', 'audit_timestamp', 'id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     
-    # Store audit data as JSON
-    results_json = db.Column(db.Text, nullable=False)  # JSON string of audit results
+    # Audit data, zlib-compressed JSON - deferred so listing queries never load it
+    results_blob = db.deferred(db.Column(db.LargeBinary, nullable=True))
+    results_codec = db.Column(db.String(16), nullable=True)
+    results_json = db.deferred(db.Column(db.Text, nullable=True))  # legacy uncompressed JSON, see migrate-results
+    
+    # Recurring audits of a portal are stored as a patch against (or a reference to) a base audit
+    content_hash = db.Column(db.String(64), nullable=True, index=True)
+    base_audit_id = db.Column(db.Integer, db.ForeignKey('audit_results.id'), nullable=True, index=True)
+    
+    # Raw HubSpot data the audit was computed from (see snapshot_store)
+    snapshot_hash = db.Column(db.String(64), db.ForeignKey('portal_snapshots.id'), nullable=True, index=True)
     overall_score = db.Column(db.Float, nullable=True)
     overall_grade = db.Column(db.String(2), nullable=True)
     
@@ -32,10 +48,397 @@ class AuditResult(db.Model):
     ai_summary = db.Column(db.Text, nullable=True)  # AI-generated summary
     ai_recommendations = db.Column(db.Text, nullable=True)  # AI-generated recommendations
     
+    # Per-category scores and metrics, kept in step with the results by set_results_dict
+    category_metrics = db.relationship('AuditCategoryMetrics', backref='audit_result', lazy=True,
+                                       cascade='all, delete-orphan')
+    
+    @classmethod
+    def from_results(cls, user_id, audit_results):
+        """Build a record (with its category metrics rows) from an audit results dict"""
+        audit_record = cls()
+        audit_record.user_id = user_id
+        audit_record.overall_score = audit_results.get('overall_score', 0)
+        audit_record.overall_grade = audit_results.get('overall_grade', 'F')
+        audit_record.hubspot_portal_id = (audit_results.get('portal_info') or {}).get('portalId')
+        audit_record.audit_timestamp = datetime.utcnow()
+        audit_record.snapshot_hash = audit_results.get('snapshot_id')
+        audit_record.set_results_dict(audit_results)
+        return audit_record
+    
+    def get_results_dict(self):
+        """Decode the stored results, resolving patches and references against the base audit"""
+        if self.results_codec == CODEC_REF:
+            return db.session.get(AuditResult, self.base_audit_id).get_results_dict()
+        if self.results_codec == CODEC_ZLIB_PATCH:
+            base_results = db.session.get(AuditResult, self.base_audit_id).get_results_dict()
+            return apply_patch(base_results, decode_results(self.results_blob, self.results_codec))
+        if self.results_blob is not None:
+            return decode_results(self.results_blob, self.results_codec)
+        return json.loads(self.results_json) if self.results_json else {}
+    
+    def set_results_dict(self, results_dict):
+        """Store results, first moving any audits stored against this one onto a new base"""
+        dependents = AuditResult.query.filter_by(base_audit_id=self.id).all() if self.id is not None else []
+        references = [row for row in dependents if row.results_codec == CODEC_REF]
+        
+        if references:
+            # A reference has exactly our old content, so it inherits our stored form
+            # and every other dependent is pointed at it unchanged
+            heir = references[0]
+            heir.results_blob = self.results_blob
+            heir.results_codec = self.results_codec
+            heir.base_audit_id = self.base_audit_id
+            for row in dependents:
+                if row is not heir:
+                    row.base_audit_id = heir.id
+            self._encode_results(results_dict)
+        elif dependents:
+            # Only patches (so we are a keyframe): stay one and re-diff them against the new content
+            old_results = [(row, row.get_results_dict()) for row in dependents]
+            self._store_full(results_dict)
+            for row, row_results in old_results:
+                row._rebase_onto(self, results_dict, row_results)
+        else:
+            self._encode_results(results_dict)
+        self.sync_category_metrics(results_dict)
+    
+    def _encode_results(self, results_dict):
+        """Store as a reference, a patch against the portal's latest keyframe, or a new keyframe"""
+        results_hash = content_hash(results_dict)
+        
+        if self.hubspot_portal_id:
+            same_portal = AuditResult.query.filter(AuditResult.hubspot_portal_id == self.hubspot_portal_id,
+                                                   AuditResult.results_blob.isnot(None))
+            if self.id is not None:
+                same_portal = same_portal.filter(AuditResult.id != self.id)
+            
+            duplicate = same_portal.filter(AuditResult.content_hash == results_hash).first()
+            if duplicate:
+                self._store_ref(duplicate, results_hash)
+                return
+            
+            keyframe = self._find_keyframe(same_portal)
+            if keyframe:
+                full_blob = encode_results(results_dict)
+                patch_blob = encode_results(diff(keyframe.get_results_dict(), results_dict))
+                # A patch that is most of the full size is not worth the extra read
+                if len(patch_blob) <= float(os.environ.get("RESULTS_MAX_PATCH_RATIO", "0.5")) * len(full_blob):
+                    self.results_blob = patch_blob
+                    self.results_codec = CODEC_ZLIB_PATCH
+                    self.base_audit_id = keyframe.id
+                    self.content_hash = results_hash
+                    self.results_json = None
+                    return
+        
+        self._store_full(results_dict, results_hash)
+    
+    @staticmethod
+    def _find_keyframe(same_portal):
+        """Newest recent keyframe of the portal that has room for another patch"""
+        keyframe_interval = int(os.environ.get("RESULTS_KEYFRAME_INTERVAL", "10"))
+        candidates = (same_portal.filter(AuditResult.results_codec == CODEC_ZLIB_JSON)
+                      .order_by(AuditResult.audit_timestamp.desc(), AuditResult.id.desc())
+                      .limit(3))
+        for keyframe in candidates:
+            patches = AuditResult.query.filter_by(base_audit_id=keyframe.id, results_codec=CODEC_ZLIB_PATCH).count()
+            if patches < keyframe_interval - 1:
+                return keyframe
+        return None
+    
+    def _store_full(self, results_dict, results_hash=None):
+        self.results_blob = encode_results(results_dict)
+        self.results_codec = CODEC_ZLIB_JSON
+        self.base_audit_id = None
+        self.content_hash = results_hash or content_hash(results_dict)
+        self.results_json = None
+    
+    def _store_ref(self, duplicate, results_hash):
+        self.results_blob = None
+        self.results_codec = CODEC_REF
+        self.base_audit_id = duplicate.id
+        self.content_hash = results_hash
+        self.results_json = None
+    
+    def _rebase_onto(self, keyframe, keyframe_results, results_dict):
+        """Re-encode a patch against its rewritten keyframe, or make it a keyframe itself"""
+        if self.content_hash == keyframe.content_hash:
+            self._store_ref(keyframe, self.content_hash)
+            return
+        full_blob = encode_results(results_dict)
+        patch_blob = encode_results(diff(keyframe_results, results_dict))
+        if len(patch_blob) <= float(os.environ.get("RESULTS_MAX_PATCH_RATIO", "0.5")) * len(full_blob):
+            self.results_blob = patch_blob
+            self.results_codec = CODEC_ZLIB_PATCH
+            self.base_audit_id = keyframe.id
+        else:
+            self._store_full(results_dict, self.content_hash)
+    
+    def sync_category_metrics(self, results_dict):
+        """Create or update one AuditCategoryMetrics row per scored category"""
+        existing = {row.category: row for row in self.category_metrics}
+        for category, data in results_dict.items():
+            if not isinstance(data, dict) or 'score' not in data:
+                continue
+            row = existing.get(category)
+            if row is None:
+                row = AuditCategoryMetrics(category=category)
+                self.category_metrics.append(row)
+            row.hubspot_portal_id = self.hubspot_portal_id
+            row.audit_timestamp = self.audit_timestamp
+            row.score = data.get('score')
+            row.grade = data.get('grade')
+            row.status = data.get('status')
+            row.critical_issue_count = len(data.get('critical_issues', []))
+            metrics = data.get('metrics', {})
+            for column in AuditCategoryMetrics.METRIC_COLUMNS:
+                value = metrics.get(column)
+                setattr(row, column, value if isinstance(value, (int, float)) and not isinstance(value, bool) else None)
+
+class PortalSnapshot(db.Model):
+    __tablename__ = 'portal_snapshots'
+    
+    id = db.Column(db.String(64), primary_key=True)  # SHA-256 of the snapshot content
+    hubspot_portal_id = db.Column(db.String(255), nullable=True, index=True)
+    data = db.deferred(db.Column(db.LargeBinary, nullable=False))  # zlib-compressed snapshot JSON
+    raw_size = db.Column(db.Integer, nullable=True)
+    stored_size = db.Column(db.Integer, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class PortalLiveSnapshot(db.Model):
+    """A portal's latest raw data, patched in place by HubSpot webhooks (see portal_changes)"""
+    __tablename__ = 'portal_live_snapshots'
+    
+    hubspot_portal_id = db.Column(db.String(255), primary_key=True)
+    data = db.deferred(db.Column(db.LargeBinary, nullable=False))  # zlib-compressed snapshot JSON
+    results_blob = db.deferred(db.Column(db.LargeBinary, nullable=False))  # audit results for that data
+    
+    # {"dirty": [categories], "pending": {object key: fetch}, "seen": {object key: occurredAt}}
+    changes_json = db.Column(db.Text, nullable=False, default='{}')
+    event_count = db.Column(db.Integer, nullable=False, default=0)
+    
+    audited_at = db.Column(db.DateTime, nullable=False)  # last full audit; incremental ones build on it
+    # Hash of the scopes granted to the token that fetched the data; only tokens with the
+    # same scopes may be audited from it, so no token sees data it could not fetch itself
+    scopes_key = db.Column(db.String(64), nullable=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    # Concurrent webhook deliveries and audits of one portal must not overwrite each other's patches
+    __mapper_args__ = {'version_id_col': version}
+    
+    def get_changes(self):
+        changes = json.loads(self.changes_json) if self.changes_json else {}
+        changes.setdefault('dirty', [])
+        changes.setdefault('pending', {})
+        changes.setdefault('seen', {})
+        return changes
+    
+    def set_changes(self, changes):
+        self.changes_json = json.dumps(changes)
+
+class AuditCategoryMetrics(db.Model):
+    __tablename__ = 'audit_category_metrics'
+    __table_args__ = (
+        db.UniqueConstraint('audit_result_id', 'category', name='uq_audit_category_metrics_audit_category'),
+        db.Index('ix_audit_category_metrics_portal_category_time', 'hubspot_portal_id', 'category', 'audit_timestamp'),
+        db.Index('ix_audit_category_metrics_category_time', 'category', 'audit_timestamp'),
+    )
+    
+    # Numeric metrics copied from each category's 'metrics'; a column stays NULL for
+    # categories that do not report it
+    METRIC_COLUMNS = [
+        'total_users', 'super_admins_count', 'active_integrations_count',
+        'total_custom_properties', 'unused_properties_count', 'unused_percentage', 'potentially_redundant',
+        'total_workflows', 'active_workflows', 'inactive_workflows', 'inactive_percentage',
+        'total_forms', 'unembedded_percentage', 'unused_forms_count', 'unused_forms_percentage', 'total_submissions_30d',
+        'common_fields_count',
+        'total_dashboards', 'total_reports', 'custom_reports',
+        'total_pipelines', 'unassigned_deals_percentage'
+    ]
+    
+    id = db.Column(db.Integer, primary_key=True)
+    audit_result_id = db.Column(db.Integer, db.ForeignKey('audit_results.id', ondelete='CASCADE'), nullable=False, index=True)
+    category = db.Column(db.String(32), nullable=False)
+    
+    # Copied from the audit so analytics queries need no join
+    hubspot_portal_id = db.Column(db.String(255), nullable=True)
+    audit_timestamp = db.Column(db.DateTime, nullable=True)
+    
+    score = db.Column(db.Float, nullable=True)  # NULL when the category could not be audited
+    grade = db.Column(db.String(2), nullable=True)
+    status = db.Column(db.String(32), nullable=True)  # e.g. insufficient_permissions
+    critical_issue_count = db.Column(db.Integer, default=0)
+    
+    total_users = db.Column(db.Integer, nullable=True)
+    super_admins_count = db.Column(db.Integer, nullable=True)
+    active_integrations_count = db.Column(db.Integer, nullable=True)
+    total_custom_properties = db.Column(db.Integer, nullable=True)
+    unused_properties_count = db.Column(db.Integer, nullable=True)
+    unused_percentage = db.Column(db.Float, nullable=True)
+    potentially_redundant = db.Column(db.Integer, nullable=True)
+    total_workflows = db.Column(db.Integer, nullable=True)
+    active_workflows = db.Column(db.Integer, nullable=True)
+    inactive_workflows = db.Column(db.Integer, nullable=True)
+    inactive_percentage = db.Column(db.Float, nullable=True)
+    total_forms = db.Column(db.Integer, nullable=True)
+    unembedded_percentage = db.Column(db.Float, nullable=True)
+    unused_forms_count = db.Column(db.Integer, nullable=True)
+    unused_forms_percentage = db.Column(db.Float, nullable=True)
+    total_submissions_30d = db.Column(db.Integer, nullable=True)
+    common_fields_count = db.Column(db.Integer, nullable=True)
+    total_dashboards = db.Column(db.Integer, nullable=True)
+    total_reports = db.Column(db.Integer, nullable=True)
+    custom_reports = db.Column(db.Integer, nullable=True)
+    total_pipelines = db.Column(db.Integer, nullable=True)
+    unassigned_deals_percentage = db.Column(db.Float, nullable=True)
+
+class ScoreBenchmarkBin(db.Model):
+    """One bucket of the score histogram used for percentile benchmarks"""
+    __tablename__ = 'score_benchmark_bins'
+    
+    scope = db.Column(db.String(32), primary_key=True)  # category key, or 'overall'
+    bin = db.Column(db.Integer, primary_key=True)  # score * 10 (scores have one decimal)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+class AIBatchJob(db.Model):
+    __tablename__ = 'ai_batch_jobs'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    provider_batch_id = db.Column(db.String(255), nullable=True, index=True)
+    status = db.Column(db.String(32), nullable=False, default='pending')  # pending, submitted, completed, failed
+    
+    # Files on the batch provider side
+    input_file_id = db.Column(db.String(255), nullable=True)
+    output_file_id = db.Column(db.String(255), nullable=True)
+    error_file_id = db.Column(db.String(255), nullable=True)
+    
+    # Audits covered by this batch (JSON list of AuditResult ids)
+    audit_ids_json = db.Column(db.Text, nullable=False, default='[]')
+    request_count = db.Column(db.Integer, default=0)
+    completed_count = db.Column(db.Integer, default=0)
+    error_message = db.Column(db.Text, nullable=True)
+    
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    completed_at = db.Column(db.DateTime, nullable=True)
+    
+    def get_audit_ids(self):
+        """Convert JSON string back to list of audit ids"""
+        return json.loads(self.audit_ids_json) if self.audit_ids_json else []
+    
+    def set_audit_ids(self, audit_ids):
+        """Convert list of audit ids to JSON string"""
+        self.audit_ids_json = json.dumps(list(audit_ids))
+
+class AuditJob(db.Model):
+    __tablename__ = 'audit_jobs'
+    
+    id = db.Column(db.String(32), primary_key=True)  # uuid4 hex, handed to the browser
+    status = db.Column(db.String(16), nullable=False, default='queued', index=True)  # queued, running, completed, failed
+    
+    # Credentials for the worker - cleared once the job finishes
+    access_token = db.Column(db.Text, nullable=True)
+    
+    # Progress and outcome
+    progress_json = db.Column(db.Text, nullable=True)  # {"completed_categories": {...}, "current_category": ...}
+    results_json = db.Column(db.Text, nullable=True)
+    error_message = db.Column(db.Text, nullable=True)
+    attempts = db.Column(db.Integer, default=0)
+    
+    # Set for audits dispatched by the scheduler (see audit_scheduler)
+    schedule_id = db.Column(db.Integer, db.ForeignKey('audit_schedules.id'), nullable=True, index=True)
+    
+    # Worker bookkeeping
+    worker_id = db.Column(db.String(255), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    started_at = db.Column(db.DateTime, nullable=True)
+    heartbeat_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    
+    def get_progress_dict(self):
+        """Convert progress JSON string back to dictionary"""
+        return json.loads(self.progress_json) if self.progress_json else {'completed_categories': {}, 'current_category': None}
+    
+    def set_progress_dict(self, progress_dict):
+        """Convert progress dictionary to JSON string"""
+        self.progress_json = json.dumps(progress_dict)
+    
     def get_results_dict(self):
         """Convert JSON string back to dictionary"""
         return json.loads(self.results_json) if self.results_json else {}
     
     def set_results_dict(self, results_dict):
         """Convert dictionary to JSON string"""
-        self.results_json = json.dumps(results_dict)
\ No newline at end of file
+        self.results_json = json.dumps(results_dict)
+
+class AuditSchedule(db.Model):
+    """Recurring audit of one portal, dispatched into the job queue by audit_scheduler"""
+    __tablename__ = 'audit_schedules'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    hubspot_portal_id = db.Column(db.String(255), nullable=False, index=True)
+    
+    # Encrypted OAuth refresh token (see token_crypto), exchanged for a fresh access token at
+    # each run - never sent to clients, and cleared once the schedule is stopped
+    refresh_token = db.Column(db.Text, nullable=True)
+    cadence_hours = db.Column(db.Float, nullable=False, default=24)
+    enabled = db.Column(db.Boolean, nullable=False, default=True, index=True)
+    
+    # Next (jittered) run; left unchanged while a dispatched job is pending
+    next_run_at = db.Column(db.DateTime, nullable=False, index=True)
+    pending_job_id = db.Column(db.String(32), nullable=True)
+    
+    # Outcome of recent runs
+    last_run_at = db.Column(db.DateTime, nullable=True)
+    last_audit_id = db.Column(db.Integer, db.ForeignKey('audit_results.id'), nullable=True)
+    last_api_calls = db.Column(db.Integer, nullable=True)
+    consecutive_failures = db.Column(db.Integer, nullable=False, default=0)
+    last_error = db.Column(db.Text, nullable=True)
+    
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def get_refresh_token(self):
+        """Decrypted refresh token, or None if cleared or unreadable"""
+        from token_crypto import decrypt_token
+        return decrypt_token(self.refresh_token)
+    
+    def set_refresh_token(self, token):
+        """Store a refresh token encrypted (None clears it)"""
+        from token_crypto import encrypt_token
+        self.refresh_token = encrypt_token(token)
+
+class SessionRecord(db.Model):
+    __tablename__ = 'server_sessions'
+    
+    id = db.Column(db.String(64), primary_key=True)  # random session key, signed in the cookie
+    data = db.Column(db.LargeBinary, nullable=False)  # zlib-compressed session JSON
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+class DashboardFragment(db.Model):
+    """Rendered dashboard HTML of a saved audit, shared by every worker (see dashboard_cache)"""
+    __tablename__ = 'dashboard_fragments'
+    
+    id = db.Column(db.String(64), primary_key=True)  # hash of audit, results, percentiles and templates
+    data = db.Column(db.LargeBinary, nullable=False)  # zlib-compressed JSON of the fragments
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+class ApiBudgetBucket(db.Model):
+    """Shared HubSpot API token bucket: the app-wide row and one row per tenant (see api_budget)"""
+    __tablename__ = 'api_budget_buckets'
+    
+    key = db.Column(db.String(64), primary_key=True)  # 'app' or 'tenant:<token fingerprint>'
+    tokens = db.Column(db.Float, nullable=False, default=0)
+    updated_at = db.Column(db.Float, nullable=False, default=0)  # unix time of the last refill
+    last_seen = db.Column(db.Float, nullable=False, default=0, index=True)
+    
+    # Calls counted against the app's daily limit (app row only)
+    day = db.Column(db.Integer, nullable=True)  # UTC date as YYYYMMDD
+    day_count = db.Column(db.Integer, nullable=False, default=0)
+    
+    version = db.Column(db.Integer, nullable=False, default=0)  # optimistic concurrency check
+
+class LLMUsage(db.Model):
+    """OpenAI tokens spent per UTC day, summed over every process (see llm_governor)"""
+    __tablename__ = 'llm_usage'
+    
+    day = db.Column(db.String(10), primary_key=True)  # YYYY-MM-DD
+    tokens = db.Column(db.BigInteger, nullable=False, default=0)
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""Disk cache of rendered PDF reports keyed by a hash of their inputs, and the pool that renders them"""
+
+import os
+import time
+import logging
+import tempfile
+import threading
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Optional, Tuple
+from pdf_generator import PDF_TEMPLATE_VERSION, PDFGenerator
+from results_codec import content_hash
+
+CACHE_DIR = os.environ.get("PDF_CACHE_DIR") or os.path.join(tempfile.gettempdir(), "hubspot-audit-pdfs")
+MAX_BYTES = int(float(os.environ.get("PDF_CACHE_MAX_MB", "200")) * 1024 * 1024)
+
+# 0 renders in the calling thread (no pool)
+RENDER_PROCESSES = int(os.environ.get("PDF_RENDER_PROCESSES", "2"))
+# Renders queued or running at once; further requests are turned away until one finishes
+RENDER_QUEUE_MAX = int(os.environ.get("PDF_RENDER_QUEUE_MAX", "16"))
+# How long a download request waits for its render before answering "still rendering"
+RENDER_WAIT_SECONDS = float(os.environ.get("PDF_RENDER_WAIT_SECONDS", "5"))
+
+_eviction_lock = threading.Lock()
+_pool = None
+_pending = {}  # report key -> Future of its render
+_pool_lock = threading.Lock()
+
+class RenderQueueFull(Exception):
+    """Raised when too many reports are already waiting to be rendered"""
+
+def report_key(audit_results: Dict, percentiles: Optional[Dict] = None) -> str:
+    """Cache key / ETag for the report these inputs would render"""
+    return content_hash({'template': PDF_TEMPLATE_VERSION, 'results': audit_results,
+                         'percentiles': percentiles or {}})
+
+def cached_report_path(key: str) -> str:
+    return os.path.join(CACHE_DIR, f"{key}.pdf")
+
+def _touch(path: str) -> bool:
+    """Mark a cached report as recently used (mtime stays the render time); False if missing"""
+    try:
+        os.utime(path, (time.time(), os.stat(path).st_mtime))
+        return True
+    except FileNotFoundError:
+        return False
+
+def render_to_cache(key: str, audit_results: Dict, percentiles: Optional[Dict] = None) -> str:
+    """Render a report into the cache and return its path (runs in a pool process)"""
+    path = cached_report_path(key)
+    if os.path.exists(path):
+        return path
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=CACHE_DIR, suffix='.tmp')
+    os.close(fd)
+    try:
+        # Written straight to disk; the appendix can run to thousands of rows
+        PDFGenerator().generate_report(audit_results, percentiles, appendix=True, output_path=tmp_path)
+        os.replace(tmp_path, path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+    return path
+
+def get_or_render(audit_results: Dict, percentiles: Optional[Dict] = None) -> Tuple[str, str]:
+    """Path of the rendered report (rendering it in this thread on a miss) and its key"""
+    key = report_key(audit_results, percentiles)
+    path = cached_report_path(key)
+    if not _touch(path):
+        render_to_cache(key, audit_results, percentiles)
+        evict()
+    return path, key
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=RENDER_PROCESSES,
+                                    mp_context=multiprocessing.get_context('spawn'))
+    return _pool
+
+def _render_finished(key: str, future: Future):
+    with _pool_lock:
+        if _pending.get(key) is future:
+            del _pending[key]
+    if future.exception() is not None:
+        logging.error(f"PDF render error: {str(future.exception())}")
+    else:
+        evict()
+
+def request_report(audit_results: Dict, percentiles: Optional[Dict] = None) -> Tuple[str, Optional[Future]]:
+    """Start rendering a report in the background unless it is cached or already rendering.
+
+    Returns the report key and the render's future (None when the report is cached).
+    """
+    global _pool
+    key = report_key(audit_results, percentiles)
+    if _touch(cached_report_path(key)):
+        return key, None
+
+    with _pool_lock:
+        future = _pending.get(key)
+        if future is not None:
+            return key, future
+        if len(_pending) >= RENDER_QUEUE_MAX:
+            raise RenderQueueFull(f"{len(_pending)} PDF reports already rendering")
+        try:
+            future = _get_pool().submit(render_to_cache, key, audit_results, percentiles)
+        except BrokenProcessPool:
+            # A worker died; start a fresh pool once
+            _pool = None
+            future = _get_pool().submit(render_to_cache, key, audit_results, percentiles)
+        _pending[key] = future
+    future.add_done_callback(lambda done: _render_finished(key, done))
+    return key, future
+
+def get_report(audit_results: Dict, percentiles: Optional[Dict] = None,
+               timeout: float = None) -> Tuple[Optional[str], str]:
+    """Path of the rendered report and its key; path is None if it is still rendering after timeout"""
+    if RENDER_PROCESSES <= 0:
+        return get_or_render(audit_results, percentiles)
+
+    key, future = request_report(audit_results, percentiles)
+    if future is not None:
+        try:
+            future.result(timeout=RENDER_WAIT_SECONDS if timeout is None else timeout)
+        except FutureTimeoutError:
+            return None, key
+    return cached_report_path(key), key
+
+def evict(max_bytes: int = None):
+    """Delete least recently used reports until the cache fits in max_bytes"""
+    max_bytes = MAX_BYTES if max_bytes is None else max_bytes
+    if not _eviction_lock.acquire(blocking=False):
+        return 0  # another thread is already evicting
+    try:
+        entries = []
+        with os.scandir(CACHE_DIR) as scan:
+            for entry in scan:
+                if entry.name.endswith('.pdf'):
+                    stat = entry.stat()
+                    entries.append((stat.st_atime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, path in sorted(entries):
+            if total <= max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                removed += 1
+            except FileNotFoundError:
+                pass
+        if removed:
+            logging.info(f"PDF cache evicted {removed} reports")
+        return removed
+    except FileNotFoundError:
+        return 0
+    finally:
+        _eviction_lock.release()
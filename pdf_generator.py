@@ -1,18 +1,99 @@
 import io
+import os
 from datetime import datetime
 from reportlab.lib.pagesizes import letter, A4
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import inch
 from reportlab.lib.colors import Color, blue, red, green, orange
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, PageBreak
 from reportlab.lib.enums import TA_CENTER, TA_LEFT, TA_RIGHT
 
+# Bump whenever the report layout changes, so cached PDFs are re-rendered
+PDF_TEMPLATE_VERSION = '3'
+
+# Appendix tables are emitted as many small Table flowables of this many rows;
+# one Table of 20k rows would have to be measured and split as a whole
+APPENDIX_CHUNK_ROWS = int(os.environ.get("PDF_APPENDIX_CHUNK_ROWS", "40"))
+APPENDIX_CELL_CHARS = 60
+
+def _yes_no(value) -> str:
+    return 'Yes' if value else 'No'
+
+# (category, metrics key, title, [(column header, width in inches, row -> cell)])
+APPENDIX_TABLES = [
+    ('admin', 'users_list', 'Users', [
+        ('Name', 1.8, lambda row: f"{row.get('firstName', '')} {row.get('lastName', '')}".strip()),
+        ('Email', 2.4, lambda row: row.get('email')),
+        ('Super Admin', 0.9, lambda row: _yes_no(row.get('superAdmin'))),
+        ('Last Login', 0.9, lambda row: row.get('lastLogin') or 'Never'),
+    ]),
+    ('admin', 'integrations_list', 'Integrations', [
+        ('Name', 2.8, lambda row: row.get('name')),
+        ('Type', 2.0, lambda row: row.get('type')),
+        ('Last Updated', 1.2, lambda row: row.get('lastUpdated')),
+    ]),
+    ('properties', 'properties_list', 'Custom Properties', [
+        ('Name', 2.0, lambda row: row.get('name')),
+        ('Label', 2.0, lambda row: row.get('label')),
+        ('Object', 0.8, lambda row: row.get('objectType')),
+        ('Type', 0.7, lambda row: row.get('type')),
+        ('Unused?', 0.5, lambda row: _yes_no(row.get('potentially_unused'))),
+    ]),
+    ('workflows', 'workflows_details', 'Workflows', [
+        ('Name', 3.2, lambda row: row.get('name')),
+        ('Type', 1.2, lambda row: row.get('type')),
+        ('Enabled', 0.7, lambda row: _yes_no(row.get('enabled'))),
+        ('Created', 0.9, lambda row: row.get('created_date')),
+    ]),
+    ('forms', 'forms_details', 'Forms', [
+        ('Name', 3.0, lambda row: row.get('name')),
+        ('Embedded', 0.8, lambda row: _yes_no(row.get('is_embedded'))),
+        ('Submissions (30d)', 1.2, lambda row: row.get('submissions_30d')),
+        ('Created', 1.0, lambda row: row.get('created_date')),
+    ]),
+]
+
+APPENDIX_TABLE_STYLE = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), blue),
+    ('TEXTCOLOR', (0, 0), (-1, 0), Color(1, 1, 1)),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, -1), 8),
+    ('GRID', (0, 0), (-1, -1), 0.5, Color(0.6, 0.6, 0.6)),
+    ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+])
+
+class LazyStory(list):
+    """Story list that pulls flowables from a generator as the document consumes them.
+
+    SimpleDocTemplate.build checks len(story) before handling each flowable, so
+    refilling there keeps only a small window of flowables alive at a time.
+    """
+    
+    def __init__(self, flowables, lookahead: int = 8):
+        super().__init__()
+        self._source = iter(flowables)
+        self._lookahead = lookahead
+    
+    def __len__(self):
+        while self._source is not None and list.__len__(self) < self._lookahead:
+            try:
+                self.append(next(self._source))
+            except StopIteration:
+                self._source = None
+        return list.__len__(self)
+
 class PDFGenerator:
     """Generate PDF reports for HubSpot audit results"""
     
+    # Stylesheet built once per process; styles are only read while rendering
+    _shared_styles = None
+    
     def __init__(self):
-        self.styles = getSampleStyleSheet()
-        self._create_custom_styles()
+        if PDFGenerator._shared_styles is None:
+            self.styles = getSampleStyleSheet()
+            self._create_custom_styles()
+            PDFGenerator._shared_styles = self.styles
+        self.styles = PDFGenerator._shared_styles
     
     def _create_custom_styles(self):
         """Create custom paragraph styles"""
@@ -40,13 +121,64 @@ class PDFGenerator:
             spaceAfter=6
         ))
     
-    def generate_report(self, audit_results: dict) -> io.BytesIO:
-        """Generate complete PDF audit report"""
-        buffer = io.BytesIO()
+    def generate_report(self, audit_results: dict, percentiles: dict = None, appendix: bool = False,
+                        output_path: str = None):
+        """Generate complete PDF audit report (percentiles: rank per category/'overall' vs. all audits).
+        
+        With appendix=True every user, integration, property, workflow and form is
+        listed at the end. With output_path the PDF is written to that file (and
+        the path returned) instead of an in-memory buffer.
+        """
+        percentiles = percentiles or {}
+        buffer = output_path or io.BytesIO()
         doc = SimpleDocTemplate(buffer, pagesize=A4, rightMargin=72, leftMargin=72,
                               topMargin=72, bottomMargin=18)
-        
-        # Build the story (content)
+        story = self._report_body(audit_results, percentiles)
+        if appendix:
+            story = LazyStory(self._chain(story, self._appendix_flowables(audit_results)))
+        doc.build(story)
+        if output_path:
+            return output_path
+        buffer.seek(0)
+        return buffer
+    
+    @staticmethod
+    def _chain(*parts):
+        for part in parts:
+            yield from part
+    
+    def _appendix_flowables(self, audit_results: dict):
+        """Appendix flowables, produced one chunk of rows at a time"""
+        tables = [(title, columns, audit_results[category]['metrics'][key])
+                  for category, key, title, columns in APPENDIX_TABLES
+                  if isinstance(audit_results.get(category), dict)
+                  and (audit_results[category].get('metrics') or {}).get(key)]
+        if not tables:
+            return
+        yield PageBreak()
+        yield Paragraph("Appendix: Full Portal Inventory", self.styles['CustomTitle'])
+        for title, columns, rows in tables:
+            yield Paragraph(f"{title} ({len(rows)})", self.styles['SectionHeader'])
+            header = [column[0] for column in columns]
+            widths = [column[1] * inch for column in columns]
+            for start in range(0, len(rows), APPENDIX_CHUNK_ROWS):
+                data = [header]
+                for row in rows[start:start + APPENDIX_CHUNK_ROWS]:
+                    if not isinstance(row, dict):
+                        row = {'name': row}
+                    data.append([self._cell(cell(row)) for _, _, cell in columns])
+                table = Table(data, colWidths=widths, repeatRows=1)
+                table.setStyle(APPENDIX_TABLE_STYLE)
+                yield table
+            yield Spacer(1, 20)
+    
+    @staticmethod
+    def _cell(value) -> str:
+        text = '' if value is None else str(value)
+        return text if len(text) <= APPENDIX_CELL_CHARS else text[:APPENDIX_CELL_CHARS - 3] + '...'
+    
+    def _report_body(self, audit_results: dict, percentiles: dict) -> list:
+        """Flowables for everything before the appendix"""
         story = []
         
         # Title
@@ -63,10 +195,12 @@ class PDFGenerator:
         
         story.append(Paragraph("Overall Assessment", self.styles['SectionHeader']))
         story.append(Paragraph(f"Overall Score: {overall_score}/5.0 (Grade: {overall_grade})", self.styles['ScoreText']))
+        if 'overall' in percentiles:
+            story.append(Paragraph(f"Better than {percentiles['overall']}% of audited HubSpot portals", self.styles['Normal']))
         story.append(Spacer(1, 20))
         
         # Summary table
-        summary_data = [['Category', 'Score', 'Grade', 'Status']]
+        summary_data = [['Category', 'Score', 'Grade', 'Status'] + (['Percentile'] if percentiles else [])]
         categories = ['admin', 'properties', 'workflows', 'forms', 'reporting', 'sales']
         category_names = {
             'admin': 'Admin & Setup',
@@ -83,7 +217,10 @@ class PDFGenerator:
                 score = cat_data.get('score', 0)
                 grade = cat_data.get('grade', 'F')
                 status = self._get_status_from_grade(grade)
-                summary_data.append([category_names[category], f"{score}/5.0", grade, status])
+                row = [category_names[category], f"{score}/5.0", grade, status]
+                if percentiles:
+                    row.append(f"{percentiles[category]}%" if category in percentiles else 'N/A')
+                summary_data.append(row)
         
         summary_table = Table(summary_data)
         summary_table.setStyle(TableStyle([
@@ -169,10 +306,7 @@ class PDFGenerator:
         # Footer
         story.append(Paragraph("For questions about this audit or to schedule a strategy consultation, please contact our team.", self.styles['Normal']))
         
-        # Build PDF
-        doc.build(story)
-        buffer.seek(0)
-        return buffer
+        return story
     
     def _generate_category_section(self, category_name: str, category_data: dict):
         """Generate content for a single category section"""
@@ -187,6 +321,8 @@ class PDFGenerator:
         
         # Metrics
         metrics = category_data.get('metrics', {})
+        # Lists (users, forms, ...) are left to the appendix
+        metrics = {key: value for key, value in metrics.items() if not isinstance(value, (list, dict))}
         if metrics:
             content.append(Paragraph("Key Metrics:", self.styles['Normal']))
             for key, value in metrics.items():
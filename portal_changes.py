@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""Keep portal snapshots current from HubSpot webhooks and re-audit incrementally"""
+
+import os
+import hmac
+import time
+import base64
+import hashlib
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterable, List, Optional
+from sqlalchemy.orm.exc import StaleDataError
+from audit_engine import AuditEngine
+from hubspot_service import HubSpotService
+from models import PortalLiveSnapshot, db
+from results_codec import decode_results, encode_results
+from snapshot_replay import RefreshingReplayHubSpotService, decode_snapshot, encode_snapshot
+
+INCREMENTAL_ENABLED = os.environ.get("INCREMENTAL_AUDITS_ENABLED", "false").lower() == "true"
+FULL_AUDIT_MAX_AGE = timedelta(hours=float(os.environ.get("INCREMENTAL_AUDIT_MAX_AGE_HOURS", "168")))
+# HubSpot signs requests with a timestamp; older ones are rejected as replays
+SIGNATURE_MAX_AGE_MS = 5 * 60 * 1000
+SAVE_RETRIES = 3
+
+# Webhook object -> audit category, snapshot call per object type, id field and single-object endpoint
+RESOURCES = {
+    'property': {
+        'category': 'properties',
+        'id_field': 'name',
+        'calls': {'contacts': 'get_contact_properties', 'companies': 'get_company_properties',
+                  'deals': 'get_deal_properties'},
+        'endpoint': '/crm/v3/properties/{object_type}/{object_id}'
+    },
+    'workflow': {
+        'category': 'workflows',
+        'id_field': 'id',
+        'calls': {None: 'get_workflows'},
+        'endpoint': '/automation/v3/workflows/{object_id}'
+    },
+    'form': {
+        'category': 'forms',
+        'id_field': 'guid',
+        'calls': {None: 'get_forms'},
+        'endpoint': '/forms/v2/forms/{object_id}'
+    },
+}
+# Categories without webhooks, and the snapshot calls they read; refetched on every audit
+UNTRACKED_CATEGORIES = {
+    'admin': ['get_users', 'get_integrations'],
+    'reporting': ['get_dashboards', 'get_reports'],
+    'sales': ['get_pipelines'],
+}
+RESOURCE_CATEGORIES = [spec['category'] for spec in RESOURCES.values()]
+CHANGE_TYPES = {'creation', 'propertyChange', 'deletion'}
+OBJECT_TYPES = {'contact': 'contacts', 'company': 'companies', 'deal': 'deals'}
+
+def verify_signature(method: str, url: str, body: bytes, timestamp: Optional[str], signature: Optional[str],
+                     secret: Optional[str]) -> bool:
+    """Check HubSpot's X-HubSpot-Signature-v3 header"""
+    if not (timestamp and signature and secret):
+        return False
+    try:
+        if abs(time.time() * 1000 - int(timestamp)) > SIGNATURE_MAX_AGE_MS:
+            return False
+    except ValueError:
+        return False
+    source = method.encode('utf-8') + url.encode('utf-8') + body + timestamp.encode('utf-8')
+    expected = base64.b64encode(hmac.new(secret.encode('utf-8'), source, hashlib.sha256).digest()).decode('ascii')
+    return hmac.compare_digest(expected, signature)
+
+def _event_target(event: Dict):
+    """(resource spec, snapshot call, change type, object type, object id), or None for untracked events"""
+    resource, _, change = str(event.get('subscriptionType') or '').partition('.')
+    spec = RESOURCES.get(resource)
+    if spec is None or change not in CHANGE_TYPES or event.get('objectId') in (None, ''):
+        return None
+    object_type = None
+    if resource == 'property':
+        object_type = str(event.get('objectType') or '').lower()
+        object_type = OBJECT_TYPES.get(object_type, object_type)
+    call = spec['calls'].get(object_type)
+    if call is None:
+        return None
+    return spec, call, change, object_type, str(event['objectId'])
+
+def _patch(snapshot: Dict, changes: Dict, event: Dict) -> bool:
+    """Apply one event to a snapshot and its change log; False if it was ignored"""
+    target = _event_target(event)
+    if target is None:
+        return False
+    spec, call, change, object_type, object_id = target
+    key = f"{call}:{object_id}"
+    occurred_at = int(event.get('occurredAt') or 0)
+    if occurred_at < changes['seen'].get(key, 0):
+        return False  # an older event delivered late
+    changes['seen'][key] = occurred_at
+    if spec['category'] not in changes['dirty']:
+        changes['dirty'].append(spec['category'])
+
+    calls = snapshot.setdefault('calls', {})
+    if call not in calls:
+        return True  # never fetched; the next audit fetches the whole list
+    items = calls[call]
+    others = [item for item in items if str(item.get(spec['id_field'])) != object_id]
+    if change == 'deletion':
+        calls[call] = others
+        changes['pending'].pop(key, None)
+    elif isinstance(event.get('object'), dict):
+        calls[call] = others + [event['object']]
+        changes['pending'].pop(key, None)
+    else:
+        # Keep the old definition until the next audit fetches the new one
+        changes['pending'][key] = {'call': call, 'id_field': spec['id_field'],
+                                   'endpoint': spec['endpoint'].format(object_type=object_type, object_id=object_id)}
+    return True
+
+def apply_events(events: Iterable[Dict]) -> Dict:
+    """Patch the live snapshots of the portals the events belong to; returns counts"""
+    by_portal = defaultdict(list)
+    for event in events:
+        if isinstance(event, dict) and event.get('portalId') is not None:
+            by_portal[str(event['portalId'])].append(event)
+
+    summary = {'applied': 0, 'ignored': 0, 'portals': []}
+    for portal_id, portal_events in by_portal.items():
+        portal_events.sort(key=lambda event: int(event.get('occurredAt') or 0))
+        for attempt in range(SAVE_RETRIES):
+            live = db.session.get(PortalLiveSnapshot, portal_id)
+            if live is None:
+                summary['ignored'] += len(portal_events)  # never audited here, nothing to patch
+                break
+            snapshot = decode_snapshot(live.data)
+            changes = live.get_changes()
+            applied = sum(1 for event in portal_events if _patch(snapshot, changes, event))
+            if applied:
+                live.data = encode_snapshot(snapshot)[1]
+                live.set_changes(changes)
+                live.event_count += applied
+                live.updated_at = datetime.utcnow()
+            try:
+                db.session.commit()
+            except StaleDataError:
+                # Another request patched the same portal meanwhile; start again from its version
+                db.session.rollback()
+                continue
+            summary['applied'] += applied
+            summary['ignored'] += len(portal_events) - applied
+            if applied:
+                summary['portals'].append(portal_id)
+            break
+        else:
+            logging.error(f"Could not apply {len(portal_events)} webhook events for portal {portal_id}")
+            summary['ignored'] += len(portal_events)
+    return summary
+
+def scopes_key(access_token: str) -> Optional[str]:
+    """Hash of the scopes granted to a token, or None if HubSpot cannot tell us"""
+    info = HubSpotService(access_token).get_token_info() or {}
+    if not isinstance(info.get('scopes'), list):
+        return None
+    return hashlib.sha256(' '.join(sorted(info['scopes'])).encode('utf-8')).hexdigest()
+
+def seed_live_snapshot(portal_id: Optional[str], snapshot: Dict, audit_results: Dict, scopes: Optional[str]):
+    """Start tracking a portal from a full audit by a token with the given scopes key"""
+    if not portal_id or not scopes:
+        return
+    try:
+        live = db.session.get(PortalLiveSnapshot, str(portal_id))
+        if live is None:
+            live = PortalLiveSnapshot(hubspot_portal_id=str(portal_id))
+            db.session.add(live)
+        live.data = encode_snapshot(snapshot)[1]
+        live.results_blob = encode_results(audit_results)
+        live.scopes_key = scopes
+        live.set_changes({})
+        live.event_count = 0
+        live.audited_at = live.updated_at = datetime.utcnow()
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logging.error(f"Live snapshot error for portal {portal_id}: {str(e)}")
+
+def _fetch_pending(hubspot: RefreshingReplayHubSpotService, pending: Dict[str, Dict]):
+    """Fetch each changed object once and put it into the snapshot"""
+    for key, fetch in pending.items():
+        item = hubspot._make_api_call(fetch['endpoint'])
+        if not isinstance(item, dict):
+            logging.warning(f"Could not fetch changed object {key}; keeping its previous definition")
+            continue
+        object_id = key.split(':', 1)[1]
+        items = hubspot.calls.get(fetch['call'], [])
+        hubspot.calls[fetch['call']] = [i for i in items if str(i.get(fetch['id_field'])) != object_id] + [item]
+
+def incremental_audit(access_token: str, progress_callback: Callable = None) -> Optional[Dict]:
+    """Re-audit a tracked portal from its patched snapshot; None when a full audit is needed"""
+    from snapshot_store import store_snapshot
+
+    portal_id = (HubSpotService(access_token).get_account_info() or {}).get('portalId')
+    live = db.session.get(PortalLiveSnapshot, str(portal_id)) if portal_id else None
+    if live is None or live.audited_at < datetime.utcnow() - FULL_AUDIT_MAX_AGE:
+        return None
+    if live.scopes_key is None or scopes_key(access_token) != live.scopes_key:
+        logging.info(f"Portal {portal_id} was last audited with other scopes; running a full audit")
+        return None
+
+    changes = live.get_changes()
+    hubspot = RefreshingReplayHubSpotService(decode_snapshot(live.data), access_token)
+    _fetch_pending(hubspot, changes['pending'])
+    stale_calls = [call for calls in UNTRACKED_CATEGORIES.values() for call in calls]
+    if 'forms' in changes['dirty']:
+        # Submission counts cover the last 30 days, so refresh them with the forms
+        stale_calls.append('get_form_submissions')
+    for key in [key for key in hubspot.calls if key.split(':', 1)[0] in stale_calls]:
+        del hubspot.calls[key]
+
+    rerun = changes['dirty'] + [category for category in UNTRACKED_CATEGORIES if category not in changes['dirty']]
+    previous_results = decode_results(live.results_blob)
+    audit_results = AuditEngine(hubspot, progress_callback=progress_callback).run_categories(rerun, previous_results)
+    if not audit_results:
+        return None
+    audit_results['incremental'] = {
+        'rerun_categories': rerun,
+        'reused_categories': [category for category in RESOURCE_CATEGORIES if category not in rerun],
+        'full_audit_at': live.audited_at.isoformat(),
+        'events_since_full_audit': live.event_count,
+        'api_calls': hubspot.api_call_count
+    }
+    logging.info(f"Incremental audit of portal {portal_id}: re-ran {', '.join(rerun)} "
+                 f"with {hubspot.api_call_count} API calls")
+
+    snapshot = hubspot.snapshot()
+    try:
+        audit_results['snapshot_id'] = store_snapshot(snapshot, str(portal_id))
+    except Exception as e:
+        db.session.rollback()
+        logging.error(f"Snapshot archive error: {str(e)}")
+    try:
+        live = db.session.get(PortalLiveSnapshot, str(portal_id))
+        live.data = encode_snapshot(snapshot)[1]
+        live.results_blob = encode_results(audit_results)
+        live.set_changes({'seen': changes['seen']})
+        live.updated_at = datetime.utcnow()
+        db.session.commit()
+    except StaleDataError:
+        # Events arrived while we audited; they stay pending for the next audit
+        db.session.rollback()
+    return audit_results
+
+def load_events(paths: Iterable[str]) -> List[Dict]:
+    """Events from recorded webhook bodies: JSON lists, single events, or one JSON value per line"""
+    import json
+    events = []
+    for path in paths:
+        with open(path) as events_file:
+            text = events_file.read().strip()
+        try:
+            values = [json.loads(text)]
+        except ValueError:
+            values = [json.loads(line) for line in text.splitlines() if line.strip()]
+        for value in values:
+            events.extend(value if isinstance(value, list) else [value])
+    return events
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""In-process relay for live audit progress events (server-sent events)"""
+
+import json
+import time
+import threading
+from typing import Dict, List, Tuple
+
+# Events after which a run produces nothing more
+TERMINAL_EVENTS = {'job_completed', 'job_failed'}
+
+class ProgressBroker:
+    """Keep the event history of recent audit runs and wake up listeners on new events.
+
+    Only runs executed by this process are visible here; the SSE endpoint falls
+    back to the progress persisted on the AuditJob row for anything else.
+    """
+
+    def __init__(self, ttl_seconds: int = 900):
+        self.ttl_seconds = ttl_seconds
+        self._runs = {}  # run_id -> {'events': [(id, event, data)], 'finished': bool, 'updated_at': float}
+        self._condition = threading.Condition()
+
+    def publish(self, run_id: str, event_id: int, event: str, data: Dict):
+        """Record an event for a run and notify waiting streams"""
+        with self._condition:
+            run = self._runs.setdefault(run_id, {'events': [], 'finished': False, 'updated_at': time.time()})
+            run['events'].append((event_id, event, data))
+            run['updated_at'] = time.time()
+            if event in TERMINAL_EVENTS:
+                run['finished'] = True
+            self._condition.notify_all()
+        self._expire_stale()
+
+    def has_run(self, run_id: str) -> bool:
+        with self._condition:
+            return run_id in self._runs
+
+    def wait_for_events(self, run_id: str, last_event_id: int, timeout: float) -> Tuple[List, bool]:
+        """Return events newer than last_event_id, blocking up to timeout for the first one"""
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while True:
+                run = self._runs.get(run_id)
+                if run is None:
+                    return [], True
+                events = [entry for entry in run['events'] if entry[0] > last_event_id]
+                remaining = deadline - time.monotonic()
+                if events or run['finished'] or remaining <= 0:
+                    return events, run['finished']
+                self._condition.wait(remaining)
+
+    def _expire_stale(self):
+        cutoff = time.time() - self.ttl_seconds
+        with self._condition:
+            for run_id in [run_id for run_id, run in self._runs.items() if run['updated_at'] < cutoff]:
+                del self._runs[run_id]
+
+def format_sse(event_id: int, event: str, data: Dict) -> str:
+    """Encode one server-sent event"""
+    return f"id: {event_id}\nevent: {event}\ndata: {json.dumps(data)}\n\n"
+
+# Shared per-process broker used by audit workers and the SSE endpoint
+progress_broker = ProgressBroker()
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""Compact encoding for stored audit results (fast JSON + zlib)"""
+
+import os
+import json
+import zlib
+import hashlib
+from typing import Dict, Optional
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - falls back to the stdlib codec
+    orjson = None
+
+# Codec names stored next to each blob so the format can change without a rewrite
+CODEC_ZLIB_JSON = 'zlib+json'    # full results (a keyframe)
+CODEC_ZLIB_PATCH = 'zlib+patch'  # results_delta patch against the base audit's results
+CODEC_REF = 'ref'                # identical to the base audit's results, no blob
+
+COMPRESSION_LEVEL = int(os.environ.get("RESULTS_COMPRESSION_LEVEL", "6"))
+
+def dumps(obj) -> bytes:
+    """Serialize to UTF-8 JSON bytes, using orjson when it is installed"""
+    if orjson is not None:
+        # Non-string keys are stringified, matching json.dumps
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+def loads(data):
+    """Parse JSON from bytes or str"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def content_hash(obj) -> str:
+    """Stable SHA-256 of a JSON-compatible value (key order does not matter)"""
+    if orjson is not None:
+        canonical = orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SORT_KEYS)
+    else:
+        canonical = json.dumps(obj, separators=(',', ':'), sort_keys=True).encode('utf-8')
+    return hashlib.sha256(canonical).hexdigest()
+
+def encode_results(results: Dict) -> bytes:
+    """Serialize and compress an audit results dict"""
+    return zlib.compress(dumps(results), COMPRESSION_LEVEL)
+
+def decode_results(blob: bytes, codec: Optional[str] = CODEC_ZLIB_JSON):
+    """Inverse of encode_results (also decodes zlib+patch blobs to their patch list)"""
+    if codec not in (None, CODEC_ZLIB_JSON, CODEC_ZLIB_PATCH):
+        raise ValueError(f"Unknown results codec: {codec}")
+    return loads(zlib.decompress(blob))
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""Structural diffs between audit result dicts (a compact JSON-patch variant)
+
+A patch is a list of operations applied in order:
+    ['set', path, value]                      set a dict key / replace the value at path
+    ['remove', path]                          delete a dict key
+    ['splice', path, start, delete_count, items]   replace a slice of the list at path
+Paths are lists of dict keys and list indices. Operations on a list are emitted
+from its end backwards, so each index still refers to the original list.
+"""
+
+import difflib
+from typing import Any, List
+from results_codec import dumps
+
+def diff(old: Any, new: Any) -> List:
+    """Operations that turn old into new"""
+    ops = []
+    _diff(old, new, [], ops)
+    return ops
+
+def apply_patch(doc: Any, ops: List) -> Any:
+    """Apply operations to doc in place and return the (possibly replaced) root"""
+    for op in ops:
+        kind, path = op[0], op[1]
+        if not path and kind == 'set':
+            doc = op[2]
+            continue
+        parent = doc
+        for key in path[:-1]:
+            parent = parent[key]
+        key = path[-1] if path else None
+
+        if kind == 'set':
+            parent[key] = op[2]
+        elif kind == 'remove':
+            del parent[key]
+        elif kind == 'splice':
+            target = parent[key] if path else doc
+            start, delete_count, items = op[2], op[3], op[4]
+            target[start:start + delete_count] = items
+        else:
+            raise ValueError(f"Unknown patch operation: {kind}")
+    return doc
+
+def _diff(old: Any, new: Any, path: List, ops: List):
+    if type(old) is type(new) and old == new:
+        return
+    if isinstance(old, dict) and isinstance(new, dict):
+        for key in old:
+            if key not in new:
+                ops.append(['remove', path + [key]])
+        for key, value in new.items():
+            if key not in old:
+                ops.append(['set', path + [key], value])
+            else:
+                _diff(old[key], value, path + [key], ops)
+    elif isinstance(old, list) and isinstance(new, list):
+        _diff_list(old, new, path, ops)
+    else:
+        ops.append(['set', path, new])
+
+def _diff_list(old: List, new: List, path: List, ops: List):
+    """Splice list changes, recursing into elements that changed in place"""
+    # Compare elements by their serialized form so dicts in lists can be matched
+    old_keys = [dumps(item) for item in old]
+    new_keys = [dumps(item) for item in new]
+    matcher = difflib.SequenceMatcher(a=old_keys, b=new_keys, autojunk=False)
+
+    for tag, i1, i2, j1, j2 in reversed(matcher.get_opcodes()):
+        if tag == 'equal':
+            continue
+        if tag == 'replace' and i2 - i1 == j2 - j1:
+            # Same number of elements changed - usually a field edit inside each one
+            for offset in reversed(range(i2 - i1)):
+                _diff(old[i1 + offset], new[j1 + offset], path + [i1 + offset], ops)
+        else:
+            ops.append(['splice', path, i1, i2 - i1, new[j1:j2]])
@@ -1,10 +1,15 @@
 import os
+import json
 import logging
-from flask import render_template, request, redirect, url_for, session, flash, make_response, send_file
+from datetime import datetime
+from flask import render_template, request, redirect, url_for, session, flash, make_response, send_file, jsonify, abort, Response, stream_with_context
 from app import app
 from hubspot_service import HubSpotService
-from audit_engine import AuditEngine
-from pdf_generator import PDFGenerator
+from pdf_cache import RenderQueueFull, get_report, report_key, request_report
+from ai_precompute import ai_precomputer
+from audit_jobs import queue_mode, enqueue_audit_job, job_status, stream_job_events
+from score_benchmarks import audit_percentiles, stored_audit_percentiles
+from dashboard_cache import fragment_key, get_fragments, render_fragments
 
 @app.route('/')
 def index():
@@ -107,34 +112,134 @@ def run_audit():
             flash('Please authenticate with HubSpot first', 'warning')
             return redirect(url_for('index'))
         
-        hubspot = HubSpotService(session['hubspot_token'])
-        audit_engine = AuditEngine(hubspot)
+        # Hand the audit to the job queue so the web worker is not tied up
+        if queue_mode() != 'off':
+            job = enqueue_audit_job(session['hubspot_token'])
+            session['audit_job_id'] = job.id
+            return redirect(url_for('audit_job_progress', job_id=job.id))
         
-        # Debug: Test workflow fetching directly
-        logging.debug("=== Testing workflow API directly ===")
-        workflows_direct = hubspot.get_workflows()
-        logging.debug(f"Direct workflow API test found: {len(workflows_direct)} workflows")
-        if workflows_direct:
-            logging.debug(f"First workflow sample: {workflows_direct[0].keys() if workflows_direct else 'None'}")
-        
-        # Run the enhanced audit
-        audit_results = audit_engine.run_full_audit()
+        # Run the enhanced audit, archiving the raw data it fetches
+        from snapshot_store import run_recorded_audit
+        audit_results = run_recorded_audit(session['hubspot_token'])
         
         if not audit_results:
             flash('Failed to run audit. Please check your HubSpot permissions.', 'error')
             return redirect(url_for('index'))
         
-        # Store results in session for potential full report access
-        session['audit_results'] = audit_results
-        
-        # Show basic results immediately (no email required)
-        return render_template('dashboard.html', results=audit_results, show_preview=True)
+        return _show_audit_preview(audit_results)
         
     except Exception as e:
         logging.error(f"Audit error: {str(e)}")
         flash('Error running audit. Please try again or check your HubSpot connection.', 'error')
         return redirect(url_for('index'))
 
+def _show_audit_preview(audit_results):
+    """Keep finished audit results in the session and render the free preview"""
+    # Store results in session for potential full report access
+    session['audit_results'] = audit_results
+    
+    # Start AI analysis in the background while the user reads the preview
+    ai_precomputer.cancel(session.pop('ai_precompute_key', None))
+    ai_precompute_key = ai_precomputer.start(audit_results)
+    if ai_precompute_key:
+        session['ai_precompute_key'] = ai_precompute_key
+    
+    # Show basic results immediately (no email required)
+    return render_template('dashboard.html', results=audit_results, percentiles=audit_percentiles(audit_results),
+                           show_preview=True)
+
+def _get_session_audit_job(job_id):
+    """Return the audit job if it belongs to this session"""
+    from models import AuditJob, db
+    if session.get('audit_job_id') != job_id:
+        return None
+    return db.session.get(AuditJob, job_id)
+
+@app.route('/api/audit-jobs', methods=['POST'])
+def create_audit_job():
+    """Queue an audit for the connected portal and return its job ID right away"""
+    if 'hubspot_token' not in session:
+        return jsonify({'error': 'Please authenticate with HubSpot first'}), 401
+    
+    job = enqueue_audit_job(session['hubspot_token'])
+    session['audit_job_id'] = job.id
+    return jsonify({
+        'job_id': job.id,
+        'status_url': url_for('audit_job_status', job_id=job.id)
+    }), 202
+
+@app.route('/api/audit-jobs/<job_id>')
+def audit_job_status(job_id):
+    """Report job status and the categories completed so far"""
+    job = _get_session_audit_job(job_id)
+    if not job:
+        return jsonify({'error': 'Audit job not found'}), 404
+    
+    status = job_status(job, after_event=request.args.get('after', type=int))
+    if job.status == 'completed':
+        status['results_url'] = url_for('audit_job_results', job_id=job.id)
+    return jsonify(status)
+
+def _sse_enabled():
+    return os.environ.get('AUDIT_SSE_ENABLED', 'false').lower() == 'true'
+
+@app.route('/api/audit-jobs/<job_id>/events')
+def audit_job_events(job_id):
+    """Server-sent event stream of audit progress (category started/finished, fetches, API calls).
+
+    A stream holds its web worker for up to AUDIT_SSE_MAX_SECONDS, so it is only
+    served with AUDIT_SSE_ENABLED=true, which needs an async worker class (e.g.
+    gunicorn -k gevent); otherwise the progress page polls the status endpoint.
+    """
+    job = _get_session_audit_job(job_id)
+    if not job or not _sse_enabled():
+        return jsonify({'error': 'Audit job not found'}), 404
+    
+    # EventSource sends Last-Event-ID when it reconnects after the stream window closes
+    try:
+        last_event_id = int(request.headers.get('Last-Event-ID') or request.args.get('last_event_id') or 0)
+    except ValueError:
+        last_event_id = 0
+    max_seconds = float(os.environ.get('AUDIT_SSE_MAX_SECONDS', '60'))
+    return Response(stream_with_context(stream_job_events(job_id, last_event_id, max_seconds)),
+                    mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/audit/jobs/<job_id>')
+def audit_job_progress(job_id):
+    """Live dashboard that fills in category cards as the audit progresses"""
+    job = _get_session_audit_job(job_id)
+    if not job:
+        flash('Audit not found. Please run a new audit.', 'warning')
+        return redirect(url_for('index'))
+    if job.status == 'completed':
+        return redirect(url_for('audit_job_results', job_id=job.id))
+    
+    return render_template('dashboard.html', results={}, live_job=job_status(job), sse_enabled=_sse_enabled(),
+                           show_preview=True)
+
+@app.route('/audit/jobs/<job_id>/results')
+def audit_job_results(job_id):
+    """Show the preview for a finished audit job"""
+    try:
+        job = _get_session_audit_job(job_id)
+        if not job:
+            flash('Audit not found. Please run a new audit.', 'warning')
+            return redirect(url_for('index'))
+        
+        if job.status == 'failed':
+            flash(job.error_message or 'Error running audit. Please try again.', 'error')
+            return redirect(url_for('index'))
+        if job.status != 'completed':
+            return redirect(url_for('audit_job_progress', job_id=job.id))
+        
+        return _show_audit_preview(job.get_results_dict())
+        
+    except Exception as e:
+        logging.error(f"Audit job results error: {str(e)}")
+        flash('Error displaying results', 'error')
+        return redirect(url_for('index'))
+
 @app.route('/results/<int:audit_id>')
 def show_results(audit_id):
     """Show audit results after email capture"""
@@ -148,8 +253,30 @@ def show_results(audit_id):
             flash('Access denied to these audit results', 'error')
             return redirect(url_for('index'))
         
-        results = audit_record.get_results_dict()
-        return render_template('dashboard.html', results=results, audit_record=audit_record, show_preview=False)
+        percentiles = stored_audit_percentiles(audit_record)
+        key = fragment_key(audit_record, percentiles)
+        if key is None:
+            results = audit_record.get_results_dict()
+            return render_template('dashboard.html', results=results, audit_record=audit_record,
+                                   percentiles=audit_percentiles(results), show_preview=False)
+        
+        # The rest of the page only varies with the login state; pending flash messages make it one-off
+        cacheable = not session.get('_flashes')
+        etag = f"{key}-{1 if session.get('hubspot_token') else 0}"
+        if cacheable and etag in request.if_none_match:
+            response = make_response('', 304)
+        else:
+            fragments = get_fragments(key, lambda: render_fragments(
+                results=audit_record.get_results_dict(), audit_record=audit_record,
+                percentiles=percentiles, show_preview=False))
+            response = make_response(render_template('dashboard.html', fragments=fragments,
+                                                     audit_record=audit_record, percentiles=percentiles,
+                                                     show_preview=False))
+        if cacheable:
+            response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        response.headers['Vary'] = 'Cookie'
+        return response
         
     except Exception as e:
         logging.error(f"Results display error: {str(e)}")
@@ -185,24 +312,30 @@ def unlock_full_report():
             flash('No audit results found. Please run a new audit.', 'warning')
             return redirect(url_for('index'))
         
-        # Add AI enhancements now that user provided email
-        from ai_analyzer import AIAnalyzer
-        ai_analyzer = AIAnalyzer()
-        ai_enhancements = ai_analyzer.generate_comprehensive_report(audit_results)
+        # Add AI enhancements now that user provided email, preferring the precomputed report
+        ai_enhancements = ai_precomputer.get(session.pop('ai_precompute_key', None))
+        if ai_enhancements is None:
+            from ai_analyzer import AIAnalyzer
+            ai_analyzer = AIAnalyzer()
+            ai_enhancements = ai_analyzer.generate_comprehensive_report(audit_results)
         audit_results.update(ai_enhancements)
         
         # Save enhanced results to database
-        audit_record = AuditResult()
-        audit_record.user_id = user.id
-        audit_record.overall_score = audit_results.get('overall_score', 0)
-        audit_record.overall_grade = audit_results.get('overall_grade', 'F')
-        audit_record.set_results_dict(audit_results)
+        audit_record = AuditResult.from_results(user.id, audit_results)
+        audit_record.ai_summary = ai_enhancements.get('ai_summary')
+        audit_record.ai_recommendations = json.dumps(ai_enhancements.get('ai_recommendations', []))
         db.session.add(audit_record)
         db.session.commit()
         
         # Update session with enhanced results
         session['audit_results'] = audit_results
         
+        # Render the PDF now so the download button is instant
+        try:
+            request_report(audit_results, audit_percentiles(audit_results))
+        except Exception as e:
+            logging.warning(f"PDF prerender skipped: {str(e)}")
+        
         flash('Thanks! Your complete AI-enhanced report is ready.', 'success')
         return redirect(url_for('show_results', audit_id=audit_record.id))
         
@@ -240,11 +373,7 @@ def email_capture():
         pending_results = session.get('pending_audit_results')
         if pending_results:
             # Save audit results
-            audit_record = AuditResult()
-            audit_record.user_id = user.id
-            audit_record.overall_score = pending_results.get('overall_score', 0)
-            audit_record.overall_grade = pending_results.get('overall_grade', 'F')
-            audit_record.set_results_dict(pending_results)
+            audit_record = AuditResult.from_results(user.id, pending_results)
             db.session.add(audit_record)
             db.session.commit()
             
@@ -261,23 +390,36 @@ def email_capture():
 
 @app.route('/export/pdf')
 def export_pdf():
-    """Generate and download PDF report"""
+    """Download the PDF report (rendered once per distinct report in the render pool, then served from cache)"""
     try:
         if 'audit_results' not in session:
             flash('No audit results found. Please run an audit first.', 'warning')
             return redirect(url_for('index'))
         
         audit_results = session['audit_results']
-        pdf_generator = PDFGenerator()
-        
-        # Generate PDF
-        pdf_buffer = pdf_generator.generate_report(audit_results)
-        
-        # Create response
-        response = make_response(pdf_buffer.getvalue())
-        response.headers['Content-Type'] = 'application/pdf'
-        response.headers['Content-Disposition'] = 'attachment; filename=hubspot_audit_report.pdf'
-        
+        percentiles = audit_percentiles(audit_results)
+        
+        # Revalidation of an unchanged report needs neither a render nor a disk read
+        key = report_key(audit_results, percentiles)
+        if request.if_none_match.contains(key):
+            response = make_response('', 304)
+            response.set_etag(key)
+            return response
+        
+        try:
+            pdf_path, key = get_report(audit_results, percentiles)
+        except RenderQueueFull:
+            pdf_path = None
+        if pdf_path is None:
+            # Still rendering - answer right away and have the browser retry the download
+            response = make_response(render_template('pdf_pending.html'), 202)
+            response.headers['Retry-After'] = '2'
+            response.headers['Refresh'] = f"2; url={url_for('export_pdf')}"
+            return response
+        
+        response = send_file(pdf_path, mimetype='application/pdf', as_attachment=True,
+                             download_name='hubspot_audit_report.pdf', etag=key, conditional=True, max_age=0)
+        response.cache_control.private = True
         return response
         
     except Exception as e:
@@ -285,9 +427,278 @@ def export_pdf():
         flash('Error generating PDF report. Please try again.', 'error')
         return redirect(url_for('run_audit'))
 
+@app.route('/metrics')
+def metrics():
+    """Operational metrics (LLM usage, latency and fallbacks) as JSON - only with METRICS_TOKEN set"""
+    metrics_token = os.environ.get('METRICS_TOKEN')
+    if not metrics_token or request.headers.get('Authorization') != f'Bearer {metrics_token}':
+        abort(404)
+    
+    from llm_governor import get_llm_governor
+    return jsonify({
+        'llm': get_llm_governor().get_stats()
+    })
+
+def _api_user_scope():
+    """(authorized, user_id) for JSON APIs - an API_TOKEN bearer sees every user's audits"""
+    api_token = os.environ.get('API_TOKEN')
+    if api_token and request.headers.get('Authorization') == f'Bearer {api_token}':
+        return True, None
+    if session.get('user_id'):
+        return True, session['user_id']
+    return False, None
+
+@app.route('/api/portals/<portal_id>/audits')
+def portal_audit_history(portal_id):
+    """Score and grade history for a portal, newest first, paged with ?cursor="""
+    authorized, user_id = _api_user_scope()
+    if not authorized:
+        return jsonify({'error': 'Authentication required'}), 401
+    
+    from audit_history import portal_history, decode_cursor
+    cursor = None
+    if request.args.get('cursor'):
+        cursor = decode_cursor(request.args['cursor'])
+        if cursor is None:
+            return jsonify({'error': 'Invalid cursor'}), 400
+    
+    history = portal_history(
+        portal_id,
+        limit=request.args.get('limit', 50, type=int),
+        cursor=cursor,
+        user_id=user_id,
+        include_categories=request.args.get('include') == 'categories'
+    )
+    if history['next_cursor']:
+        history['next_url'] = url_for('portal_audit_history', portal_id=portal_id, cursor=history['next_cursor'],
+                                      limit=request.args.get('limit'), include=request.args.get('include'))
+    return jsonify(history)
+
+@app.route('/api/audits/export', methods=['GET', 'POST'])
+def bulk_export_reports():
+    """ZIP of PDF reports for many audits (?ids=1,2,3 or JSON {"audit_ids": [...]}), streamed as it is built"""
+    authorized, user_id = _api_user_scope()
+    if not authorized:
+        return jsonify({'error': 'Authentication required'}), 401
+    
+    from bulk_export import MAX_AUDITS, stream_reports_zip
+    payload = request.get_json(silent=True) or {}
+    if not isinstance(payload, dict):
+        return jsonify({'error': 'Request body must be a JSON object'}), 400
+    raw_ids = payload.get('audit_ids') or request.args.get('ids', '').split(',')
+    if not isinstance(raw_ids, list):
+        return jsonify({'error': 'audit_ids must be a list'}), 400
+    try:
+        audit_ids = [int(audit_id) for audit_id in raw_ids if str(audit_id).strip()]
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Audit ids must be integers'}), 400
+    if not audit_ids:
+        return jsonify({'error': 'No audit ids given'}), 400
+    if len(audit_ids) > MAX_AUDITS:
+        return jsonify({'error': f'At most {MAX_AUDITS} audits per export'}), 400
+    
+    filename = f"hubspot_audit_reports_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.zip"
+    return Response(stream_with_context(stream_reports_zip(audit_ids, user_id)), mimetype='application/zip',
+                    headers={'Content-Disposition': f'attachment; filename={filename}',
+                             'X-Accel-Buffering': 'no'})
+
+@app.route('/api/audits/<int:audit_id>/lists/<list_name>.<fmt>')
+def export_audit_list(audit_id, list_name, fmt):
+    """Stream one detailed list of a saved audit as CSV or NDJSON (?source=snapshot for the raw HubSpot data)"""
+    authorized, user_id = _api_user_scope()
+    if not authorized:
+        return jsonify({'error': 'Authentication required'}), 401
+    
+    from detail_export import DETAIL_LISTS, FORMATS, rows_from_results, rows_from_snapshot, stream_list
+    from models import AuditResult
+    if list_name not in DETAIL_LISTS or fmt not in FORMATS:
+        return jsonify({'error': f"Unknown list or format; lists: {', '.join(DETAIL_LISTS)}, formats: {', '.join(FORMATS)}"}), 404
+    query = AuditResult.query.filter_by(id=audit_id)
+    if user_id is not None:
+        query = query.filter_by(user_id=user_id)
+    audit = query.first()
+    if audit is None:
+        return jsonify({'error': 'Audit not found'}), 404
+    
+    if request.args.get('source') == 'snapshot':
+        from snapshot_store import load_snapshot
+        snapshot = load_snapshot(audit.snapshot_hash) if audit.snapshot_hash else None
+        if snapshot is None:
+            return jsonify({'error': 'No raw snapshot archived for this audit'}), 404
+        rows = rows_from_snapshot(list_name, snapshot)
+    else:
+        rows = rows_from_results(list_name, audit.get_results_dict())
+    
+    use_gzip = request.accept_encodings['gzip'] > 0
+    response = Response(stream_with_context(stream_list(list_name, rows, fmt, gzip=use_gzip)), mimetype=FORMATS[fmt])
+    response.headers['Content-Disposition'] = f'attachment; filename=audit_{audit_id}_{list_name}.{fmt}'
+    response.headers['Vary'] = 'Accept-Encoding'
+    if use_gzip:
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+# Query parameters of the section API that are not column filters
+_SECTION_PARAMS = {'cursor', 'limit', 'sort', 'order', 'q'}
+
+def _detail_section_page(list_name, audit_results, endpoint, **url_values):
+    """JSON page of a detailed list (?cursor=&limit=&sort=&order=&q=, other parameters filter columns)"""
+    from detail_pages import DEFAULT_PAGE_SIZE, PageRequestError, list_page
+    from detail_export import DETAIL_LISTS, rows_from_results
+    if list_name not in DETAIL_LISTS:
+        return jsonify({'error': f"Unknown list; lists: {', '.join(DETAIL_LISTS)}"}), 404
+
+    filters = {key: value for key, value in request.args.items() if key not in _SECTION_PARAMS}
+    try:
+        page = list_page(
+            list_name, rows_from_results(list_name, audit_results),
+            cursor=request.args.get('cursor'),
+            limit=request.args.get('limit', DEFAULT_PAGE_SIZE, type=int),
+            sort=request.args.get('sort'),
+            order=request.args.get('order', 'asc'),
+            query=request.args.get('q'),
+            filters=filters
+        )
+    except PageRequestError as e:
+        return jsonify({'error': str(e)}), 400
+    if page['next_cursor']:
+        page['next_url'] = url_for(endpoint, list_name=list_name, **url_values,
+                                   **dict(request.args.items(), cursor=page['next_cursor']))
+    return jsonify(page)
+
+@app.route('/api/audits/<int:audit_id>/sections/<list_name>')
+def audit_section_page(audit_id, list_name):
+    """Page through one detailed list of a saved audit for the dashboard"""
+    authorized, user_id = _api_user_scope()
+    if not authorized:
+        return jsonify({'error': 'Authentication required'}), 401
+
+    from models import AuditResult
+    query = AuditResult.query.filter_by(id=audit_id)
+    if user_id is not None:
+        query = query.filter_by(user_id=user_id)
+    audit = query.first()
+    if audit is None:
+        return jsonify({'error': 'Audit not found'}), 404
+    return _detail_section_page(list_name, audit.get_results_dict(), 'audit_section_page', audit_id=audit_id)
+
+@app.route('/api/preview/sections/<list_name>')
+def preview_section_page(list_name):
+    """Page through one detailed list of the audit previewed in this session"""
+    audit_results = session.get('audit_results')
+    if not audit_results:
+        return jsonify({'error': 'No audit in this session'}), 404
+    return _detail_section_page(list_name, audit_results, 'preview_section_page')
+
+def _api_v1_audit_response(audit_id, category=None):
+    """Cached JSON of a saved audit or one category (?fields=), gzipped when accepted, with ETag/304"""
+    authorized, user_id = _api_user_scope()
+    if not authorized:
+        return jsonify({'error': 'Authentication required'}), 401
+
+    from audit_api import GZIP_MIN_BYTES, encoded_payload, parse_fields
+    from models import AuditResult
+    query = AuditResult.query.filter_by(id=audit_id)
+    if user_id is not None:
+        query = query.filter_by(user_id=user_id)
+    audit = query.first()
+    if audit is None:
+        return jsonify({'error': 'Audit not found'}), 404
+    try:
+        fields = parse_fields(request.args.get('fields'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    try:
+        payload = encoded_payload(audit, category, fields)
+    except KeyError:
+        return jsonify({'error': f"Category '{category}' not found in this audit"}), 404
+
+    use_gzip = request.accept_encodings['gzip'] > 0 and len(payload.body) >= GZIP_MIN_BYTES
+    # The gzipped body is a different representation, so it gets its own strong ETag
+    etag = f"{payload.etag}-gzip" if use_gzip else payload.etag
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        response = Response(payload.gzipped if use_gzip else payload.body, mimetype='application/json')
+        if use_gzip:
+            response.headers['Content-Encoding'] = 'gzip'
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.headers['Vary'] = 'Accept-Encoding, Authorization, Cookie'
+    return response
+
+@app.route('/api/v1/audits/<int:audit_id>')
+def api_v1_audit(audit_id):
+    """Saved audit as JSON: scores, categories, metrics and AI analysis"""
+    return _api_v1_audit_response(audit_id)
+
+@app.route('/api/v1/audits/<int:audit_id>/categories/<category>')
+def api_v1_audit_category(audit_id, category):
+    """One category of a saved audit as JSON"""
+    return _api_v1_audit_response(audit_id, category)
+
+@app.route('/api/schedules', methods=['GET', 'POST'])
+def audit_schedules():
+    """List recurring audits, or schedule the connected portal (JSON: cadence_hours)"""
+    authorized, user_id = _api_user_scope()
+    if not authorized:
+        return jsonify({'error': 'Authentication required'}), 401
+    
+    from models import AuditSchedule
+    from audit_scheduler import create_schedule, schedule_status
+    if request.method == 'GET':
+        query = AuditSchedule.query
+        if user_id is not None:
+            query = query.filter_by(user_id=user_id)
+        return jsonify({'schedules': [schedule_status(s) for s in query.order_by(AuditSchedule.id)]})
+    
+    refresh_token = session.get('hubspot_refresh_token')
+    portal_id = ((session.get('audit_results') or {}).get('portal_info') or {}).get('portalId')
+    if user_id is None or not refresh_token or not portal_id:
+        return jsonify({'error': 'Connect HubSpot and save an audit before scheduling one'}), 400
+    cadence_hours = (request.get_json(silent=True) or {}).get('cadence_hours', 24)
+    try:
+        schedule = create_schedule(user_id, portal_id, refresh_token, float(cadence_hours))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'cadence_hours must be a number'}), 400
+    return jsonify(schedule_status(schedule)), 201
+
+@app.route('/api/schedules/<int:schedule_id>', methods=['DELETE'])
+def delete_audit_schedule(schedule_id):
+    """Stop a recurring audit"""
+    authorized, user_id = _api_user_scope()
+    if not authorized:
+        return jsonify({'error': 'Authentication required'}), 401
+    
+    from models import AuditSchedule, db
+    from audit_scheduler import schedule_status, stop_schedule
+    schedule = db.session.get(AuditSchedule, schedule_id)
+    if schedule is None or (user_id is not None and schedule.user_id != user_id):
+        return jsonify({'error': 'Schedule not found'}), 404
+    stop_schedule(schedule)
+    db.session.commit()
+    return jsonify(schedule_status(schedule))
+
+@app.route('/webhooks/hubspot', methods=['POST'])
+def hubspot_webhook():
+    """Receive HubSpot change events and patch the snapshots of the portals they belong to"""
+    from portal_changes import apply_events, verify_signature
+    body = request.get_data()
+    if os.environ.get('HUBSPOT_WEBHOOK_VERIFY', 'true').lower() == 'true' and not verify_signature(
+            request.method, request.url, body, request.headers.get('X-HubSpot-Request-Timestamp'),
+            request.headers.get('X-HubSpot-Signature-v3'), os.environ.get('HUBSPOT_CLIENT_SECRET')):
+        return jsonify({'error': 'Invalid signature'}), 401
+    
+    events = request.get_json(silent=True)
+    if isinstance(events, dict):
+        events = [events]
+    if not isinstance(events, list):
+        return jsonify({'error': 'Expected a JSON list of events'}), 400
+    return jsonify(apply_events(events))
+
 @app.route('/logout')
 def logout():
     """Clear session and logout"""
+    ai_precomputer.cancel(session.get('ai_precompute_key'))
     session.clear()
     flash('Successfully logged out', 'info')
     return redirect(url_for('index'))
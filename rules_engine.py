@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""Scoring engine compiled from scoring_rules.json
+
+The rules file declares, per category, a weight and excellent/good/poor bands
+for each scored metric (plus optional score adjustments). Bands are compiled
+into sorted boundary tables so a metric's band is a single bisect, and the
+same tables drive a vectorized NumPy path for scoring many audits at once.
+"""
+
+import os
+import json
+import logging
+import threading
+from bisect import bisect_left, bisect_right
+from typing import Dict, List, Optional, Tuple
+
+DEFAULT_RULES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scoring_rules.json')
+
+# Best band first - when two bands share a boundary the better one wins
+BANDS = ['excellent', 'good', 'poor']
+BAND_LEVELS = {'excellent': 2, 'good': 1, 'poor': 0}
+
+# Every logic scores a category by its weakest metric band; 'linear_scaling'
+# categories have a single metric, so they score by that metric's band too
+SUPPORTED_LOGIC = {'all_conditions_met', 'combined_conditions', 'linear_scaling'}
+
+class ScoringRulesError(ValueError):
+    """Raised when scoring_rules.json is missing or inconsistent"""
+
+class CompiledMetric:
+    """Band table for one metric: bands sorted by upper bound"""
+
+    def __init__(self, name: str, bands: Dict):
+        self.name = name
+        ordered = sorted(bands.items(), key=lambda item: (item[1]['max'], -BAND_LEVELS[item[0]]))
+        self.maxes = [float(band['max']) for _, band in ordered]
+        self.mins = [float(band['min']) for _, band in ordered]
+        self.levels = [BAND_LEVELS[name] for name, _ in ordered]
+
+    def level(self, value: float) -> int:
+        """Band level of a value.
+
+        Values above the top band are clamped to it and values below the lowest
+        band are poor; a fractional value in the gap between two integer bands
+        (10.5 between 0-10 and 11-25) gets the worse of the two.
+        """
+        index = min(bisect_left(self.maxes, value), len(self.maxes) - 1)
+        if value < self.mins[index]:
+            if index == 0:
+                return BAND_LEVELS['poor']
+            return min(self.levels[index], self.levels[index - 1])
+        return self.levels[index]
+
+class CompiledAdjustment:
+    """Score delta looked up by a metric's value (first step whose max is not exceeded)"""
+
+    def __init__(self, name: str, steps: List[Dict]):
+        self.name = name
+        self.maxes = [float(step['max']) for step in steps]
+        self.deltas = [float(step['delta']) for step in steps]
+
+    def delta(self, value: float) -> float:
+        return self.deltas[min(bisect_left(self.maxes, value), len(self.maxes) - 1)]
+
+class CompiledCategory:
+    def __init__(self, key: str, rules: Dict, band_scores: Dict):
+        self.key = key
+        self.name = rules.get('name', key)
+        self.weight = float(rules['weight'])
+        self.metrics = [CompiledMetric(name, bands) for name, bands in rules['metrics'].items()]
+        self.adjustments = [CompiledAdjustment(name, steps) for name, steps in rules.get('adjustments', {}).items()]
+        bounds = rules.get('score_bounds', {})
+        self.min_score = float(bounds.get('min', 0.0))
+        self.max_score = float(bounds.get('max', 5.0))
+        # Level -> score, indexable by the band level
+        self.level_scores = [float(band_scores['poor']), float(band_scores['good']), float(band_scores['excellent'])]
+
+class RulesEngine:
+    """Validated, compiled scoring rules"""
+
+    def __init__(self, rules: Dict):
+        validate_rules(rules)
+        self.version = rules.get('version')
+        system = rules['scoring_system']
+        self.categories = {key: CompiledCategory(key, category_rules, system['band_scores'])
+                           for key, category_rules in rules['categories'].items()}
+        self.benchmarks = system.get('benchmarks', {})
+
+        scale = sorted(system['scale'].values(), key=lambda entry: entry['min'])
+        self.grade_mins = [float(entry['min']) for entry in scale]
+        self.grade_letters = [entry['grade'] for entry in scale]
+
+    @classmethod
+    def from_file(cls, path: str) -> 'RulesEngine':
+        try:
+            with open(path) as rules_file:
+                rules = json.load(rules_file)
+        except (OSError, ValueError) as e:
+            raise ScoringRulesError(f"Cannot load scoring rules from {path}: {str(e)}")
+        return cls(rules)
+
+    def score_category(self, category: str, metrics: Dict) -> float:
+        """Score one category's metrics dict (every banded metric must be present)"""
+        compiled = self.categories[category]
+        level = min(metric.level(metrics[metric.name]) for metric in compiled.metrics)
+        score = compiled.level_scores[level]
+        if compiled.adjustments:
+            score += sum(adjustment.delta(metrics.get(adjustment.name, 0)) for adjustment in compiled.adjustments)
+        return round(max(compiled.min_score, min(compiled.max_score, score)), 1)
+
+    def grade(self, score: float) -> str:
+        """Letter grade for a score on the 0-5 scale"""
+        return self.grade_letters[max(0, bisect_right(self.grade_mins, score) - 1)]
+
+    def overall_score(self, category_scores: Dict[str, Optional[float]]) -> Tuple[float, str]:
+        """Weighted overall score and grade; categories without a score are left out"""
+        weighted = [(self.categories[category].weight, score) for category, score in category_scores.items()
+                    if score is not None and category in self.categories]
+        total_weight = sum(weight for weight, _ in weighted)
+        if not total_weight:
+            return 0, 'F'
+        score = round(sum(weight * score for weight, score in weighted) / total_weight, 1)
+        return score, self.grade(score)
+
+    def score_category_vectors(self, category: str, columns: Dict[str, 'np.ndarray']) -> 'np.ndarray':
+        """Score many audits of one category at once.
+
+        columns maps each metric name to an array of values (one per audit); NaN
+        in a banded metric means the category was not scored and yields NaN.
+        """
+        import numpy as np
+
+        compiled = self.categories[category]
+        level = None
+        missing = None
+        for metric in compiled.metrics:
+            values = np.asarray(columns[metric.name], dtype=float)
+            maxes = np.asarray(metric.maxes)
+            levels = np.asarray(metric.levels)
+            index = np.minimum(np.searchsorted(maxes, values, side='left'), len(maxes) - 1)
+            gap_level = np.where(index == 0, BAND_LEVELS['poor'],
+                                 np.minimum(levels[index], levels[np.maximum(index - 1, 0)]))
+            metric_level = np.where(values < np.asarray(metric.mins)[index], gap_level, levels[index])
+            level = metric_level if level is None else np.minimum(level, metric_level)
+            missing = np.isnan(values) if missing is None else missing | np.isnan(values)
+
+        scores = np.asarray(compiled.level_scores)[level]
+        for adjustment in compiled.adjustments:
+            values = np.asarray(columns.get(adjustment.name, np.zeros(len(scores))), dtype=float)
+            values = np.nan_to_num(values, nan=0.0)
+            index = np.minimum(np.searchsorted(np.asarray(adjustment.maxes), values, side='left'),
+                               len(adjustment.maxes) - 1)
+            scores = scores + np.asarray(adjustment.deltas)[index]
+
+        scores = np.round(np.clip(scores, compiled.min_score, compiled.max_score), 1)
+        return np.where(missing, np.nan, scores)
+
+    def overall_score_vectors(self, category_scores: Dict[str, 'np.ndarray']) -> 'np.ndarray':
+        """Weighted overall scores for many audits; NaN category scores are left out"""
+        import numpy as np
+
+        categories = [category for category in category_scores if category in self.categories]
+        scores = np.vstack([np.asarray(category_scores[category], dtype=float) for category in categories])
+        weights = np.asarray([self.categories[category].weight for category in categories])[:, None]
+        present = ~np.isnan(scores)
+        total_weight = (weights * present).sum(axis=0)
+        weighted = (weights * np.nan_to_num(scores)).sum(axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            overall = np.where(total_weight > 0, weighted / total_weight, 0.0)
+        return np.round(overall, 1)
+
+    def grade_vectors(self, scores: 'np.ndarray') -> 'np.ndarray':
+        import numpy as np
+        index = np.maximum(np.searchsorted(np.asarray(self.grade_mins), scores, side='right') - 1, 0)
+        return np.asarray(self.grade_letters)[index]
+
+def validate_rules(rules: Dict):
+    """Raise ScoringRulesError describing the first problem found"""
+    system = rules.get('scoring_system')
+    if not isinstance(system, dict):
+        raise ScoringRulesError("Missing 'scoring_system'")
+    if not system.get('scale'):
+        raise ScoringRulesError("Missing 'scoring_system.scale'")
+    for name, entry in system['scale'].items():
+        if not {'min', 'max', 'grade'} <= set(entry) or entry['min'] > entry['max']:
+            raise ScoringRulesError(f"Invalid grade scale entry '{name}'")
+    band_scores = system.get('band_scores', {})
+    if set(band_scores) != set(BANDS):
+        raise ScoringRulesError(f"'scoring_system.band_scores' must define {', '.join(BANDS)}")
+
+    categories = rules.get('categories')
+    if not categories:
+        raise ScoringRulesError("No categories defined")
+    for key, category in categories.items():
+        weight = category.get('weight')
+        if not isinstance(weight, (int, float)) or weight <= 0:
+            raise ScoringRulesError(f"Category '{key}' needs a positive weight")
+        if category.get('scoring_logic') not in SUPPORTED_LOGIC:
+            raise ScoringRulesError(f"Category '{key}' has unsupported scoring_logic {category.get('scoring_logic')!r}")
+        if not category.get('metrics'):
+            raise ScoringRulesError(f"Category '{key}' has no metrics")
+        for metric, bands in category['metrics'].items():
+            if not bands or not set(bands) <= set(BANDS):
+                raise ScoringRulesError(f"Metric '{key}.{metric}' must use bands {', '.join(BANDS)}")
+            for band, limits in bands.items():
+                if not isinstance(limits.get('min'), (int, float)) or not isinstance(limits.get('max'), (int, float)) \
+                        or limits['min'] > limits['max']:
+                    raise ScoringRulesError(f"Band '{key}.{metric}.{band}' needs numeric min <= max")
+        for metric, steps in category.get('adjustments', {}).items():
+            maxes = [step.get('max') for step in steps]
+            if not steps or any(not isinstance(step.get('delta'), (int, float)) for step in steps) \
+                    or any(not isinstance(value, (int, float)) for value in maxes) or maxes != sorted(maxes):
+                raise ScoringRulesError(f"Adjustment '{key}.{metric}' needs steps with increasing max and a delta")
+
+    total_weight = sum(category['weight'] for category in categories.values())
+    if abs(total_weight - 1.0) > 0.01:
+        logging.warning(f"Scoring weights sum to {total_weight:.3f}, not 1.0 - they will be normalized")
+
+_rules_engine = None
+_rules_engine_lock = threading.Lock()
+
+def get_rules_engine() -> RulesEngine:
+    """Return the per-process engine, compiled from SCORING_RULES_PATH on first use"""
+    global _rules_engine
+    with _rules_engine_lock:
+        if _rules_engine is None:
+            _rules_engine = RulesEngine.from_file(os.environ.get("SCORING_RULES_PATH", DEFAULT_RULES_PATH))
+        return _rules_engine
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""Percentile benchmarks from all stored audits, kept up to date incrementally.
+
+Scores are 0-5 with one decimal, so a 51-bucket histogram per category (and
+one for the overall score) is an exact quantile sketch: smaller and simpler
+than a t-digest or KLL sketch and without their approximation error. Each
+bucket is a row in score_benchmark_bins; saving, rescoring or deleting an
+audit adjusts the affected buckets with an atomic count = count + 1, in the
+same transaction as the audit itself.
+"""
+
+import os
+import logging
+from typing import Dict, List, Optional
+from sqlalchemy import event, func, inspect
+from sqlalchemy.exc import IntegrityError
+from models import AuditCategoryMetrics, AuditResult, ScoreBenchmarkBin, db
+from rules_engine import get_rules_engine
+
+OVERALL = 'overall'
+BIN_COUNT = 51  # 0.0 .. 5.0 in steps of 0.1
+
+# Percentiles are only shown once enough audits have been stored to mean something
+MIN_AUDITS = int(os.environ.get("BENCHMARK_MIN_AUDITS", "20"))
+
+def score_bin(score: float) -> int:
+    return max(0, min(BIN_COUNT - 1, int(round(score * 10))))
+
+def _scopes() -> List[str]:
+    return list(get_rules_engine().categories) + [OVERALL]
+
+def _adjust(connection, scope: str, score: Optional[float], delta: int):
+    """Move one audit into (delta=1) or out of (delta=-1) a histogram bucket"""
+    if score is None:
+        return
+    table = ScoreBenchmarkBin.__table__
+    result = connection.execute(
+        table.update()
+        .where(table.c.scope == scope, table.c.bin == score_bin(score))
+        .values(count=table.c.count + delta))
+    if result.rowcount == 0 and delta > 0:
+        # Buckets are created up front; this only covers a scope added since
+        connection.execute(table.insert().values(scope=scope, bin=score_bin(score), count=delta))
+
+def _score_change(target, attribute: str):
+    """(old, new) score if the attribute changed in this flush, else None"""
+    history = inspect(target).attrs[attribute].history
+    if not history.has_changes():
+        return None
+    old = history.deleted[0] if history.deleted else None
+    new = history.added[0] if history.added else None
+    return old, new
+
+@event.listens_for(AuditResult, 'after_insert')
+def _audit_inserted(mapper, connection, target):
+    _adjust(connection, OVERALL, target.overall_score, 1)
+
+@event.listens_for(AuditResult, 'after_update')
+def _audit_updated(mapper, connection, target):
+    change = _score_change(target, 'overall_score')
+    if change:
+        _adjust(connection, OVERALL, change[0], -1)
+        _adjust(connection, OVERALL, change[1], 1)
+
+@event.listens_for(AuditResult, 'after_delete')
+def _audit_deleted(mapper, connection, target):
+    _adjust(connection, OVERALL, target.overall_score, -1)
+
+@event.listens_for(AuditCategoryMetrics, 'after_insert')
+def _category_inserted(mapper, connection, target):
+    _adjust(connection, target.category, target.score, 1)
+
+@event.listens_for(AuditCategoryMetrics, 'after_update')
+def _category_updated(mapper, connection, target):
+    change = _score_change(target, 'score')
+    if change:
+        _adjust(connection, target.category, change[0], -1)
+        _adjust(connection, target.category, change[1], 1)
+
+@event.listens_for(AuditCategoryMetrics, 'after_delete')
+def _category_deleted(mapper, connection, target):
+    _adjust(connection, target.category, target.score, -1)
+
+def rebuild_benchmarks():
+    """Recount every histogram from the stored audits (one full scan)"""
+    counts = {(scope, bin_index): 0 for scope in _scopes() for bin_index in range(BIN_COUNT)}
+
+    overall_bin = func.round(AuditResult.overall_score * 10)
+    for bin_index, count in (db.session.query(overall_bin, func.count(AuditResult.id))
+                             .filter(AuditResult.overall_score.isnot(None))
+                             .group_by(overall_bin)):
+        key = (OVERALL, score_bin(float(bin_index) / 10))
+        counts[key] = counts.get(key, 0) + count
+
+    category_bin = func.round(AuditCategoryMetrics.score * 10)
+    for category, bin_index, count in (db.session.query(AuditCategoryMetrics.category, category_bin,
+                                                        func.count(AuditCategoryMetrics.id))
+                                       .filter(AuditCategoryMetrics.score.isnot(None))
+                                       .group_by(AuditCategoryMetrics.category, category_bin)):
+        key = (category, score_bin(float(bin_index) / 10))
+        counts[key] = counts.get(key, 0) + count
+
+    ScoreBenchmarkBin.query.delete()
+    db.session.bulk_insert_mappings(ScoreBenchmarkBin, [
+        {'scope': scope, 'bin': bin_index, 'count': count} for (scope, bin_index), count in counts.items()
+    ])
+    db.session.commit()
+    return sum(count for (scope, _), count in counts.items() if scope == OVERALL)
+
+def ensure_benchmarks():
+    """Build the histograms on first start (from any audits already stored)"""
+    if db.session.query(ScoreBenchmarkBin.scope).first() is not None:
+        return
+    try:
+        audits = rebuild_benchmarks()
+        logging.info(f"Built score benchmarks from {audits} stored audits")
+    except IntegrityError:
+        # Another process built them at the same time
+        db.session.rollback()
+
+def load_histograms() -> Dict[str, List[int]]:
+    """Bucket counts per scope (a few hundred rows, independent of the number of audits)"""
+    histograms = {}
+    for scope, bin_index, count in db.session.query(ScoreBenchmarkBin.scope, ScoreBenchmarkBin.bin,
+                                                    ScoreBenchmarkBin.count):
+        histogram = histograms.setdefault(scope, [0] * BIN_COUNT)
+        if 0 <= bin_index < BIN_COUNT:
+            histogram[bin_index] = max(0, count)
+    return histograms
+
+def percentile_rank(histogram: List[int], score: float) -> Optional[int]:
+    """Percent of audits scoring below this score (ties count half)"""
+    total = sum(histogram)
+    if total < MIN_AUDITS:
+        return None
+    bin_index = score_bin(score)
+    below = sum(histogram[:bin_index])
+    return int(round(100 * (below + histogram[bin_index] / 2) / total))
+
+def quantile(histogram: List[int], fraction: float) -> Optional[float]:
+    """Score at the given fraction of audits (0.9 -> 90th percentile)"""
+    total = sum(histogram)
+    if not total:
+        return None
+    running = 0
+    for bin_index, count in enumerate(histogram):
+        running += count
+        if running >= fraction * total:
+            return bin_index / 10
+    return (BIN_COUNT - 1) / 10
+
+def audit_percentiles(audit_results: Dict, histograms: Optional[Dict[str, List[int]]] = None) -> Dict[str, int]:
+    """Percentile rank of an audit's overall and category scores; empty until enough audits exist.
+
+    Pass histograms (from load_histograms) when ranking many audits at once.
+    """
+    if histograms is None:
+        try:
+            histograms = load_histograms()
+        except Exception as e:
+            logging.error(f"Benchmark lookup error: {str(e)}")
+            return {}
+
+    scores = {OVERALL: audit_results.get('overall_score')}
+    for scope in histograms:
+        data = audit_results.get(scope)
+        if scope != OVERALL and isinstance(data, dict):
+            scores[scope] = data.get('score')
+
+    percentiles = {}
+    for scope, score in scores.items():
+        if score is None or scope not in histograms:
+            continue
+        rank = percentile_rank(histograms[scope], score)
+        if rank is not None:
+            percentiles[scope] = rank
+    return percentiles
+
+def stored_audit_percentiles(audit_record, histograms: Optional[Dict[str, List[int]]] = None) -> Dict[str, int]:
+    """audit_percentiles for a saved audit, from its score columns instead of its decoded results"""
+    scores = {'overall_score': audit_record.overall_score}
+    for row in audit_record.category_metrics:
+        scores[row.category] = {'score': row.score}
+    return audit_percentiles(scores, histograms)
+
+def benchmark_summary() -> Dict[str, Dict]:
+    """Live average and top-10% threshold per scope, falling back to the static
+    scoring_rules.json benchmarks until enough audits have been stored"""
+    static = get_rules_engine().benchmarks
+    histograms = load_histograms()
+    summary = {}
+    for scope in _scopes():
+        histogram = histograms.get(scope, [0] * BIN_COUNT)
+        total = sum(histogram)
+        if total >= MIN_AUDITS:
+            summary[scope] = {
+                'audits': total,
+                'average': round(sum(i * count for i, count in enumerate(histogram)) / total / 10, 2),
+                'top_10_percent': quantile(histogram, 0.9),
+                'source': 'audits'
+            }
+        else:
+            summary[scope] = {
+                'audits': total,
+                'average': static.get('industry_average', {}).get(scope),
+                'top_10_percent': static.get('top_10_percent', {}).get(scope),
+                'source': 'static'
+            }
+    return summary
@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""Server-side Flask sessions - the cookie only carries a signed session key"""
+
+import os
+import time
+import zlib
+import random
+import secrets
+import logging
+import tempfile
+from datetime import datetime, timedelta
+from typing import Optional
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from itsdangerous import BadSignature, Signer
+from werkzeug.datastructures import CallbackDict
+
+class ServerSession(CallbackDict, SessionMixin):
+    """Session dict that remembers its storage key and whether it was changed"""
+
+    def __init__(self, initial=None, sid: str = None, new: bool = False, expires_at: datetime = None):
+        def on_update(self):
+            self.modified = True
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.expires_at = expires_at
+        self.cleared_sid = None
+        self.modified = False
+
+    def clear(self):
+        # Logout - data stored after this (flash messages) goes under a fresh key
+        if self.cleared_sid is None and not self.new:
+            self.cleared_sid = self.sid
+            self.sid = secrets.token_urlsafe(32)
+        super().clear()
+
+class ServerSessionInterface(SessionInterface):
+    """Keep session data zlib-compressed in a database table or on local disk.
+
+    Audit results live in the session between the preview and the unlock/PDF
+    routes, so with cookie sessions every request carried (and often overflowed)
+    the whole portal payload. Here the request only carries an opaque key.
+    """
+
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, backend: str = None):
+        self.backend = (backend or os.environ.get("SESSION_BACKEND", "database")).lower()
+        self.lifetime = timedelta(hours=float(os.environ.get("SESSION_LIFETIME_HOURS", "24")))
+        self.compression_level = int(os.environ.get("SESSION_COMPRESSION_LEVEL", "6"))
+        self.cleanup_probability = float(os.environ.get("SESSION_CLEANUP_PROBABILITY", "0.01"))
+        self.refresh_interval = timedelta(seconds=float(os.environ.get("SESSION_REFRESH_SECONDS", "300")))
+        self.file_dir = os.environ.get("SESSION_FILE_DIR") or os.path.join(tempfile.gettempdir(), "hubspot-audit-sessions")
+        if self.backend == 'filesystem':
+            os.makedirs(self.file_dir, exist_ok=True)
+
+    def open_session(self, app, request) -> ServerSession:
+        signed_sid = request.cookies.get(self.get_cookie_name(app))
+        sid = self._unsign(app, signed_sid) if signed_sid else None
+        if sid:
+            loaded = self._load(sid)
+            if loaded is not None:
+                data, expires_at = loaded
+                return ServerSession(data, sid=sid, expires_at=expires_at)
+        return ServerSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def save_session(self, app, session: ServerSession, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if session.cleared_sid:
+            # Cleared (logout) - drop the stored data under the old key
+            self._delete(session.cleared_sid)
+
+        if not session:
+            if session.modified:
+                self._delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        expires_at = datetime.utcnow() + self.lifetime
+        if not session.modified:
+            # Sessions expire after SESSION_LIFETIME_HOURS without use, not after the last change
+            if session.expires_at and expires_at - session.expires_at > self.refresh_interval:
+                self._touch(session.sid, expires_at)
+            return
+
+        payload = zlib.compress(self.serializer.dumps(dict(session)).encode('utf-8'), self.compression_level)
+        self._store(session.sid, payload, expires_at)
+        if random.random() < self.cleanup_probability:
+            self.cleanup_expired()
+
+        response.set_cookie(
+            name,
+            self._signer(app).sign(session.sid).decode('utf-8'),
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app)
+        )
+
+    def cleanup_expired(self) -> int:
+        """Remove expired sessions and return how many were removed"""
+        try:
+            if self.backend == 'filesystem':
+                return self._cleanup_files()
+            return self._cleanup_rows()
+        except Exception as e:
+            logging.error(f"Session cleanup error: {str(e)}")
+            return 0
+
+    def _load(self, sid: str) -> Optional[tuple]:
+        """Return (data, expires_at) for a live session, None if it is missing or expired"""
+        try:
+            stored = self._read_file(sid) if self.backend == 'filesystem' else self._read_row(sid)
+            if stored is None:
+                return None
+            payload, expires_at = stored
+            return self.serializer.loads(zlib.decompress(payload).decode('utf-8')), expires_at
+        except Exception as e:
+            logging.error(f"Session load error: {str(e)}")
+            return None
+
+    def _store(self, sid: str, payload: bytes, expires_at: datetime):
+        try:
+            if self.backend == 'filesystem':
+                self._write_file(sid, payload, expires_at)
+            else:
+                self._write_row(sid, payload, expires_at)
+        except Exception as e:
+            logging.error(f"Session save error: {str(e)}")
+
+    def _touch(self, sid: str, expires_at: datetime):
+        try:
+            if self.backend == 'filesystem':
+                stored = self._read_file(sid)
+                if stored is not None:
+                    self._write_file(sid, stored[0], expires_at)
+            else:
+                from models import SessionRecord, db
+                SessionRecord.query.filter_by(id=sid).update({'expires_at': expires_at})
+                db.session.commit()
+        except Exception as e:
+            logging.error(f"Session refresh error: {str(e)}")
+
+    def _delete(self, sid: str):
+        try:
+            if self.backend == 'filesystem':
+                path = self._file_path(sid)
+                if os.path.exists(path):
+                    os.remove(path)
+            else:
+                from models import SessionRecord, db
+                SessionRecord.query.filter_by(id=sid).delete()
+                db.session.commit()
+        except Exception as e:
+            logging.error(f"Session delete error: {str(e)}")
+
+    # Database backend
+
+    def _read_row(self, sid: str) -> Optional[tuple]:
+        from models import SessionRecord, db
+        record = db.session.get(SessionRecord, sid)
+        if not record or record.expires_at < datetime.utcnow():
+            return None
+        return record.data, record.expires_at
+
+    def _write_row(self, sid: str, payload: bytes, expires_at: datetime):
+        from models import SessionRecord, db
+        record = db.session.get(SessionRecord, sid)
+        if record is None:
+            record = SessionRecord(id=sid)
+            db.session.add(record)
+        record.data = payload
+        record.expires_at = expires_at
+        db.session.commit()
+
+    def _cleanup_rows(self) -> int:
+        from models import SessionRecord, db
+        removed = SessionRecord.query.filter(SessionRecord.expires_at < datetime.utcnow()).delete()
+        db.session.commit()
+        return removed
+
+    # Filesystem backend - each file is an expiry timestamp line followed by the payload
+
+    def _file_path(self, sid: str) -> str:
+        return os.path.join(self.file_dir, f"{sid}.session")
+
+    def _read_file(self, sid: str) -> Optional[tuple]:
+        path = self._file_path(sid)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'rb') as session_file:
+            expires_ts = float(session_file.readline())
+            now = time.time()
+            if expires_ts < now:
+                return None
+            return session_file.read(), datetime.utcnow() + timedelta(seconds=expires_ts - now)
+
+    def _write_file(self, sid: str, payload: bytes, expires_at: datetime):
+        expires_ts = time.time() + (expires_at - datetime.utcnow()).total_seconds()
+        fd, tmp_path = tempfile.mkstemp(dir=self.file_dir, suffix=".tmp")
+        with os.fdopen(fd, 'wb') as session_file:
+            session_file.write(f"{expires_ts}\n".encode('ascii'))
+            session_file.write(payload)
+        # Atomic so a concurrent request never reads a half-written session
+        os.replace(tmp_path, self._file_path(sid))
+
+    def _cleanup_files(self) -> int:
+        removed = 0
+        now = time.time()
+        for name in os.listdir(self.file_dir):
+            if not name.endswith(".session"):
+                continue
+            path = os.path.join(self.file_dir, name)
+            try:
+                with open(path, 'rb') as session_file:
+                    expired = float(session_file.readline()) < now
+                if expired:
+                    os.remove(path)
+                    removed += 1
+            except (OSError, ValueError):
+                continue
+        return removed
+
+    @staticmethod
+    def _signer(app) -> Signer:
+        return Signer(app.secret_key, salt="server-session")
+
+    def _unsign(self, app, signed_sid: str) -> Optional[str]:
+        try:
+            return self._signer(app).unsign(signed_sid).decode('utf-8')
+        except BadSignature:
+            return None
+
+def install_session_interface(app):
+    """Use server-side sessions unless SESSION_BACKEND=cookie"""
+    backend = os.environ.get("SESSION_BACKEND", "database").lower()
+    if backend == 'cookie':
+        return
+    app.session_interface = ServerSessionInterface(backend)
+    logging.info(f"Using {backend} server-side sessions")
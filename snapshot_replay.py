@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""Record the raw HubSpot data an audit fetches and replay audits from it offline.
+
+Kept free of Flask and database imports so bulk re-scoring can run it in
+worker processes.
+"""
+
+import copy
+import inspect
+import logging
+import zlib
+from typing import Callable, Dict, Optional
+from hubspot_service import HubSpotService
+from audit_engine import AuditEngine
+from results_codec import COMPRESSION_LEVEL, content_hash, dumps, loads
+
+SNAPSHOT_VERSION = 1
+
+# HubSpotService methods whose return values make up a snapshot
+SNAPSHOT_METHODS = [
+    'get_account_info', 'get_users', 'get_integrations',
+    'get_contact_properties', 'get_company_properties', 'get_deal_properties',
+    'get_workflows', 'get_forms', 'get_form_submissions',
+    'get_dashboards', 'get_reports', 'get_pipelines', 'get_contact_count_by_property'
+]
+
+def snapshot_key(method: str, args: tuple, kwargs: dict) -> str:
+    """Key for one call, with defaults filled in so equivalent calls match"""
+    bound = inspect.signature(getattr(HubSpotService, method)).bind(None, *args, **kwargs)
+    bound.apply_defaults()
+    call_args = list(bound.arguments.values())[1:]
+    return f"{method}:{dumps(call_args).decode('utf-8')}" if call_args else method
+
+class RecordingHubSpotService(HubSpotService):
+    """HubSpotService that keeps every fetched result for the audit's snapshot"""
+
+    def __init__(self, access_token=None):
+        super().__init__(access_token)
+        self.recorded_calls = {}
+
+    def snapshot(self) -> Dict:
+        return {'version': SNAPSHOT_VERSION, 'calls': self.recorded_calls}
+
+class ReplayHubSpotService(HubSpotService):
+    """HubSpotService that answers from a snapshot and never touches the network"""
+
+    # Subclasses that fetch missing calls live also add them to self.calls
+    fetch_missing = False
+
+    def __init__(self, snapshot: Dict):
+        super().__init__(None)
+        self.calls = snapshot.get('calls', {})
+        self.missing_calls = []
+
+    def _make_api_call(self, endpoint: str, params: Dict = None) -> Optional[Dict]:
+        # Only reached for calls missing from the snapshot - behave like a failed request
+        self.missing_calls.append(endpoint)
+        return None
+
+class RefreshingReplayHubSpotService(ReplayHubSpotService):
+    """Answers from a (patched) snapshot and fetches only the calls it does not have.
+
+    Used by incremental audits: the result is a complete snapshot again.
+    """
+
+    fetch_missing = True
+
+    def __init__(self, snapshot: Dict, access_token: str):
+        super().__init__({'calls': dict(snapshot.get('calls', {}))})
+        self.access_token = access_token
+
+    def _make_api_call(self, endpoint: str, params: Dict = None) -> Optional[Dict]:
+        return HubSpotService._make_api_call(self, endpoint, params)
+
+    def snapshot(self) -> Dict:
+        return {'version': SNAPSHOT_VERSION, 'calls': self.calls}
+
+def _recording(method: str) -> Callable:
+    original = getattr(HubSpotService, method)
+
+    def record(self, *args, **kwargs):
+        result = original(self, *args, **kwargs)
+        self.recorded_calls[snapshot_key(method, args, kwargs)] = copy.deepcopy(result)
+        return result
+    record.__name__ = method
+    return record
+
+def _replaying(method: str) -> Callable:
+    original = getattr(HubSpotService, method)
+
+    def replay(self, *args, **kwargs):
+        key = snapshot_key(method, args, kwargs)
+        if key in self.calls:
+            return copy.deepcopy(self.calls[key])
+        result = original(self, *args, **kwargs)
+        if self.fetch_missing:
+            self.calls[key] = copy.deepcopy(result)
+        return result
+    replay.__name__ = method
+    return replay
+
+for _method in SNAPSHOT_METHODS:
+    setattr(RecordingHubSpotService, _method, _recording(_method))
+    setattr(ReplayHubSpotService, _method, _replaying(_method))
+
+def encode_snapshot(snapshot: Dict):
+    """(content hash, compressed blob, raw size) for a snapshot"""
+    raw = dumps(snapshot)
+    return content_hash(snapshot), zlib.compress(raw, COMPRESSION_LEVEL), len(raw)
+
+def decode_snapshot(blob: bytes) -> Dict:
+    return loads(zlib.decompress(blob))
+
+def replay_audit(snapshot: Dict) -> Dict:
+    """Run the audit engine against a snapshot"""
+    hubspot = ReplayHubSpotService(snapshot)
+    audit_results = AuditEngine(hubspot).run_full_audit()
+    if hubspot.missing_calls:
+        logging.warning(f"Snapshot replay had no data for {len(hubspot.missing_calls)} calls")
+    return audit_results
+
+def rescore_snapshot_blob(blob: bytes) -> Dict:
+    """Process-pool entry point: decode a stored snapshot and replay the audit"""
+    return replay_audit(decode_snapshot(blob))
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""Content-addressed archive of raw portal snapshots, and audits that record one"""
+
+import logging
+from typing import Callable, Dict, Optional
+from sqlalchemy.exc import IntegrityError
+from api_budget import ApiBudgetExhausted
+from audit_engine import AuditEngine
+from models import PortalSnapshot, db
+from snapshot_replay import RecordingHubSpotService, decode_snapshot, encode_snapshot
+
+def store_snapshot(snapshot: Dict, portal_id: Optional[str] = None) -> str:
+    """Archive a snapshot (once per distinct content) and return its content hash"""
+    snapshot_hash, blob, raw_size = encode_snapshot(snapshot)
+    if db.session.query(PortalSnapshot.id).filter_by(id=snapshot_hash).first():
+        return snapshot_hash
+
+    try:
+        with db.session.begin_nested():
+            db.session.add(PortalSnapshot(id=snapshot_hash, hubspot_portal_id=portal_id, data=blob,
+                                          raw_size=raw_size, stored_size=len(blob)))
+    except IntegrityError:
+        # Stored concurrently by another worker - same content, nothing to do. Only the
+        # savepoint was rolled back; the caller's own changes are still pending.
+        return snapshot_hash
+    db.session.commit()
+    return snapshot_hash
+
+def load_snapshot(snapshot_hash: str) -> Optional[Dict]:
+    snapshot = db.session.get(PortalSnapshot, snapshot_hash)
+    return decode_snapshot(snapshot.data) if snapshot else None
+
+def run_recorded_audit(access_token: str, progress_callback: Callable = None) -> Dict:
+    """Run a live audit and archive the raw data it fetched; results carry the snapshot id.
+
+    With INCREMENTAL_AUDITS_ENABLED, a portal kept current by webhooks is
+    re-audited from its patched snapshot instead (see portal_changes).
+    """
+    from portal_changes import INCREMENTAL_ENABLED, incremental_audit, scopes_key, seed_live_snapshot
+    if INCREMENTAL_ENABLED:
+        try:
+            audit_results = incremental_audit(access_token, progress_callback=progress_callback)
+            if audit_results:
+                return audit_results
+        except ApiBudgetExhausted:
+            raise
+        except Exception as e:
+            db.session.rollback()
+            logging.error(f"Incremental audit error, running a full audit: {str(e)}")
+
+    hubspot = RecordingHubSpotService(access_token)
+    audit_results = AuditEngine(hubspot, progress_callback=progress_callback).run_full_audit()
+    if audit_results:
+        portal_id = (audit_results.get('portal_info') or {}).get('portalId')
+        try:
+            audit_results['snapshot_id'] = store_snapshot(hubspot.snapshot(), portal_id)
+        except Exception as e:
+            db.session.rollback()
+            logging.error(f"Snapshot archive error: {str(e)}")
+        if INCREMENTAL_ENABLED:
+            seed_live_snapshot(portal_id, hubspot.snapshot(), audit_results, scopes_key(access_token))
+    return audit_results
@@ -0,0 +1,33 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Importing app creates the tables, so point it at a throwaway database first
+_db_dir = tempfile.mkdtemp(prefix='hubspot-audit-tests-')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_db_dir, 'test.db')}"
+os.environ.setdefault('OPENAI_API_KEY', 'test')
+os.environ.setdefault('SESSION_BACKEND', 'cookie')
+os.environ.setdefault('API_BUDGET_BACKEND', 'off')
+
+# The app module has to be imported before models and the modules built on them
+import app as _app_module  # noqa: E402,F401
+
+@pytest.fixture(scope='session')
+def app():
+    from app import app as flask_app
+    flask_app.config['TESTING'] = True
+    return flask_app
+
+@pytest.fixture
+def app_context(app):
+    with app.app_context():
+        yield
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
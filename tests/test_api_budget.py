@@ -0,0 +1,184 @@
+import pytest
+
+import api_budget
+from api_budget import ApiBudgetExhausted, grant
+from audit_engine import AuditEngine
+from hubspot_service import HubSpotService
+
+def _simulate(demands, seconds=20.0, step=0.01, rate=9.0, burst=10.0):
+    """Calls granted per tenant when each tenant asks for one call every step while its demand lasts"""
+    app_tokens, app_updated = burst, 0.0
+    tenants = {name: [0.0, 0.0] for name in demands}
+    granted = {name: 0 for name in demands}
+    now = 0.0
+    while now < seconds:
+        active = [name for name in demands if granted[name] < demands[name]]
+        for name in active:
+            tokens, updated = tenants[name]
+            got, _, app_tokens, tokens = grant(app_tokens, app_updated, tokens, updated, len(active), 1, now,
+                                               rate=rate, burst=burst)
+            app_updated = now
+            tenants[name] = [tokens, now]
+            granted[name] += got
+        now += step
+    return granted
+
+def test_busy_tenants_split_the_rate_evenly():
+    granted = _simulate({'big': 10 ** 6, 'small-1': 10 ** 6, 'small-2': 10 ** 6})
+    total = sum(granted.values())
+    assert 0.95 * 9 * 20 <= total <= 9 * 20 + 10
+    for count in granted.values():
+        assert abs(count - total / 3) <= 0.05 * total
+
+def test_small_tenant_finishes_despite_a_huge_one():
+    granted = _simulate({'huge': 10 ** 6, 'small': 30}, seconds=8)
+    assert granted['small'] == 30
+    # The huge tenant still gets the rest of the app's rate
+    assert granted['huge'] + granted['small'] >= 0.95 * 9 * 8
+
+def test_lone_tenant_gets_the_full_rate():
+    granted = _simulate({'only': 10 ** 6}, seconds=10)
+    assert 0.95 * 9 * 10 <= granted['only'] <= 9 * 10 + 10
+
+def test_daily_limit_raises(monkeypatch):
+    monkeypatch.setattr(api_budget, 'DAILY_LIMIT', 5)
+    now = 1_800_000_000.0
+    day = api_budget._utc_day(now)
+    assert api_budget._count_daily(day, 3, 4, now) == (day, 5, 2)
+    with pytest.raises(ApiBudgetExhausted):
+        api_budget._count_daily(day, 5, 1, now)
+
+class _ExhaustedBudget:
+    def acquire(self, access_token=None):
+        raise ApiBudgetExhausted('Daily HubSpot API limit of 5 calls reached')
+
+def test_exhausted_budget_fails_the_audit_instead_of_scoring_empty_data(monkeypatch):
+    monkeypatch.setattr(HubSpotService, 'rate_limiter', _ExhaustedBudget())
+    hubspot = HubSpotService('token')
+    assert hubspot.get_users() == []
+    with pytest.raises(ApiBudgetExhausted):
+        AuditEngine(HubSpotService('token')).run_full_audit()
+
+def test_exhausted_budget_fails_the_job(app_context, app, monkeypatch):
+    import uuid
+    import audit_jobs
+    from models import AuditJob, db
+    monkeypatch.setattr(HubSpotService, 'rate_limiter', _ExhaustedBudget())
+    job = AuditJob(id=uuid.uuid4().hex, status='running', access_token='token', worker_id='owner', attempts=1)
+    job.set_progress_dict(audit_jobs._empty_progress())
+    db.session.add(job)
+    db.session.commit()
+    worker = audit_jobs.AuditJobWorker(app)
+    worker.worker_id = 'owner'
+    worker.run_job(job)
+
+    db.session.expire_all()
+    job = db.session.get(AuditJob, job.id)
+    assert job.status == 'failed' and 'API limit' in job.error_message
+    assert job.results_json is None
+
+# End of 2026-10-19 UTC
+DAY_END = 1_792_454_399.0
+
+def _database_store(app):
+    from models import ApiBudgetBucket, db
+    with app.app_context():
+        ApiBudgetBucket.query.delete()
+        db.session.commit()
+        return api_budget.DatabaseBudgetStore(db.engine)
+
+@pytest.fixture(params=['database', 'shm'])
+def store(request, app, tmp_path):
+    if request.param == 'shm':
+        return api_budget.SharedMemoryBudgetStore(str(tmp_path / 'budget'))
+    return _database_store(app)
+
+class _CountingStore:
+    def __init__(self, store, failures=0):
+        self.store = store
+        self.failures = failures
+        self.calls = 0
+
+    def take(self, tenant, want, now):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise RuntimeError('database is locked')
+        return self.store.take(tenant, want, now)
+
+def test_lease_covers_several_calls(store):
+    counting = _CountingStore(store)
+    budget = api_budget.ApiBudget(counting, lease_size=3)
+    for _ in range(3):
+        budget.acquire('token')
+    assert counting.calls == 1
+    budget.acquire('token')
+    assert counting.calls == 2
+
+def test_tenants_share_the_rate(store):
+    now = DAY_END - 100
+    assert store.take('a' * 16, 1, now)[0] == 1
+    # Two active tenants: each bucket holds half the burst
+    assert store.take('b' * 16, 10, now)[0] == 5
+    # Both are idle by now, so a third tenant gets the whole burst again
+    assert store.take('c' * 16, 10, now + api_budget.ACTIVE_SECONDS + 1)[0] == 10
+
+def test_daily_count_rolls_over_at_utc_midnight(store, monkeypatch):
+    monkeypatch.setattr(api_budget, 'DAILY_LIMIT', 5)
+    assert store.take('a' * 16, 10, DAY_END - 1)[0] == 5
+    with pytest.raises(ApiBudgetExhausted):
+        store.take('a' * 16, 1, DAY_END - 0.5)
+    assert store.take('a' * 16, 3, DAY_END + 1)[0] == 3
+
+def test_database_version_conflict_retries(app, monkeypatch):
+    from sqlalchemy import update
+    store = _database_store(app)
+    table = store.table
+    real_grant = api_budget.grant
+    conflicts = []
+
+    def racing_grant(*args, **kwargs):
+        if not conflicts:
+            # Another process writes the app row between our read and our write
+            conflicts.append(True)
+            with store.engine.begin() as connection:
+                connection.execute(update(table).where(table.c.key == 'app').values(version=table.c.version + 1))
+        return real_grant(*args, **kwargs)
+    monkeypatch.setattr(api_budget, 'grant', racing_grant)
+
+    assert store.take('a' * 16, 1, DAY_END - 100) == (0, 0.005)
+    assert store.take('a' * 16, 1, DAY_END - 100)[0] == 1
+
+    monkeypatch.setattr(api_budget.time, 'sleep', lambda seconds: None)
+    conflicts.clear()
+    counting = _CountingStore(store)
+    api_budget.ApiBudget(counting, lease_size=1).acquire('token')
+    assert counting.calls == 2
+
+def test_shm_reuses_the_slot_idle_longest(tmp_path):
+    store = api_budget.SharedMemoryBudgetStore(str(tmp_path / 'budget'))
+    now = DAY_END - 100
+    for index in range(api_budget.SHM_SLOTS):
+        store.take(f"{index + 1:016x}", 1, now + index * 0.001)
+
+    def slot_keys():
+        return [store.SLOT.unpack_from(store._map, store._slot_offset(index))[0]
+                for index in range(api_budget.SHM_SLOTS)]
+    assert slot_keys() == list(range(1, api_budget.SHM_SLOTS + 1))
+
+    store.take(f"{1000:016x}", 1, now + 1)
+    assert slot_keys()[0] == 1000
+    store.take(f"{1:016x}", 1, now + 2)
+    assert slot_keys()[:2] == [1000, 1]
+    assert slot_keys()[2:] == list(range(3, api_budget.SHM_SLOTS + 1))
+
+def test_store_errors_are_retried_then_let_through(store, monkeypatch, caplog):
+    monkeypatch.setattr(api_budget.time, 'sleep', lambda seconds: None)
+    flaky = _CountingStore(store, failures=api_budget.STORE_ERROR_RETRIES - 1)
+    api_budget.ApiBudget(flaky, lease_size=1).acquire('token')
+    assert flaky.calls == api_budget.STORE_ERROR_RETRIES
+    assert 'API budget unavailable' not in caplog.text
+
+    broken = _CountingStore(store, failures=10 ** 6)
+    api_budget.ApiBudget(broken, lease_size=1).acquire('token')
+    assert broken.calls == api_budget.STORE_ERROR_RETRIES
+    assert 'API budget unavailable, allowing call: database is locked' in caplog.text
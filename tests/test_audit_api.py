@@ -0,0 +1,42 @@
+from datetime import datetime
+
+import pytest
+
+import audit_api
+from audit_api import encoded_payload, parse_fields
+
+class _Audit:
+    hubspot_portal_id = '123'
+    audit_timestamp = datetime(2026, 1, 1)
+
+    def __init__(self, audit_id, padding=0):
+        self.id = audit_id
+        self.content_hash = f"hash-{audit_id}"
+        self.results = {'overall_score': 4.0, 'admin': {'score': 4.0, 'notes': 'x' * padding}}
+
+    def get_results_dict(self):
+        return self.results
+
+def test_equivalent_field_selections_share_a_key():
+    assert parse_fields('categories.admin.score, categories,overall_score,categories') == ('categories', 'overall_score')
+    assert parse_fields(' , ') is None
+
+def test_oversized_field_selections_are_rejected():
+    with pytest.raises(ValueError):
+        parse_fields(','.join(f"field{index}" for index in range(audit_api.MAX_FIELDS + 1)))
+    with pytest.raises(ValueError):
+        parse_fields('a' * (audit_api.MAX_FIELD_LENGTH + 1))
+
+def test_cache_is_bounded_by_bytes(monkeypatch):
+    monkeypatch.setattr(audit_api, '_cache', type(audit_api._cache)())
+    monkeypatch.setattr(audit_api, '_cache_bytes', 0)
+    monkeypatch.setattr(audit_api, 'PAYLOAD_CACHE_MAX_BYTES', 20000)
+
+    for audit_id in range(10):
+        encoded_payload(_Audit(audit_id, padding=3000))
+    assert 0 < audit_api._cache_bytes <= 20000
+    assert audit_api._cache_bytes == sum(entry.cost for entry in audit_api._cache.values())
+    assert [key[0] for key in audit_api._cache] == [7, 8, 9]
+
+    encoded_payload(_Audit(99, padding=30000))  # larger than the whole cache
+    assert all(key[0] != 99 for key in audit_api._cache)
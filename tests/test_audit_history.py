@@ -0,0 +1,44 @@
+from datetime import datetime
+
+from audit_history import decode_cursor, encode_cursor
+
+def test_cursor_round_trip():
+    timestamp = datetime(2026, 3, 4, 5, 6, 7, 891011)
+    cursor = encode_cursor(timestamp, 12345)
+    assert '=' not in cursor
+    assert decode_cursor(cursor) == (timestamp, 12345)
+
+def test_cursor_without_microseconds_round_trips():
+    timestamp = datetime(2026, 1, 1)
+    assert decode_cursor(encode_cursor(timestamp, 1)) == (timestamp, 1)
+
+def test_malformed_cursors_decode_to_none():
+    for cursor in ['', 'not-a-cursor', encode_cursor(datetime(2026, 1, 1), 1)[:-4], '////']:
+        assert decode_cursor(cursor) is None
+
+def test_pages_walk_every_audit_once_newest_first(app_context):
+    import uuid
+    from datetime import timedelta
+    from audit_history import portal_history
+    from models import AuditResult, User, db
+    user = User(email=f"{uuid.uuid4().hex}@example.com")
+    db.session.add(user)
+    db.session.flush()
+    portal_id = uuid.uuid4().hex
+    start = datetime(2026, 1, 1)
+    # Two audits share each timestamp, so the id breaks ties
+    for index in range(7):
+        db.session.add(AuditResult(user_id=user.id, hubspot_portal_id=portal_id, overall_score=index / 2,
+                                   audit_timestamp=start + timedelta(days=index // 2)))
+    db.session.commit()
+
+    seen, cursor = [], None
+    while True:
+        page = portal_history(portal_id, limit=3, cursor=decode_cursor(cursor) if cursor else None)
+        seen.extend(audit['id'] for audit in page['audits'])
+        cursor = page['next_cursor']
+        if not cursor:
+            break
+    expected = [row.id for row in AuditResult.query.filter_by(hubspot_portal_id=portal_id)
+                .order_by(AuditResult.audit_timestamp.desc(), AuditResult.id.desc())]
+    assert seen == expected
@@ -0,0 +1,118 @@
+import uuid
+from datetime import datetime, timedelta
+
+import audit_jobs
+from audit_jobs import AuditJobWorker, JobProgressRecorder
+
+def _running_job(worker_id='worker-1'):
+    from models import AuditJob, db
+    job = AuditJob(id=uuid.uuid4().hex, status='running', access_token='token', worker_id=worker_id,
+                   attempts=1, heartbeat_at=datetime.utcnow() - timedelta(hours=1))
+    job.set_progress_dict(audit_jobs._empty_progress())
+    db.session.add(job)
+    db.session.commit()
+    return job
+
+def test_api_calls_keep_the_heartbeat_fresh(app_context, monkeypatch):
+    from models import AuditJob, db
+    monkeypatch.setattr(audit_jobs, 'HEARTBEAT_SECONDS', 0)
+    job = _running_job()
+    recorder = JobProgressRecorder(job)
+    recorder.record('api_call', {'api_calls': 7})
+
+    db.session.expire_all()
+    job = db.session.get(AuditJob, job.id)
+    assert job.heartbeat_at > datetime.utcnow() - timedelta(minutes=1)
+    assert job.get_progress_dict()['api_calls'] == 7
+
+def test_heartbeat_writes_are_throttled(app_context, monkeypatch):
+    from models import AuditJob, db
+    monkeypatch.setattr(audit_jobs, 'HEARTBEAT_SECONDS', 3600)
+    job = _running_job()
+    stale = job.heartbeat_at
+    JobProgressRecorder(job).record('api_call', {'api_calls': 1})
+
+    db.session.expire_all()
+    assert db.session.get(AuditJob, job.id).heartbeat_at == stale
+
+def test_requeued_job_outcome_is_not_overwritten(app_context, app, monkeypatch):
+    from models import AuditJob, db
+    job = _running_job(worker_id='loser')
+    worker = AuditJobWorker(app)
+    worker.worker_id = 'loser'
+
+    def audit_taken_over(access_token, progress_callback=None):
+        # Meanwhile the job was requeued as stale and claimed by another worker
+        db.session.execute(audit_jobs.update(AuditJob).where(AuditJob.id == job.id).values(worker_id='winner'))
+        db.session.commit()
+        return {'overall_score': 1.0}
+    monkeypatch.setattr(audit_jobs, 'run_recorded_audit', audit_taken_over)
+    worker.run_job(job)
+
+    db.session.expire_all()
+    job = db.session.get(AuditJob, job.id)
+    assert job.status == 'running' and job.worker_id == 'winner'
+    assert job.results_json is None and job.access_token == 'token'
+
+def test_owner_records_outcome(app_context, app, monkeypatch):
+    from models import AuditJob, db
+    job = _running_job(worker_id='owner')
+    worker = AuditJobWorker(app)
+    worker.worker_id = 'owner'
+    monkeypatch.setattr(audit_jobs, 'run_recorded_audit', lambda token, progress_callback=None: {'overall_score': 3.0})
+    worker.run_job(job)
+
+    db.session.expire_all()
+    job = db.session.get(AuditJob, job.id)
+    assert job.status == 'completed' and job.access_token is None
+    assert job.get_results_dict() == {'overall_score': 3.0}
+
+def test_audits_run_as_live_jobs_by_default(monkeypatch):
+    monkeypatch.delenv('AUDIT_JOB_QUEUE', raising=False)
+    assert audit_jobs.queue_mode() == 'inline'
+    monkeypatch.setenv('AUDIT_JOB_QUEUE', 'sync')
+    assert audit_jobs.queue_mode() == 'off'
+
+def test_inline_recovery_runs_jobs_left_behind(app_context, monkeypatch):
+    from models import AuditJob, db
+    job = _running_job(worker_id='dead-process')
+    started = []
+
+    class _Pool:
+        def submit(self, fn, *args):
+            started.append(args[0]) if fn is audit_jobs._run_inline_job else fn(*args)
+    monkeypatch.setattr(audit_jobs, '_inline_executor', _Pool())
+    audit_jobs._recover_inline_jobs()
+
+    db.session.expire_all()
+    assert db.session.get(AuditJob, job.id).status == 'queued'
+    assert job.id in started
+
+def test_status_endpoint_returns_new_events_for_polling(app_context, client):
+    from models import db
+    job = _running_job()
+    progress = job.get_progress_dict()
+    progress['events'] = [{'id': 1, 'event': 'category_started', 'data': {'category': 'admin'}},
+                          {'id': 2, 'event': 'category_finished', 'data': {'category': 'admin'}}]
+    job.set_progress_dict(progress)
+    db.session.commit()
+    with client.session_transaction() as sess:
+        sess['audit_job_id'] = job.id
+
+    response = client.get(f'/api/audit-jobs/{job.id}?after=1')
+    assert [entry['id'] for entry in response.get_json()['events']] == [2]
+    assert 'events' not in client.get(f'/api/audit-jobs/{job.id}').get_json()
+
+def test_event_stream_is_off_by_default_and_tolerates_bad_ids(app_context, client, monkeypatch):
+    from models import db
+    job = _running_job()
+    job.status = 'completed'
+    db.session.commit()
+    with client.session_transaction() as sess:
+        sess['audit_job_id'] = job.id
+
+    assert client.get(f'/api/audit-jobs/{job.id}/events').status_code == 404
+    monkeypatch.setenv('AUDIT_SSE_ENABLED', 'true')
+    response = client.get(f'/api/audit-jobs/{job.id}/events', headers={'Last-Event-ID': 'abc'})
+    assert response.status_code == 200
+    assert 'job_completed' in response.get_data(as_text=True)
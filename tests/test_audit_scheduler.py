@@ -0,0 +1,47 @@
+import uuid
+from datetime import datetime
+
+import audit_scheduler
+from audit_scheduler import create_schedule
+
+def _user():
+    from models import User, db
+    user = User(email=f"{uuid.uuid4().hex}@example.com")
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+def test_refresh_token_is_stored_encrypted(app_context):
+    schedule = create_schedule(_user().id, uuid.uuid4().hex, 'refresh-secret', 24)
+    assert 'refresh-secret' not in schedule.refresh_token
+    assert schedule.get_refresh_token() == 'refresh-secret'
+
+def test_deleting_a_schedule_drops_its_token(app_context, client, monkeypatch):
+    from models import AuditSchedule, db
+    schedule = create_schedule(_user().id, uuid.uuid4().hex, 'refresh-secret', 24)
+    monkeypatch.setenv('API_TOKEN', 'secret')
+
+    response = client.delete(f'/api/schedules/{schedule.id}', headers={'Authorization': 'Bearer secret'})
+    assert response.status_code == 200 and 'refresh' not in response.get_data(as_text=True)
+    db.session.expire_all()
+    schedule = db.session.get(AuditSchedule, schedule.id)
+    assert not schedule.enabled and schedule.refresh_token is None
+
+def test_schedule_disabled_after_failures_drops_its_token(app_context):
+    from models import db
+    schedule = create_schedule(_user().id, uuid.uuid4().hex, 'refresh-secret', 24)
+    for _ in range(audit_scheduler.MAX_FAILURES):
+        audit_scheduler._record_failure(schedule, 'token refresh failed', datetime.utcnow())
+    db.session.commit()
+    assert not schedule.enabled and schedule.refresh_token is None
+
+def test_unreadable_token_fails_the_run_without_calling_hubspot(app_context, monkeypatch):
+    from models import db
+    schedule = create_schedule(_user().id, uuid.uuid4().hex, 'refresh-secret', 24)
+    schedule.refresh_token = 'plaintext-from-before'
+    db.session.commit()
+    monkeypatch.setattr(audit_scheduler.HubSpotService, 'refresh_access_token',
+                        lambda self, token: (_ for _ in ()).throw(AssertionError('called HubSpot')))
+
+    assert audit_scheduler._dispatch(schedule, datetime.utcnow()) is None
+    assert schedule.consecutive_failures == 1
@@ -0,0 +1,35 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import batch_audit
+
+class _ThreadPool(ThreadPoolExecutor):
+    """Runs the batch in threads and records how many audits were queued at once"""
+    submitted = 0
+    finished = 0
+    most_queued = 0
+    lock = threading.Lock()
+
+    def __init__(self, max_workers, mp_context=None, initializer=None, initargs=()):
+        super().__init__(max_workers=max_workers)
+
+    def submit(self, fn, *args):
+        with _ThreadPool.lock:
+            _ThreadPool.submitted += 1
+            _ThreadPool.most_queued = max(_ThreadPool.most_queued, _ThreadPool.submitted - _ThreadPool.finished)
+        return super().submit(fn, *args)
+
+def _fake_audit(token):
+    with _ThreadPool.lock:
+        _ThreadPool.finished += 1
+    return {'results': {'portal_info': {}}, 'snapshot': None, 'api_calls': 1, 'seconds': 0.0}
+
+def test_batch_submits_a_bounded_window(app_context, monkeypatch):
+    monkeypatch.setattr(batch_audit, 'ProcessPoolExecutor', _ThreadPool)
+    monkeypatch.setattr(batch_audit, 'audit_portal', _fake_audit)
+    tokens = [f"token-{index}" for index in range(50)]
+
+    summary = batch_audit.run_batch(tokens, user_id=1, processes=3)
+    assert summary['failed'] == 50 and summary['api_calls'] == 50
+    assert _ThreadPool.submitted == 50
+    assert _ThreadPool.most_queued <= 2 * 3
@@ -0,0 +1,60 @@
+import pytest
+
+@pytest.fixture
+def api_client(client, monkeypatch):
+    monkeypatch.setenv('API_TOKEN', 'secret')
+    client.environ_base['HTTP_AUTHORIZATION'] = 'Bearer secret'
+    return client
+
+@pytest.mark.parametrize('body', [[1, 2], {'audit_ids': 5}, {'audit_ids': {'a': 1}}, {'audit_ids': [{'a': 1}]},
+                                  {'audit_ids': ['x']}, {'audit_ids': [[1]]}])
+def test_malformed_export_requests_are_rejected(api_client, body):
+    response = api_client.post('/api/audits/export', json=body)
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
+
+def test_export_requires_authentication(client):
+    assert client.post('/api/audits/export', json={'audit_ids': [1]}).status_code == 401
+
+def test_export_streams_a_valid_zip_of_visible_reports(client, app, monkeypatch, tmp_path):
+    import io
+    import uuid
+    import zipfile
+    import bulk_export
+    from models import AuditResult, User, db
+
+    def fake_render(results, percentiles=None):
+        path = tmp_path / f"{results['overall_score']}.pdf"
+        path.write_bytes(b'%PDF-1.4 ' + str(results['overall_score']).encode() * 5000)
+        return str(path), path.name
+    monkeypatch.setattr(bulk_export, 'RENDER_PROCESSES', 0)
+    monkeypatch.setattr(bulk_export, 'get_or_render', fake_render)
+
+    with app.app_context():
+        owner, other = User(email=f"{uuid.uuid4().hex}@example.com"), User(email=f"{uuid.uuid4().hex}@example.com")
+        db.session.add_all([owner, other])
+        db.session.flush()
+        audits = []
+        for user, score in [(owner, 1.5), (owner, 2.5), (other, 3.5)]:
+            audit = AuditResult(user_id=user.id, hubspot_portal_id='123', overall_score=score)
+            audit.set_results_dict({'overall_score': score})
+            db.session.add(audit)
+            audits.append(audit)
+        db.session.commit()
+        visible, forbidden, owner_id = [audits[0].id, audits[1].id], audits[2].id, owner.id
+    missing = forbidden + 10000
+
+    with client.session_transaction() as sess:
+        sess['user_id'] = owner_id
+    response = client.post('/api/audits/export', json={'audit_ids': visible + [forbidden, missing]})
+    assert response.status_code == 200
+
+    chunks = list(response.response)
+    archive = zipfile.ZipFile(io.BytesIO(b''.join(chunks)))
+    assert archive.testzip() is None
+    reports = [name for name in archive.namelist() if name.endswith('.pdf')]
+    assert sorted(name.rsplit('_', 1)[0] for name in reports) == sorted(f"audit_{audit_id}_123" for audit_id in visible)
+    assert all(archive.read(name).startswith(b'%PDF') for name in reports)
+    errors = archive.read('errors.txt').decode()
+    assert f"audit_{forbidden}.pdf: not found" in errors
+    assert f"audit_{missing}.pdf: not found" in errors
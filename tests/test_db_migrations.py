@@ -0,0 +1,26 @@
+from sqlalchemy import create_engine, inspect, text
+
+from app import db
+from db_migrations import _upgrade
+
+def test_sqlite_rebuild_keeps_rows_and_foreign_keys(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    with engine.begin() as connection:
+        connection.execute(text('CREATE TABLE users (id INTEGER PRIMARY KEY, email VARCHAR(120))'))
+        connection.execute(text('CREATE TABLE audit_results (id INTEGER PRIMARY KEY, user_id INTEGER, '
+                                'results_json TEXT NOT NULL)'))
+        connection.execute(text('CREATE TABLE audit_notes (id INTEGER PRIMARY KEY, '
+                                'audit_id INTEGER REFERENCES audit_results(id))'))
+        connection.execute(text("INSERT INTO audit_results (id, user_id, results_json) VALUES (1, 1, '{}')"))
+
+    with engine.begin() as connection:
+        db.metadata.create_all(connection)
+        _upgrade(connection)
+
+    inspector = inspect(engine)
+    results_json = next(c for c in inspector.get_columns('audit_results') if c['name'] == 'results_json')
+    assert results_json['nullable']
+    assert inspector.get_foreign_keys('audit_notes')[0]['referred_table'] == 'audit_results'
+    assert 'audit_results__new' not in inspector.get_table_names()
+    with engine.connect() as connection:
+        assert connection.execute(text('SELECT results_json FROM audit_results')).scalar() == '{}'
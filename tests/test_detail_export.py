@@ -0,0 +1,61 @@
+import csv
+import io
+import zlib
+
+import orjson
+import pytest
+
+from detail_export import stream_list
+
+ROWS = [
+    {'name': 'lead_score', 'label': '=HYPERLINK("http://x")', 'objectType': 'contact', 'hubspotDefined': False,
+     'potentially_unused': True, 'extra': 'dropped'},
+    {'name': 'region', 'label': '-', 'objectType': 'company', 'hubspotDefined': True, 'potentially_unused': False},
+]
+
+def test_csv_has_the_list_columns_and_neutralizes_formulas():
+    text = b''.join(stream_list('properties', iter(ROWS), 'csv')).decode('utf-8')
+    rows = list(csv.DictReader(io.StringIO(text)))
+    assert list(rows[0]) == ['name', 'label', 'objectType', 'type', 'fieldType', 'groupName', 'hubspotDefined',
+                             'created', 'potentially_unused']
+    assert [row['name'] for row in rows] == ['lead_score', 'region']
+    assert rows[0]['label'] == '\'=HYPERLINK("http://x")'
+    assert rows[1]['label'] == "'-"
+    assert rows[0]['potentially_unused'] == 'True'
+
+def test_ndjson_keeps_values_as_they_are():
+    lines = b''.join(stream_list('properties', iter(ROWS), 'ndjson')).splitlines()
+    rows = [orjson.loads(line) for line in lines]
+    assert len(rows) == 2
+    assert rows[0]['label'] == '=HYPERLINK("http://x")'
+    assert rows[1] == {'name': 'region', 'label': '-', 'objectType': 'company', 'type': None, 'fieldType': None,
+                       'groupName': None, 'hubspotDefined': True, 'created': None, 'potentially_unused': False}
+
+@pytest.mark.parametrize('fmt', ['csv', 'ndjson'])
+def test_gzip_stream_is_one_valid_member(fmt, monkeypatch):
+    import detail_export
+    monkeypatch.setattr(detail_export, 'ROWS_PER_CHUNK', 7)
+    rows = [{'name': f"prop_{index}", 'label': f"Property {index}"} for index in range(100)]
+    chunks = list(stream_list('properties', iter(rows), fmt, gzip=True))
+    assert len(chunks) > 2
+    assert zlib.decompress(b''.join(chunks), 31) == b''.join(stream_list('properties', iter(rows), fmt))
+
+def test_snapshot_export_without_archived_snapshot_is_404(client, app, monkeypatch):
+    import uuid
+    from models import AuditResult, User, db
+    with app.app_context():
+        user = User(email=f"{uuid.uuid4().hex}@example.com")
+        db.session.add(user)
+        db.session.flush()
+        audit = AuditResult(user_id=user.id, hubspot_portal_id='123', overall_score=3.0)
+        audit.set_results_dict({'properties': {'metrics': {'properties_list': ROWS}}})
+        db.session.add(audit)
+        db.session.commit()
+        audit_id = audit.id
+
+    monkeypatch.setenv('API_TOKEN', 'secret')
+    headers = {'Authorization': 'Bearer secret'}
+    assert client.get(f"/api/audits/{audit_id}/lists/properties.csv", headers=headers).status_code == 200
+    response = client.get(f"/api/audits/{audit_id}/lists/properties.csv?source=snapshot", headers=headers)
+    assert response.status_code == 404
+    assert 'snapshot' in response.get_json()['error']
@@ -0,0 +1,79 @@
+import pytest
+
+from detail_pages import PageRequestError, decode_cursor, encode_cursor, list_page
+
+PROPERTIES = [
+    {'name': f"prop_{index:02d}", 'label': f"Property {index}", 'objectType': ['contact', 'company'][index % 2],
+     'created': None if index % 5 == 0 else f"2026-01-{index % 28 + 1:02d}", 'potentially_unused': index % 3 == 0}
+    for index in range(23)
+]
+
+def _walk(**kwargs):
+    names, cursor = [], None
+    while True:
+        page = list_page('properties', PROPERTIES, cursor=cursor, limit=4, **kwargs)
+        names.extend(item['name'] for item in page['items'])
+        cursor = page['next_cursor']
+        if cursor is None:
+            return names
+
+def test_cursor_round_trip():
+    assert decode_cursor(encode_cursor(40, 'abc')) == (40, 'abc')
+    for cursor in ['', 'not-a-cursor', '////']:
+        assert decode_cursor(cursor) is None
+
+def test_pages_walk_every_row_once():
+    assert _walk() == [row['name'] for row in PROPERTIES]
+    sorted_names = _walk(sort='label', order='desc')
+    assert len(sorted_names) == len(set(sorted_names)) == len(PROPERTIES)
+
+def test_cursor_is_tied_to_its_sort_and_filter():
+    cursor = list_page('properties', PROPERTIES, limit=4, sort='name')['next_cursor']
+    assert list_page('properties', PROPERTIES, cursor=cursor, limit=4, sort='name')['items']
+    with pytest.raises(PageRequestError):
+        list_page('properties', PROPERTIES, cursor=cursor, limit=4, sort='label')
+    with pytest.raises(PageRequestError):
+        list_page('properties', PROPERTIES, cursor=cursor, limit=4, sort='name', filters={'objectType': 'contact'})
+
+@pytest.mark.parametrize('order', ['asc', 'desc'])
+def test_blanks_sort_last_in_both_orders(order):
+    created = [item['created'] for item in list_page('properties', PROPERTIES, limit=50, sort='created', order=order)['items']]
+    present = [value for value in created if value]
+    assert created == present + [None] * 5
+    assert present == sorted(present, reverse=order == 'desc')
+
+def test_bool_filters():
+    page = list_page('properties', PROPERTIES, limit=50, filters={'potentially_unused': 'true'})
+    assert page['matched'] == 8 and page['total'] == 23
+    assert all(item['potentially_unused'] for item in page['items'])
+    assert list_page('properties', PROPERTIES, limit=50, filters={'potentially_unused': 'false'})['matched'] == 15
+
+@pytest.fixture
+def section_url(app, monkeypatch):
+    import uuid
+    from models import AuditResult, User, db
+    with app.app_context():
+        user = User(email=f"{uuid.uuid4().hex}@example.com")
+        db.session.add(user)
+        db.session.flush()
+        audit = AuditResult(user_id=user.id, hubspot_portal_id='123', overall_score=3.0)
+        audit.set_results_dict({'properties': {'metrics': {'properties_list': PROPERTIES}}})
+        db.session.add(audit)
+        db.session.commit()
+        audit_id = audit.id
+    monkeypatch.setenv('API_TOKEN', 'secret')
+    return f"/api/audits/{audit_id}/sections/properties"
+
+@pytest.mark.parametrize('query', ['sort=nope', 'nope=1', 'cursor=////', 'cursor=not-a-cursor'])
+def test_bad_section_requests_are_400(client, section_url, query):
+    response = client.get(f"{section_url}?{query}", headers={'Authorization': 'Bearer secret'})
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
+
+def test_section_pages_follow_next_url(client, section_url):
+    names, url = [], f"{section_url}?limit=10&sort=name"
+    while url:
+        page = client.get(url, headers={'Authorization': 'Bearer secret'}).get_json()
+        names.extend(item['name'] for item in page['items'])
+        url = page.get('next_url')
+    assert names == sorted(row['name'] for row in PROPERTIES)
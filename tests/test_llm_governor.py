@@ -0,0 +1,32 @@
+from types import SimpleNamespace
+
+from llm_governor import DatabaseUsageStore, LLMGovernor
+
+def _response(tokens):
+    return SimpleNamespace(usage=SimpleNamespace(prompt_tokens=tokens, completion_tokens=0),
+                           choices=[SimpleNamespace(message=SimpleNamespace(content='ok'))])
+
+def test_daily_budget_is_shared_between_processes(app_context, monkeypatch):
+    from models import LLMUsage, db
+    LLMUsage.query.delete()
+    db.session.commit()
+    monkeypatch.setattr(LLMGovernor, 'usage_store', DatabaseUsageStore(db.engine))
+    monkeypatch.setenv('LLM_DAILY_TOKEN_BUDGET', '1000')
+
+    # Two governors stand in for two worker processes
+    first, second = LLMGovernor(client=object()), LLMGovernor(client=object())
+    first._record_success('gpt-4o', _response(600), 1.0)
+    assert second.select_model() is not None
+    second._record_success('gpt-4o', _response(500), 1.0)
+
+    assert second.select_model() is None
+    first._shared_read_at = 0  # past the refresh interval
+    assert first.select_model() is None
+    assert first.get_stats()['tokens_today'] == 1100
+
+def test_metrics_hidden_without_token(client, monkeypatch):
+    monkeypatch.delenv('METRICS_TOKEN', raising=False)
+    assert client.get('/metrics').status_code == 404
+    monkeypatch.setenv('METRICS_TOKEN', 'secret')
+    assert client.get('/metrics').status_code == 404
+    assert client.get('/metrics', headers={'Authorization': 'Bearer secret'}).status_code == 200
@@ -0,0 +1,93 @@
+import uuid
+
+import pytest
+
+import portal_changes
+from audit_engine import AuditEngine
+from hubspot_service import HubSpotService
+from portal_changes import _patch, apply_events, incremental_audit, seed_live_snapshot
+from snapshot_replay import RecordingHubSpotService, decode_snapshot
+
+def _changes():
+    return {'dirty': [], 'pending': {}, 'seen': {}}
+
+def _form_event(change, occurred_at, name=None, portal_id='1'):
+    event = {'portalId': portal_id, 'subscriptionType': f'form.{change}', 'objectId': 'f1', 'occurredAt': occurred_at}
+    if name:
+        event['object'] = {'guid': 'f1', 'name': name}
+    return event
+
+def test_late_event_does_not_undo_a_newer_one():
+    snapshot = {'calls': {'get_forms': [{'guid': 'f1', 'name': 'v1'}]}}
+    changes = _changes()
+    assert _patch(snapshot, changes, _form_event('deletion', 200))
+    # The creation happened before the deletion but was delivered after it
+    assert not _patch(snapshot, changes, _form_event('creation', 100, name='v1'))
+    assert snapshot['calls']['get_forms'] == []
+    assert _patch(snapshot, changes, _form_event('creation', 300, name='v3'))
+    assert snapshot['calls']['get_forms'] == [{'guid': 'f1', 'name': 'v3'}]
+    assert changes['dirty'] == ['forms']
+
+def test_change_without_body_is_fetched_later():
+    snapshot = {'calls': {'get_forms': [{'guid': 'f1', 'name': 'v1'}]}}
+    changes = _changes()
+    assert _patch(snapshot, changes, _form_event('propertyChange', 100))
+    assert snapshot['calls']['get_forms'] == [{'guid': 'f1', 'name': 'v1'}]
+    assert changes['pending']['get_forms:f1']['endpoint'] == '/forms/v2/forms/f1'
+
+def test_batches_are_applied_in_occurrence_order(app_context):
+    from models import PortalLiveSnapshot, db
+    portal_id = uuid.uuid4().hex
+    seed_live_snapshot(portal_id, {'calls': {'get_forms': [{'guid': 'f1', 'name': 'v1'}]}}, {}, 'scopes')
+
+    summary = apply_events([_form_event('propertyChange', 300, 'v3', portal_id),
+                            _form_event('propertyChange', 200, 'v2', portal_id)])
+    assert summary['applied'] == 2
+    summary = apply_events([_form_event('propertyChange', 250, 'late', portal_id)])
+    assert summary == {'applied': 0, 'ignored': 1, 'portals': []}
+
+    db.session.expire_all()
+    live = db.session.get(PortalLiveSnapshot, portal_id)
+    assert decode_snapshot(live.data)['calls']['get_forms'] == [{'guid': 'f1', 'name': 'v3'}]
+
+@pytest.fixture
+def fake_portal(monkeypatch):
+    """A portal whose user list can change between audits; counts the API calls made"""
+    portal = {'id': uuid.uuid4().int % 10 ** 9, 'users': [{'id': '1', 'superAdmin': True}], 'calls': [],
+              'scopes': ['oauth', 'forms']}
+
+    def fake_call(self, endpoint, params=None):
+        portal['calls'].append(endpoint)
+        self._record_api_call(endpoint, 200)
+        if endpoint.startswith('/account-info'):
+            return {'portalId': portal['id']}
+        if endpoint == '/settings/v3/users':
+            return {'results': portal['users']}
+        return [] if endpoint.startswith('/forms/') else {'results': []}
+    monkeypatch.setattr(HubSpotService, '_make_api_call', fake_call)
+    monkeypatch.setattr(HubSpotService, 'get_token_info', lambda self: {'scopes': list(portal['scopes'])})
+    return portal
+
+def _full_audit(portal):
+    hubspot = RecordingHubSpotService('token')
+    results = AuditEngine(hubspot).run_full_audit()
+    seed_live_snapshot(str(portal['id']), hubspot.snapshot(), results, portal_changes.scopes_key('token'))
+    return results
+
+def test_incremental_audit_refreshes_untracked_categories_and_is_marked(app_context, fake_portal):
+    full = _full_audit(fake_portal)
+    assert 'incremental' not in full
+    fake_portal['users'] = [{'id': str(index)} for index in range(30)]
+    fake_portal['calls'].clear()
+
+    results = incremental_audit('token')
+    assert results['incremental']['rerun_categories'] == ['admin', 'reporting', 'sales']
+    assert results['incremental']['reused_categories'] == ['properties', 'workflows', 'forms']
+    assert results['admin']['metrics']['total_users'] == 30
+    assert '/settings/v3/users' in fake_portal['calls']
+    assert not any('properties' in call or 'workflows' in call for call in fake_portal['calls'])
+
+def test_token_with_other_scopes_gets_a_full_audit(app_context, fake_portal):
+    _full_audit(fake_portal)
+    fake_portal['scopes'] = ['oauth']
+    assert incremental_audit('token') is None
@@ -0,0 +1,66 @@
+import copy
+import random
+
+from results_delta import apply_patch, diff
+
+def _round_trip(old, new):
+    ops = diff(old, new)
+    assert apply_patch(copy.deepcopy(old), ops) == new
+    return ops
+
+def test_identical_documents_have_no_ops():
+    doc = {'admin': {'score': 4.5, 'items': [1, 2, 3]}}
+    assert _round_trip(doc, copy.deepcopy(doc)) == []
+
+def test_dict_and_list_edits_round_trip():
+    old = {'overall_score': 3.1, 'admin': {'score': 3.5, 'users': [{'id': 1}, {'id': 2}], 'gone': True},
+           'forms': {'details': ['a', 'b', 'c', 'd']}}
+    new = {'overall_score': 3.4, 'admin': {'score': 4.0, 'users': [{'id': 1, 'role': 'admin'}, {'id': 3}]},
+           'forms': {'details': ['x', 'a', 'c', 'd', 'e']}, 'sales': {'score': None}}
+    _round_trip(old, new)
+
+def test_type_changes_and_root_replacement_round_trip():
+    _round_trip({'a': [1, 2]}, {'a': {'1': 2}})
+    _round_trip({'a': 1}, [1, 2])
+    _round_trip([1, 2, 3], [])
+    _round_trip({'a': 1}, {'a': 1.0})
+
+def _random_value(rng, depth):
+    kind = rng.randint(0, 4 if depth < 3 else 2)
+    if kind == 0:
+        return rng.randint(0, 5)
+    if kind == 1:
+        return rng.choice(['a', 'b', None, True])
+    if kind == 2:
+        return round(rng.uniform(0, 5), 1)
+    if kind == 3:
+        return [_random_value(rng, depth + 1) for _ in range(rng.randint(0, 5))]
+    return {rng.choice('abcdef'): _random_value(rng, depth + 1) for _ in range(rng.randint(0, 4))}
+
+def _mutate(rng, value, depth=0):
+    if isinstance(value, dict):
+        value = dict(value)
+        for key in list(value):
+            roll = rng.random()
+            if roll < 0.2:
+                del value[key]
+            elif roll < 0.6:
+                value[key] = _mutate(rng, value[key], depth + 1)
+        if rng.random() < 0.3:
+            value[rng.choice('abcdefgh')] = _random_value(rng, depth + 1)
+        return value
+    if isinstance(value, list):
+        value = [_mutate(rng, item, depth + 1) if rng.random() < 0.4 else item for item in value]
+        if value and rng.random() < 0.3:
+            del value[rng.randrange(len(value))]
+        if rng.random() < 0.3:
+            value.insert(rng.randint(0, len(value)), _random_value(rng, depth + 1))
+        return value
+    return _random_value(rng, depth) if rng.random() < 0.5 else value
+
+def test_random_documents_round_trip():
+    rng = random.Random(35)
+    for _ in range(500):
+        old = {key: _random_value(rng, 0) for key in 'abcd'}
+        new = _mutate(rng, old)
+        _round_trip(old, new)
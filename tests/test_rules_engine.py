@@ -0,0 +1,65 @@
+import random
+
+import numpy as np
+
+from rules_engine import get_rules_engine
+
+def _legacy_properties_score(unused_percentage):
+    if unused_percentage <= 10:
+        return 5.0
+    elif unused_percentage <= 25:
+        return 3.5
+    return 2.0
+
+def _legacy_sales_score(pipelines, unassigned_percentage):
+    if pipelines >= 2 and unassigned_percentage <= 5:
+        return 5.0
+    elif pipelines >= 1 and unassigned_percentage <= 15:
+        return 3.5
+    return 2.0
+
+def _legacy_grade(score):
+    for minimum, grade in ((4.5, 'A'), (3.5, 'B'), (2.5, 'C'), (1.5, 'D')):
+        if score >= minimum:
+            return grade
+    return 'F'
+
+def _random_metrics(engine, category, rng):
+    compiled = engine.categories[category]
+    names = [metric.name for metric in compiled.metrics] + [adjustment.name for adjustment in compiled.adjustments]
+    return {name: rng.choice([rng.randint(0, 40), round(rng.uniform(0, 100), 1)]) for name in names}
+
+def test_scores_match_the_previous_thresholds():
+    engine = get_rules_engine()
+    rng = random.Random(37)
+    for _ in range(2000):
+        unused = rng.choice([rng.randint(0, 100), round(rng.uniform(0, 100), 1)])
+        assert engine.score_category('properties', {'unused_percentage': unused}) == _legacy_properties_score(unused)
+
+        pipelines, unassigned = rng.randint(0, 4), rng.choice([rng.randint(0, 30), round(rng.uniform(0, 30), 1)])
+        metrics = {'total_pipelines': pipelines, 'unassigned_deals_percentage': unassigned}
+        assert engine.score_category('sales', metrics) == _legacy_sales_score(pipelines, unassigned)
+
+    for tenths in range(0, 51):
+        assert engine.grade(tenths / 10) == _legacy_grade(tenths / 10)
+
+def test_vector_path_matches_scalar_scoring():
+    engine = get_rules_engine()
+    rng = random.Random(38)
+    category_scores = {}
+    for category in engine.categories:
+        rows = [_random_metrics(engine, category, rng) for _ in range(500)]
+        columns = {name: np.asarray([row[name] for row in rows], dtype=float) for name in rows[0]}
+        vector_scores = engine.score_category_vectors(category, columns)
+        assert list(vector_scores) == [engine.score_category(category, row) for row in rows]
+        category_scores[category] = vector_scores
+
+    overall = engine.overall_score_vectors(category_scores)
+    for index in range(0, 500, 25):
+        expected = engine.overall_score({category: float(scores[index]) for category, scores in category_scores.items()})
+        assert (float(overall[index]), str(engine.grade_vectors(overall[index:index + 1])[0])) == expected
+
+def test_unscored_categories_are_left_out():
+    engine = get_rules_engine()
+    assert engine.overall_score({'admin': 5.0, 'properties': None}) == (5.0, 'A')
+    assert np.isnan(engine.score_category_vectors('properties', {'unused_percentage': np.array([np.nan])})[0])
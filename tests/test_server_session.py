@@ -0,0 +1,83 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from server_session import ServerSessionInterface
+
+@pytest.fixture(params=['database', 'filesystem'])
+def interface(request, app, monkeypatch, tmp_path):
+    monkeypatch.setenv('SESSION_FILE_DIR', str(tmp_path))
+    session_interface = ServerSessionInterface(request.param)
+    monkeypatch.setattr(app, 'session_interface', session_interface)
+    return session_interface
+
+def _cookie(client, app):
+    cookie = client.get_cookie(app.config['SESSION_COOKIE_NAME'])
+    return cookie.value if cookie else None
+
+def _stored(interface, app, sid):
+    with app.app_context():
+        return interface._load(sid)
+
+def test_signed_key_round_trip(interface, client, app):
+    with client.session_transaction() as sess:
+        sess['portal_id'] = '123'
+        sess['results'] = {'overall_score': 4.5}
+
+    signed = _cookie(client, app)
+    sid = interface._unsign(app, signed)
+    assert sid and '123' not in signed
+    assert _stored(interface, app, sid)[0]['results'] == {'overall_score': 4.5}
+    with client.session_transaction() as sess:
+        assert sess['portal_id'] == '123'
+
+def test_tampered_or_unknown_cookie_gets_empty_session(interface, client, app):
+    with client.session_transaction() as sess:
+        sess['portal_id'] = '123'
+    signed = _cookie(client, app)
+    name = app.config['SESSION_COOKIE_NAME']
+
+    client.set_cookie(name, signed[:-2] + ('AA' if not signed.endswith('AA') else 'BB'))
+    with client.session_transaction() as sess:
+        assert dict(sess) == {}
+
+    client.set_cookie(name, interface._signer(app).sign('no-such-session').decode('utf-8'))
+    with client.session_transaction() as sess:
+        assert dict(sess) == {}
+
+def test_expired_sessions_are_ignored_and_cleaned_up(interface, client, app):
+    interface.lifetime = timedelta(seconds=-1)
+    with client.session_transaction() as sess:
+        sess['portal_id'] = '123'
+    sid = interface._unsign(app, _cookie(client, app))
+    with client.session_transaction() as sess:
+        assert dict(sess) == {}
+    assert _stored(interface, app, sid) is None
+
+    result = app.test_cli_runner().invoke(args=['cleanup-sessions'])
+    assert 'Removed 1 expired sessions' in result.output
+    with app.app_context():
+        assert interface.cleanup_expired() == 0
+
+def test_access_refreshes_expiry(interface, client, app):
+    with client.session_transaction() as sess:
+        sess['portal_id'] = '123'
+    sid = interface._unsign(app, _cookie(client, app))
+    with app.app_context():
+        interface._touch(sid, datetime.utcnow() + timedelta(hours=1))
+
+    with client.session_transaction() as sess:
+        assert sess['portal_id'] == '123'
+    data, expires_at = _stored(interface, app, sid)
+    assert data['portal_id'] == '123'
+    assert expires_at > datetime.utcnow() + interface.lifetime - timedelta(minutes=1)
+
+def test_logout_deletes_stored_session(interface, client, app):
+    with client.session_transaction() as sess:
+        sess['portal_id'] = '123'
+    sid = interface._unsign(app, _cookie(client, app))
+
+    assert client.get('/logout').status_code == 302
+    assert _stored(interface, app, sid) is None
+    with client.session_transaction() as sess:
+        assert 'portal_id' not in sess
@@ -0,0 +1,28 @@
+import uuid
+
+from snapshot_replay import encode_snapshot
+from snapshot_store import store_snapshot
+
+class _NoMatch:
+    """Stands in for the existence check, as if another worker stored the snapshot just after it"""
+    def filter_by(self, **kwargs):
+        return self
+
+    def first(self):
+        return None
+
+def test_concurrently_stored_snapshot_keeps_callers_changes(app_context, monkeypatch):
+    from models import AuditJob, PortalSnapshot, db
+    snapshot = {'calls': {'get_forms': [{'guid': uuid.uuid4().hex}]}}
+    snapshot_hash, blob, raw_size = encode_snapshot(snapshot)
+    db.session.add(PortalSnapshot(id=snapshot_hash, data=blob, raw_size=raw_size, stored_size=len(blob)))
+    db.session.commit()
+
+    job_id = uuid.uuid4().hex
+    db.session.add(AuditJob(id=job_id, status='queued'))
+    monkeypatch.setattr(db.session, 'query', lambda *entities: _NoMatch())
+    assert store_snapshot(snapshot) == snapshot_hash
+    monkeypatch.undo()
+
+    db.session.commit()
+    assert db.session.get(AuditJob, job_id) is not None
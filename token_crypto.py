@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+"""Encryption at rest for stored OAuth tokens (Fernet, keyed from the app secret)"""
+
+import os
+import base64
+import hashlib
+import logging
+from typing import Optional
+from cryptography.fernet import Fernet, InvalidToken
+from flask import current_app
+
+def _fernet() -> Fernet:
+    # TOKEN_ENCRYPTION_KEY (a Fernet key) lets the tokens outlive a SESSION_SECRET rotation
+    key = os.environ.get("TOKEN_ENCRYPTION_KEY")
+    if not key:
+        digest = hashlib.sha256(f"stored-tokens:{current_app.secret_key}".encode('utf-8')).digest()
+        key = base64.urlsafe_b64encode(digest)
+    return Fernet(key)
+
+def encrypt_token(token: Optional[str]) -> Optional[str]:
+    if not token:
+        return None
+    return _fernet().encrypt(token.encode('utf-8')).decode('ascii')
+
+def decrypt_token(value: Optional[str]) -> Optional[str]:
+    """The token, or None when there is none or it was encrypted under another key"""
+    if not value:
+        return None
+    try:
+        return _fernet().decrypt(value.encode('ascii')).decode('utf-8')
+    except (InvalidToken, ValueError):
+        logging.warning("Stored token could not be decrypted; the user has to reconnect HubSpot")
+        return None